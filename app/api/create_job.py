@@ -1,10 +1,25 @@
-import concurrent.futures
-from typing import Dict, Tuple
+import asyncio
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 
 from services.job_executor import JobExecutor
-from schema.create_job_schema import MultiInputModel, InputModel, OutputModel
+from services.job_packing import (
+    elapse_seconds,
+    format_elapse,
+    is_packable,
+    plan_packs,
+)
+from services.job_registry import TERMINAL_STATUSES, get_job_registry
+from services.resource_history import resolve_auto_resources
+from services.task_checkpoint import job_checkpoint_path
+from schema.create_job_schema import (
+    MultiInputModel,
+    InputModel,
+    JobSubmissionModel,
+    OutputModel,
+)
+from utils.config import settings
 
 router = APIRouter()
 
@@ -12,6 +27,7 @@ router = APIRouter()
 @router.post("/create-local-job", response_model=OutputModel)
 async def create_local_job(input_model: InputModel) -> OutputModel:
     """ローカルテスト用のエンドポイント"""
+    (input_model,) = await resolve_auto_resources([input_model])
     executor = JobExecutor(input_model)
     try:
         await executor.execute_single_job()
@@ -27,27 +43,143 @@ async def create_local_job(input_model: InputModel) -> OutputModel:
 @router.post("/create-job", response_model=OutputModel)
 async def create_job(input_model: InputModel) -> OutputModel:
     """1つのジョブを投入する."""
+    (input_model,) = await resolve_auto_resources([input_model])
     executor = JobExecutor(input_model)
-    output = executor.submit_job(input_model)
+    output = await executor.submit_job(input_model)
     return output
 
 
-@router.post("/create-multi-job", response_model=Dict[OutputModel, InputModel])
-async def create_jobs(input_models: MultiInputModel) -> Dict[OutputModel, InputModel]:
+@router.post("/jobs/{job_id}/resubmit", response_model=OutputModel)
+async def resubmit_job(job_id: str, elapse: Optional[str] = None) -> OutputModel:
+    """終了したジョブを完了済みのタスク結果を引き継いで再投入する.
+
+    タイムアウト・中断したジョブは完了していないタスクのみを実行する．
+    elapseを指定した場合は経過時間の上限を変更する．
+    """
+    record = get_job_registry().get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} is not registered")
+    if record.job_status not in TERMINAL_STATUSES:
+        raise HTTPException(
+            status_code=409,
+            detail=f"job {job_id} is not finished ({record.job_status})",
+        )
+    input_model = record.input_model
+    if elapse:
+        input_model = input_model.model_copy(update={"elapse": elapse})
+    return await JobExecutor(input_model).resubmit_job(
+        input_model, job_checkpoint_path(record)
+    )
+
+
+@router.post("/create-multi-job", response_model=List[JobSubmissionModel])
+async def create_jobs(input_models: MultiInputModel) -> List[JobSubmissionModel]:
     """複数のジョブを投入する"""
+    # バルク・パックのサブジョブは個別に正常終了を記録しないため結果を再利用できない
+    if (input_models.bulk or input_models.pack) and any(
+        input_model.memoize for input_model in input_models.jobs
+    ):
+        raise HTTPException(
+            status_code=400, detail="memoize cannot be used with bulk or pack"
+        )
+    # 資源指定の"auto"はパック・バルクの計画より前に決める
+    input_models.jobs = await resolve_auto_resources(input_models.jobs)
+    if input_models.pack:
+        results = await submit_packed_jobs(input_models.jobs)
+    elif input_models.bulk:
+        results = await submit_bulk_jobs(input_models.jobs)
+    else:
+        # pjsubの同時実行数はスケジューラコマンド層のセマフォで制限される
+        results = await asyncio.gather(
+            *[
+                JobExecutor(input_model).submit_job(input_model)
+                for input_model in input_models.jobs
+            ]
+        )
+    output_models = [
+        JobSubmissionModel(output=output_model, input=input_model)
+        for input_model, output_model in zip(input_models.jobs, results)
+    ]
+    return output_models
 
-    def execute_wrapper(input_model: InputModel) -> Tuple[InputModel, OutputModel]:
-        executor = JobExecutor(input_model)
-        output_model = executor.submit_job(input_model)
-        return (input_model, output_model)
 
-    output_models = {}
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        result = [
-            executor.submit(execute_wrapper, input_model)
-            for input_model in input_models.jobs
+async def submit_bulk_jobs(input_models: List[InputModel]) -> List[OutputModel]:
+    """資源指定ごとにジョブをまとめ，それぞれを1つのバルクジョブとして投入する."""
+    groups: Dict[Tuple, List[int]] = {}
+    for i, input_model in enumerate(input_models):
+        key = (
+            input_model.resource_group,
+            input_model.node,
+            input_model.vnode_core,
+            input_model.gpu,
+            input_model.elapse,
+        )
+        groups.setdefault(key, []).append(i)
+    group_results = await asyncio.gather(
+        *[
+            JobExecutor(input_models[indices[0]]).submit_bulk_job(
+                [input_models[i] for i in indices]
+            )
+            for indices in groups.values()
         ]
-        for result in concurrent.futures.as_completed(result):
-            result_set = result.result()
-            output_models[result_set[-1]] = result_set[0]
-    return output_models
+    )
+    results = [None] * len(input_models)
+    for indices, outputs in zip(groups.values(), group_results):
+        for i, output in zip(indices, outputs):
+            results[i] = output
+    return results
+
+
+async def submit_packed_jobs(input_models: List[InputModel]) -> List[OutputModel]:
+    """1ノード未満のジョブを少数のパックジョブに詰め込んで投入する.
+
+    パックできないジョブと，1件のみのパックは通常のジョブとして投入する．
+    """
+    packable = [
+        i
+        for i, input_model in enumerate(input_models)
+        if is_packable(input_model, settings.PACK_MAX_CORES)
+    ]
+    # リソースグループごとに詰め込む
+    by_group: Dict[Optional[str], List[int]] = {}
+    for i in packable:
+        by_group.setdefault(input_models[i].resource_group, []).append(i)
+    packs = [
+        (members, pack)
+        for members in by_group.values()
+        for pack in plan_packs(
+            [input_models[i] for i in members],
+            settings.PACK_MAX_CORES,
+            elapse_seconds(settings.PACK_MAX_ELAPSE),
+        )
+    ]
+    groups: List[List[int]] = []
+    coroutines = []
+    for members, pack in packs:
+        indices = [members[i] for i in pack.indices]
+        if len(indices) == 1:
+            continue
+        # パックの資源指定は使用するコア数と計画した経過時間
+        resources = input_models[indices[0]].model_copy(
+            update={"vnode_core": pack.n_cores, "elapse": format_elapse(pack.elapse)}
+        )
+        groups.append(indices)
+        coroutines.append(
+            JobExecutor(resources).submit_packed_job(
+                [input_models[i] for i in indices], pack.cores
+            )
+        )
+    packed = {i for indices in groups for i in indices}
+    singles = [i for i in range(len(input_models)) if i not in packed]
+    groups += [[i] for i in singles]
+    coroutines += [
+        JobExecutor(input_models[i]).submit_job(input_models[i]) for i in singles
+    ]
+    group_results = await asyncio.gather(*coroutines)
+    results = [None] * len(input_models)
+    for indices, outputs in zip(groups, group_results):
+        if not isinstance(outputs, list):
+            outputs = [outputs]
+        for i, output in zip(indices, outputs):
+            results[i] = output
+    return results
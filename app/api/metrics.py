@@ -0,0 +1,50 @@
+import time
+
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import PlainTextResponse
+from starlette.routing import Match
+
+from services.metrics import get_metrics_registry
+
+router = APIRouter()
+
+REQUEST_SECONDS = get_metrics_registry().histogram(
+    "hpcops_http_request_seconds",
+    "Latency of API requests.",
+    ("method", "route", "status"),
+)
+
+
+def route_template(request: Request) -> str:
+    """リクエストに一致するルートのパス. パスパラメータはテンプレートのまま集計する."""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+async def observe_request(request: Request, call_next) -> Response:
+    """APIのレイテンシをルートごとに記録するミドルウェア."""
+    start = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route_template(request),
+            status=status,
+        )
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """サーバーのメトリクスをPrometheusのテキスト形式で取得する."""
+    return PlainTextResponse(
+        get_metrics_registry().render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
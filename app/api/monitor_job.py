@@ -1,9 +1,26 @@
-from typing import List
+import asyncio
+from pathlib import Path
+from typing import List, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 
 from services.job_manager import JobManager
-from schema.monitor_job_schema import JobItems, JobStatusModel
+from services.job_output import LineIndex, job_output_path, read_chunk
+from services.job_packing import parse_packed_job_id
+from services.job_registry import TERMINAL_STATUSES, get_job_registry
+from services.job_timing import read_job_timings
+from services.job_status_stream import get_job_status_broadcaster
+from services.job_status_cache import get_job_status_cache
+from schema.monitor_job_schema import (
+    JobItems,
+    JobOutputModel,
+    JobRecordModel,
+    JobStatusModel,
+    JobTimingsModel,
+    StatusCacheModel,
+)
+from utils.config import settings
 
 router = APIRouter()
 
@@ -11,14 +28,197 @@ router = APIRouter()
 @router.put("/job-status", response_model=List[JobStatusModel])
 async def get_job_status(input_models: JobItems) -> List[JobStatusModel]:
     """ジョブの状態を取得する."""
-    output_models = [
-        JobManager(job_id).get_job_stats() for job_id in input_models.job_ids
-    ]
+    output_models = await get_job_status_cache().get_job_stats(input_models.job_ids)
     return output_models
 
 
 @router.delete("/delete-job", response_model=List[JobStatusModel])
 async def delete_running_job(input_models: JobItems) -> List[JobStatusModel]:
     """実行中のジョブを削除する."""
-    output_models = [JobManager(job_id).delete_job() for job_id in input_models.job_ids]
+    # パックジョブのサブジョブはpjdelで個別に削除できない
+    packed = [job_id for job_id in input_models.job_ids if parse_packed_job_id(job_id)]
+    if packed:
+        raise HTTPException(
+            status_code=400,
+            detail=f"sub jobs of a packed job cannot be deleted: {', '.join(packed)}",
+        )
+    cache = get_job_status_cache()
+    managers = [JobManager(job_id) for job_id in input_models.job_ids]
+    before_del_status = await cache.get_job_stats(input_models.job_ids)
+    targets = [
+        (manager, status)
+        for manager, status in zip(managers, before_del_status)
+        if status.job_id and status.job_status not in TERMINAL_STATUSES
+    ]
+    results = await asyncio.gather(*[manager.run_pjdel() for manager, _ in targets])
+    cache.forget([manager.job_id for manager, _ in targets])
+    after_del_status = await cache.get_job_stats(input_models.job_ids)
+
+    pjdel_results = {manager.job_id: r for (manager, _), r in zip(targets, results)}
+    output_models = []
+    for manager, before, after in zip(managers, before_del_status, after_del_status):
+        if manager.job_id not in pjdel_results:
+            output_models.append(before)
+            continue
+        output_models.append(
+            manager.merge_delete_status(after, pjdel_results[manager.job_id])
+        )
     return output_models
+
+
+@router.get("/job-status/cache", response_model=StatusCacheModel)
+async def get_job_status_cache_stats() -> StatusCacheModel:
+    """ジョブ状態キャッシュのヒット/ミス数を取得する."""
+    return get_job_status_cache().stats()
+
+
+@router.get("/jobs", response_model=List[JobRecordModel])
+async def list_jobs(
+    project: Optional[str] = None,
+    group: Optional[str] = None,
+    jobtype: Optional[str] = None,
+    job_status: Optional[List[str]] = Query(None),
+    limit: int = Query(100, ge=1, le=10000),
+    offset: int = Query(0, ge=0),
+) -> List[JobRecordModel]:
+    """投入済みのジョブをレジストリから検索する."""
+    return get_job_registry().list_jobs(
+        project=project,
+        group=group,
+        jobtype=jobtype,
+        job_status=job_status,
+        limit=limit,
+        offset=offset,
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=JobRecordModel)
+async def get_job(job_id: str) -> JobRecordModel:
+    """投入済みのジョブをレジストリから取得する."""
+    record = get_job_registry().get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} is not registered")
+    return record
+
+
+@router.get("/jobs/{job_id}/timings", response_model=JobTimingsModel)
+async def get_job_timings(job_id: str) -> JobTimingsModel:
+    """ジョブの各フェーズ・タスクの実行時間とワーカーの稼働率を取得する."""
+    record = get_job_registry().get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} is not registered")
+    timings = await asyncio.to_thread(read_job_timings, record)
+    if timings is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} has no timings yet")
+    return JobTimingsModel(
+        job_id=job_id,
+        queue_wait=max(0.0, timings["started_at"] - record.submitted_at),
+        **timings,
+    )
+
+
+async def find_job_output(job_id: str) -> Path:
+    record = get_job_registry().get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} is not registered")
+    path = await asyncio.to_thread(job_output_path, record)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} has no output yet")
+    return path
+
+
+@router.get("/jobs/{job_id}/output", response_model=JobOutputModel)
+async def get_job_output(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    max_bytes: int = Query(settings.LOG_TAIL_MAX_BYTES, ge=1),
+    tail_lines: Optional[int] = Query(None, ge=0),
+) -> JobOutputModel:
+    """ジョブの標準出力をoffsetから読み込む.
+
+    tail_linesを指定した場合はoffsetを無視して末尾の行を返す．
+    レスポンスのnext_offsetを次のoffsetとすることで追記分のみを取得できる．
+    """
+    path = await find_job_output(job_id)
+    max_bytes = min(max_bytes, settings.LOG_TAIL_MAX_BYTES)
+
+    def read() -> JobOutputModel:
+        start = offset
+        if tail_lines is not None:
+            index = LineIndex(path, settings.LOG_INDEX_STRIDE).update()
+            start = index.tail_offset(tail_lines)
+        data, next_offset, size, truncated = read_chunk(path, start, max_bytes)
+        return JobOutputModel(
+            job_id=job_id,
+            offset=next_offset - len(data),
+            next_offset=next_offset,
+            size=size,
+            data=data.decode(errors="replace"),
+            eof=next_offset >= size,
+            truncated=truncated,
+        )
+
+    return await asyncio.to_thread(read)
+
+
+@router.get("/jobs/{job_id}/output/follow")
+async def follow_job_output(
+    request: Request, job_id: str, offset: int = Query(0, ge=0)
+) -> StreamingResponse:
+    """ジョブの標準出力の追記分をoffsetから逐次配信する.
+
+    ジョブが終了し，未送信の出力が無くなった時点で配信を終える．
+    """
+    path = await find_job_output(job_id)
+    registry = get_job_registry()
+
+    async def output_stream():
+        position = offset
+        while not await request.is_disconnected():
+            # 終了の判定を読み込みの前に行い，終了直前の出力を取りこぼさない
+            record = registry.get(job_id)
+            finished = record is None or record.job_status in TERMINAL_STATUSES
+            data, position, size, _ = await asyncio.to_thread(
+                read_chunk, path, position, settings.LOG_TAIL_MAX_BYTES
+            )
+            if data:
+                yield data
+            if position < size:
+                continue
+            if finished:
+                break
+            await asyncio.sleep(settings.LOG_FOLLOW_INTERVAL)
+
+    return StreamingResponse(
+        output_stream(),
+        media_type="text/plain",
+        headers={"X-Output-Offset": str(offset)},
+    )
+
+
+@router.get("/job-status/stream")
+async def stream_job_status(
+    request: Request,
+    job_ids: List[str] = Query([]),
+    project: Optional[str] = None,
+    group: Optional[str] = None,
+    jobtype: Optional[str] = None,
+) -> StreamingResponse:
+    """ジョブの状態遷移をServer-Sent Eventsで配信する."""
+    broadcaster = get_job_status_broadcaster()
+    subscription = broadcaster.subscribe(job_ids, project, group, jobtype)
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), 15)
+                except asyncio.TimeoutError:
+                    # 接続維持のためのコメント行
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: status\ndata: {event.model_dump_json()}\n\n"
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
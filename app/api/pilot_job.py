@@ -0,0 +1,73 @@
+from typing import List
+
+from fastapi import APIRouter
+
+from services.pilot_manager import get_pilot_manager
+from services.resource_history import resolve_auto_resources
+from schema.create_job_schema import InputModel
+from schema.monitor_job_schema import JobItems
+from schema.pilot_job_schema import (
+    PilotCompleteRequest,
+    PilotHeartbeatRequest,
+    PilotLeaseModel,
+    PilotLeaseRequest,
+    PilotPoolModel,
+    PilotReleaseRequest,
+    PilotTaskModel,
+)
+
+router = APIRouter()
+
+
+@router.post("/create-pilot-job", response_model=PilotTaskModel)
+async def create_pilot_job(input_model: InputModel) -> PilotTaskModel:
+    """パイロットジョブ上で実行するジョブをキューに追加する."""
+    (input_model,) = await resolve_auto_resources([input_model])
+    return await get_pilot_manager().enqueue(input_model)
+
+
+@router.put("/pilot-job-status", response_model=List[PilotTaskModel])
+async def get_pilot_job_status(input_models: JobItems) -> List[PilotTaskModel]:
+    """パイロットジョブ上で実行するジョブの状態を取得する."""
+    return get_pilot_manager().get_tasks(input_models.job_ids)
+
+
+@router.get("/pilot/pool", response_model=PilotPoolModel)
+async def get_pilot_pool() -> PilotPoolModel:
+    """パイロットとキューの状態を取得する."""
+    manager = get_pilot_manager()
+    await manager.ensure_capacity()
+    return manager.stats()
+
+
+@router.post("/pilot/lease", response_model=PilotLeaseModel)
+async def lease_pilot_job(request: PilotLeaseRequest) -> PilotLeaseModel:
+    """(パイロット用) 実行するジョブを1つ取得する."""
+    return await get_pilot_manager().lease(
+        request.pilot_id, request.wait, request.walltime
+    )
+
+
+@router.post("/pilot/heartbeat")
+async def heartbeat_pilot(request: PilotHeartbeatRequest) -> dict:
+    """(パイロット用) ジョブの実行中に生存を通知する."""
+    get_pilot_manager().heartbeat(request.pilot_id)
+    return {}
+
+
+@router.post("/pilot/complete")
+async def complete_pilot_job(request: PilotCompleteRequest) -> dict:
+    """(パイロット用) ジョブの終了を通知する."""
+    manager = get_pilot_manager()
+    manager.complete(request.pilot_id, request.task_id, request.status, request.msg)
+    await manager.ensure_capacity()
+    return {}
+
+
+@router.post("/pilot/release")
+async def release_pilot(request: PilotReleaseRequest) -> dict:
+    """(パイロット用) アイドル状態での終了を通知する."""
+    manager = get_pilot_manager()
+    manager.release(request.pilot_id)
+    await manager.ensure_capacity()
+    return {}
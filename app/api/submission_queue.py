@@ -0,0 +1,50 @@
+from typing import List
+
+from fastapi import APIRouter, HTTPException
+
+from services.resource_history import resolve_auto_resources
+from services.submission_queue import get_submission_queue
+from schema.monitor_job_schema import JobItems
+from schema.submission_queue_schema import (
+    SubmissionQueueModel,
+    SubmissionRequest,
+    SubmissionTicketModel,
+)
+from utils.config import settings
+
+router = APIRouter()
+
+
+@router.post(
+    "/submission-queue", status_code=202, response_model=List[SubmissionTicketModel]
+)
+async def enqueue_jobs(request: SubmissionRequest) -> List[SubmissionTicketModel]:
+    """ジョブを投入キューに追加する. ジョブはリソースグループごとの制限内で順に投入される."""
+    # 投入先のリソースグループごとにキューを分けるため，決まらないジョブは受け付けない
+    if not settings.RESOURCE_GROUP and any(
+        not job.resource_group for job in request.jobs
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail="resource_group is required because RESOURCE_GROUP is not set",
+        )
+    jobs = await resolve_auto_resources(request.jobs)
+    return get_submission_queue().enqueue(jobs, request.priority)
+
+
+@router.put("/submission-queue/status", response_model=List[SubmissionTicketModel])
+async def get_ticket_status(input_models: JobItems) -> List[SubmissionTicketModel]:
+    """投入キューに追加したジョブの投入状態を取得する. job_idsにはチケットIDを指定する."""
+    return get_submission_queue().get_tickets(input_models.job_ids)
+
+
+@router.delete("/submission-queue", response_model=List[SubmissionTicketModel])
+async def cancel_tickets(input_models: JobItems) -> List[SubmissionTicketModel]:
+    """待ち状態のジョブを投入キューから取り消す."""
+    return get_submission_queue().cancel(input_models.job_ids)
+
+
+@router.get("/submission-queue/stats", response_model=SubmissionQueueModel)
+async def get_queue_stats() -> SubmissionQueueModel:
+    """投入キューの状態を取得する."""
+    return get_submission_queue().stats()
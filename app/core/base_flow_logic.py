@@ -1,10 +1,226 @@
+import inspect
+import os
 from abc import ABCMeta, abstractmethod
-from typing import Any, List, Dict
+from typing import Any, Callable, List, Dict, Optional
+
+
+# タスクの実行方法. "process": プロセスプール, "thread": スレッドプール,
+# "asyncio": async defのrun_taskをイベントループで並行実行, "inline": driverで順に実行
+EXECUTION_MODES = ("process", "thread", "asyncio", "inline")
 
 
 class BaseFlowLogic(metaclass=ABCMeta):
+    # 同時に実行中とするタスクのチャンク数の上限. Noneの場合はワーカー数の2倍
+    max_in_flight: Optional[int] = None
+    # 1タスクが使用するスレッド数. ワーカー数は割り当てコア数をこの値で割って決まる
+    threads_per_worker: int = 1
+    # 完了したタスクの結果を記録し，ジョブの再実行時に省略するか.
+    # 同じ入力でも毎回実行する必要があるタスクではFalseとする
+    checkpoint_tasks: bool = True
+    # タスクの実行方法(EXECUTION_MODES). Noneの場合はrun_taskがasync defなら"asyncio"，
+    # それ以外は"process"
+    execution_mode: Optional[str] = None
+    # "thread"・"asyncio"での同時実行数. Noneの場合はTASK_CONCURRENCY
+    max_concurrency: Optional[int] = None
+
     def __init__(self, cfg) -> None:
         self.cfg = cfg
+        # 実行時にJobExecutorが設定する. ジョブの一時ディレクトリと並列実行数
+        self.work_dir: Optional[str] = None
+        self.parallelism: int = 1
+        # 実行時に設定されるメトリクスの出力先. logを通して使用する
+        self.sink: Optional[Any] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # 出力先はプロセスごとに設定されるためワーカーへは渡さない
+        state = self.__dict__.copy()
+        state["sink"] = None
+        return state
+
+    def log(self, data: Dict[str, Any], step: Optional[int] = None) -> None:
+        """メトリクスをジョブのrunに記録する.
+
+        ジョブ内の全プロセス(ワーカー・他ノードを含む)の記録はdriverにまとめられ，
+        ジョブごとに1つのrun(またはファイル)へ一定間隔で書き込まれる．
+
+        Args:
+            data (Dict[str, Any]): 記録するメトリクス.
+            step (Optional[int]): ステップ. optunaでは試行番号など.
+        """
+        if self.sink is not None:
+            self.sink.log(data, step)
+
+    def task_execution_mode(self) -> str:
+        """タスクの実行方法.
+
+        I/O待ちの多いタスクや短いタスクでは"thread"・"asyncio"・"inline"とすることで
+        ワーカープロセスの起動とタスク入力・結果のpickleを省略できる．
+        """
+        mode = self.execution_mode
+        if mode is None:
+            mode = (
+                "asyncio" if inspect.iscoroutinefunction(self.run_task) else "process"
+            )
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"unknown execution mode: {mode}")
+        # 別スレッド・別プロセスではコルーチンをawaitできない
+        if mode in ("process", "thread") and inspect.iscoroutinefunction(self.run_task):
+            raise ValueError(f"run_task must not be async def in {mode} mode")
+        return mode
+
+    def is_streaming(self) -> bool:
+        """consume_resultが実装されている場合はタスク結果を逐次処理する."""
+        return type(self).consume_result is not BaseFlowLogic.consume_result
+
+    def stage_dataset(
+        self,
+        name: str,
+        tables: Dict[str, List[Dict[str, Any]]],
+        file_name: Optional[str] = None,
+    ) -> Any:
+        """データセットArtifactを前処理済みの列指向形式で取得する.
+
+        変換はデータセットのバージョンと前処理定義ごとに一度だけ行われ，
+        以降はmmapによりコピーなしで参照される．
+
+        Args:
+            name (str): "<artifact名>:<エイリアス or バージョン>".
+            tables (Dict[str, List[Dict[str, Any]]]): 出力テーブル名と前処理定義.
+            file_name (Optional[str]): Artifact内のpickleファイル名.
+
+        Returns:
+            StagedDataset: テーブル名で参照可能な変換済みデータセット.
+        """
+        from services.dataset_staging import get_dataset_stager
+
+        return get_dataset_stager().stage(
+            self.cfg["project"], name, tables, file_name=file_name
+        )
+
+    def _journal_storage(self, path: str) -> Any:
+        import optuna
+
+        try:
+            from optuna.storages.journal import JournalFileBackend, JournalFileOpenLock
+        except ImportError:
+            from optuna.storages import JournalFileOpenLock
+            from optuna.storages import JournalFileStorage as JournalFileBackend
+
+        # 複数ノードから共有ファイルシステム上で書き込むためflockを使わないロックを使用する
+        return optuna.storages.JournalStorage(
+            JournalFileBackend(path, lock_obj=JournalFileOpenLock(path))
+        )
+
+    def create_study_tasks(
+        self,
+        study_name: str,
+        n_trials: int,
+        direction: str = "maximize",
+        task_input: Optional[Dict[str, Any]] = None,
+        n_parallel: Optional[int] = None,
+        pruner: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """ジョブの一時ディレクトリに共有のoptuna studyを作成し，試行をタスクに分割する.
+
+        task_schedulerの出力として使用する．各タスクはプロセスプール
+        (node > 1の場合は全ノード)で並列に実行され，同じstudyに試行を追加する．
+        バルクジョブではサブジョブごとに別のstudyとなる．
+
+        Args:
+            study_name (str): studyの名前.
+            n_trials (int): 全タスク合計の試行回数.
+            direction (str): 最適化の方向.
+            task_input (Optional[Dict[str, Any]]): 各タスクに共通して渡す入力.
+            n_parallel (Optional[int]): 分割数. 省略時はジョブの並列実行数.
+            pruner (Optional[str]): "median", "hyperband" または "none".
+                省略時はoptunaの既定(MedianPruner).
+
+        Returns:
+            List[Dict[str, Any]]: "study"キーに試行の割り当てを持つタスク入力のリスト.
+        """
+        import optuna
+
+        # バルクジョブのサブジョブは一時ディレクトリを共有するため，
+        # パラメータの異なるサブジョブの試行が混ざらないようサブジョブごとに分ける
+        bulk_num = os.getenv("PJM_BULKNUM")
+        journal = study_name if bulk_num is None else f"{study_name}_{bulk_num}"
+        storage_path = os.path.join(self.work_dir, f"{journal}.journal")
+        optuna.create_study(
+            study_name=study_name,
+            storage=self._journal_storage(storage_path),
+            direction=direction,
+            load_if_exists=True,
+        )
+        self._pruner(pruner)
+        n_parallel = max(1, min(n_parallel or self.parallelism, n_trials))
+        counts = [
+            n_trials // n_parallel + (1 if i < n_trials % n_parallel else 0)
+            for i in range(n_parallel)
+        ]
+        return [
+            dict(
+                **(task_input or {}),
+                study={
+                    "study_name": study_name,
+                    "storage": storage_path,
+                    "n_trials": n,
+                    "pruner": pruner,
+                },
+            )
+            for n in counts
+        ]
+
+    def _pruner(self, name: Optional[str]) -> Any:
+        import optuna
+
+        if name is None:
+            return None
+        pruners = {
+            "median": optuna.pruners.MedianPruner,
+            "hyperband": optuna.pruners.HyperbandPruner,
+            "none": optuna.pruners.NopPruner,
+        }
+        if name not in pruners:
+            raise ValueError(f"unknown pruner: {name}")
+        return pruners[name]()
+
+    def load_study(self, study: Dict[str, Any]) -> Any:
+        """create_study_tasksで作成したstudyを読み込む.
+
+        全タスクの試行は同じストレージに記録されるため，
+        create_resultではいずれか1つのタスク結果から全試行を含むstudyが得られる．
+
+        Args:
+            study (Dict[str, Any]): タスク入力の"study"の値.
+
+        Returns:
+            optuna.Study: 読み込んだstudy.
+        """
+        import optuna
+
+        return optuna.load_study(
+            study_name=study["study_name"],
+            storage=self._journal_storage(study["storage"]),
+            # 並列実行中の試行が同じ点を探索しないようにする
+            sampler=optuna.samplers.TPESampler(constant_liar=True),
+            # 目的関数がtrial.reportした途中経過をもとに見込みの薄い試行を打ち切る
+            pruner=self._pruner(study.get("pruner")),
+        )
+
+    def optimize_study(
+        self, study: Dict[str, Any], objective: Callable
+    ) -> Dict[str, Any]:
+        """タスクに割り当てられた回数の試行を実行する. run_task内で使用する.
+
+        Args:
+            study (Dict[str, Any]): タスク入力の"study"の値.
+            objective (Callable): optunaの目的関数.
+
+        Returns:
+            Dict[str, Any]: create_resultでload_studyに渡すstudyの情報.
+        """
+        self.load_study(study).optimize(objective, n_trials=study["n_trials"])
+        return study
 
     @abstractmethod
     async def task_scheduler(self) -> List[Dict[str, Any]]:
@@ -19,6 +235,8 @@ class BaseFlowLogic(metaclass=ABCMeta):
     def run_task(self, **kwargs) -> Any:
         """Job内で実行するタスクの内容を記述.
 
+        async defで定義した場合は"asyncio"の実行方法で実行される．
+
         Args:
             **kwargs: task_schedulerの出力リスト内のDictが渡される.
 
@@ -27,6 +245,17 @@ class BaseFlowLogic(metaclass=ABCMeta):
         """
         return NotImplementedError
 
+    async def consume_result(self, result: Any) -> None:
+        """(任意) タスク結果を完了順に1つずつ処理する.
+
+        実装した場合，タスク結果は保持されずに完了するたびに渡され，
+        全タスク完了後のcreate_resultには空のリストが渡される．
+
+        Args:
+            result (Any): run_taskの出力.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     async def create_result(self, result_set: List[Any]) -> None:
         """Job内でタスク実行後にwandbに出力する.
@@ -1,11 +1,22 @@
 import asyncio
+import os
 import pickle
 import sys
 
 from services.job_executor import JobExecutor
+from services.result_cache import done_marker
 
 
 if __name__ == "__main__":
     with open(sys.argv[1], "rb") as f:
-        job_executor = JobExecutor(pickle.load(f))
+        input_model = pickle.load(f)
+    # バルクジョブではバルク番号に対応するInputModelを使用する
+    bulk = isinstance(input_model, list)
+    if bulk:
+        input_model = input_model[int(os.environ["PJM_BULKNUM"])]
+    work_dir = os.path.dirname(sys.argv[1])
+    job_executor = JobExecutor(input_model, work_dir=work_dir)
     asyncio.run(job_executor.execute_single_job())
+    # 正常終了を記録し，メモ化で結果を再利用できるようにする
+    if not bulk:
+        done_marker(work_dir).touch()
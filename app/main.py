@@ -1,8 +1,14 @@
+import asyncio
+
 import uvicorn
 import yaml
 from fastapi import FastAPI
 
-from api import create_job, monitor_job
+from api import create_job, metrics, monitor_job, pilot_job, submission_queue
+from services.job_registry import get_job_registry, reconcile_forever
+from services.pilot_manager import get_pilot_manager
+from services.submission_queue import get_submission_queue
+from utils.config import settings
 
 
 app = FastAPI(
@@ -13,6 +19,42 @@ app = FastAPI(
 # routerを読み込む
 app.include_router(create_job.router)
 app.include_router(monitor_job.router)
+app.include_router(pilot_job.router)
+app.include_router(submission_queue.router)
+app.include_router(metrics.router)
+# APIのレイテンシを記録する
+app.middleware("http")(metrics.observe_request)
+
+
+@app.on_event("startup")
+async def start_reconciler() -> None:
+    # ジョブレジストリの状態を1つのバックグラウンドタスクでまとめて更新する
+    app.state.reconciler = asyncio.create_task(
+        reconcile_forever(get_job_registry(), settings.JOB_REGISTRY_INTERVAL)
+    )
+
+
+@app.on_event("startup")
+async def start_submission_queue() -> None:
+    # 投入キューのジョブを制限内で順に投入する
+    app.state.submission_queue = asyncio.create_task(
+        get_submission_queue().run_forever(settings.SUBMIT_QUEUE_INTERVAL)
+    )
+
+
+@app.on_event("startup")
+async def start_pilot_manager() -> None:
+    # 終了・応答の途絶えたパイロットを取り除き，実行中だったジョブをキューに戻す
+    app.state.pilot_manager = asyncio.create_task(
+        get_pilot_manager().run_forever(settings.PILOT_PRUNE_INTERVAL)
+    )
+
+
+@app.on_event("shutdown")
+async def stop_reconciler() -> None:
+    app.state.reconciler.cancel()
+    app.state.submission_queue.cancel()
+    app.state.pilot_manager.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,19 @@
+import multiprocessing
+import sys
+
+from services.distributed_executor import worker_main
+
+
+if __name__ == "__main__":
+    # 引数: driverのホスト ポート ノード番号 ワーカー数
+    host, port, node_id, n_workers = sys.argv[1:5]
+    workers = [
+        multiprocessing.Process(
+            target=worker_main, args=(host, int(port), int(node_id))
+        )
+        for _ in range(int(n_workers))
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
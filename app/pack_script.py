@@ -0,0 +1,120 @@
+import os
+import pickle
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from services.job_packing import (
+    JST,
+    elapse_seconds,
+    read_sub_status,
+    sub_job_dir,
+    write_sub_status,
+)
+from utils.config import settings
+
+
+def launch(sub_dir: str, cpus: List[int]) -> subprocess.Popen:
+    """サブジョブを割り当てたCPUに固定して起動する."""
+    env = dict(os.environ, PJM_VNODE_CORE=str(len(cpus)))
+    with open(Path(sub_dir) / "result.out", "w") as out:
+        return subprocess.Popen(
+            [
+                sys.executable,
+                str(Path(settings.BASE_DIR_PATH) / "app/job_script.py"),
+                str(Path(sub_dir) / "input.pkl"),
+            ],
+            cwd=settings.BASE_DIR_PATH,
+            env=env,
+            stdout=out,
+            stderr=subprocess.STDOUT,
+            preexec_fn=lambda: os.sched_setaffinity(0, cpus),
+            # 経過時間の超過時にワーカープロセスごと終了できるようにする
+            start_new_session=True,
+        )
+
+
+def reap(running: Dict[int, Any], busy: set) -> None:
+    """終了したサブジョブの状態を記録し，コアを解放する.
+
+    経過時間の上限(サブジョブのelapse)を超えたサブジョブはプロセスグループごと
+    終了し，"ERR"とする．後続のサブジョブがパックジョブのelapseを超えないようにする．
+    """
+    for sub_num, (proc, sub_job, sub_dir, deadline) in list(running.items()):
+        state = "EXT"
+        update: Dict[str, Any] = {}
+        if proc.poll() is None:
+            if time.monotonic() < deadline:
+                continue
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            proc.wait()
+            state = "ERR"
+            update["reason"] = f"elapse {sub_job['input_model'].elapse} exceeded"
+        del running[sub_num]
+        busy -= set(sub_job["cores"])
+        write_sub_status(
+            sub_dir,
+            **dict(
+                read_sub_status(sub_dir),
+                state=state,
+                exit_code=proc.returncode,
+                **update,
+            ),
+        )
+
+
+def main(pkl_path: str, poll_interval: float = 1.0) -> None:
+    """パックジョブ内のサブジョブを計画した順序・コアで並行して実行する.
+
+    サブジョブは割り当てたコアが全て空いた時点で起動し，経過時間の上限で終了する．
+    各サブジョブの状態はサブジョブのディレクトリの状態ファイルに記録する．
+    """
+    with open(pkl_path, "rb") as f:
+        sub_jobs = pickle.load(f)
+    tmp_dir = os.path.dirname(pkl_path)
+    for sub_job in sub_jobs:
+        sub_dir = sub_job_dir(tmp_dir, sub_job["sub_num"])
+        os.makedirs(sub_dir, exist_ok=True)
+        with open(Path(sub_dir) / "input.pkl", "wb") as f:
+            pickle.dump(sub_job["input_model"], f)
+        write_sub_status(sub_dir, state="QUE", cores=sub_job["cores"])
+
+    # パック内のコア番号を実際に割り当てられたCPUに対応させる
+    allowed = sorted(os.sched_getaffinity(0))
+    busy: set = set()
+    running: Dict[int, Any] = {}
+    for sub_job in sub_jobs:
+        # 計画より後のサブジョブが追い越さないよう，順に割り当てコアの解放を待つ
+        while busy & set(sub_job["cores"]):
+            time.sleep(poll_interval)
+            reap(running, busy)
+        sub_dir = sub_job_dir(tmp_dir, sub_job["sub_num"])
+        cpus = [allowed[c % len(allowed)] for c in sub_job["cores"]]
+        deadline = time.monotonic() + elapse_seconds(sub_job["input_model"].elapse)
+        running[sub_job["sub_num"]] = (
+            launch(sub_dir, cpus),
+            sub_job,
+            sub_dir,
+            deadline,
+        )
+        busy |= set(sub_job["cores"])
+        write_sub_status(
+            sub_dir,
+            state="RUN",
+            cores=sub_job["cores"],
+            start_date=datetime.now(JST).strftime("%Y/%m/%d %H:%M:%S"),
+        )
+    while running:
+        time.sleep(poll_interval)
+        reap(running, busy)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
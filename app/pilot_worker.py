@@ -0,0 +1,142 @@
+import asyncio
+import json
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import urllib.request
+from typing import Optional
+
+from schema.create_job_schema import InputModel
+from services.job_executor import JobExecutor
+from services.job_packing import elapse_seconds
+from utils.config import settings
+
+# サーバーへのリクエストが失敗した場合の再送間隔(秒)の初期値と上限
+RETRY_INTERVAL = 1.0
+MAX_RETRY_INTERVAL = 60.0
+
+
+def post(server_url: str, endpoint: str, body: dict, timeout: float) -> dict:
+    request = urllib.request.Request(
+        server_url + endpoint,
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as r:
+        return json.loads(r.read() or b"{}")
+
+
+async def post_with_retry(
+    server_url: str, endpoint: str, body: dict, timeout: float, deadline: float
+) -> Optional[dict]:
+    """サーバーの一時的なエラー・再起動に備え，間隔を広げながら成功するまで再送する.
+
+    deadline(time.monotonic()の値)までに成功しない場合はNoneを返す．
+    """
+    interval = RETRY_INTERVAL
+    while True:
+        try:
+            return await asyncio.to_thread(post, server_url, endpoint, body, timeout)
+        except (OSError, ValueError) as e:
+            if time.monotonic() + interval > deadline:
+                print(f"failed to post {endpoint}: {e}")
+                return None
+            print(f"failed to post {endpoint}: {e}. retry in {interval:.0f}s")
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_RETRY_INTERVAL)
+
+
+async def heartbeat(server_url: str, pilot_id: str) -> None:
+    """ジョブの実行中，サーバーに一定間隔で生存を通知する."""
+    while True:
+        await asyncio.sleep(settings.PILOT_HEARTBEAT_INTERVAL)
+        try:
+            await asyncio.to_thread(
+                post, server_url, "/pilot/heartbeat", {"pilot_id": pilot_id}, 30
+            )
+        except Exception as e:
+            print(f"failed to send heartbeat: {e}")
+
+
+async def main(
+    server_url: str, pilot_id: str, idle_timeout: float, elapse: Optional[str] = None
+) -> None:
+    """サーバーからジョブを取得してプロセス内で実行する.
+
+    flow logicとデータセットはプロセス内・Artifactキャッシュに保持されるため，
+    2件目以降のジョブは起動コストなしで実行される．
+    アイドル時間がidle_timeoutを超えると終了し，割り当て資源を返却する．
+    パイロットの経過時間の上限(elapse)までの残り時間内に終わるジョブのみ取得する．
+    ジョブはサーバーが作成した一時ディレクトリで実行し，実行時間等はサーバーが集計する．
+    """
+    started = time.monotonic()
+    end = started + elapse_seconds(elapse) if elapse else None
+    idle_since = started
+    while time.monotonic() - idle_since < idle_timeout:
+        walltime = None
+        if elapse:
+            walltime = elapse_seconds(elapse) - (time.monotonic() - started)
+            if walltime <= 0:
+                break
+        wait = min(30.0, idle_timeout - (time.monotonic() - idle_since))
+        # サーバーが応答しない間もアイドル時間に含める
+        lease = await post_with_retry(
+            server_url,
+            "/pilot/lease",
+            {"pilot_id": pilot_id, "wait": wait, "walltime": walltime},
+            wait + 30,
+            idle_since + idle_timeout,
+        )
+        if not lease or not lease.get("task_id"):
+            continue
+        print(f"Start task {lease['task_id']}")
+        # 一時ディレクトリを返さないサーバーではパイロット内に作成し，終了後に削除する
+        work_dir = lease.get("work_dir") or tempfile.mkdtemp(prefix="hpc-ops-")
+        beat = asyncio.create_task(heartbeat(server_url, pilot_id))
+        try:
+            input_model = InputModel(**lease["input_model"])
+            await JobExecutor(input_model, work_dir=work_dir).execute_single_job()
+            status, msg = 0, "Pilot job is successfuly completed"
+        except Exception:
+            status, msg = 1, traceback.format_exc()
+            print(msg)
+        finally:
+            beat.cancel()
+            if not lease.get("work_dir"):
+                shutil.rmtree(work_dir, ignore_errors=True)
+        # 通知できない場合もサーバーは応答の無いパイロットとしてジョブをキューに戻す
+        await post_with_retry(
+            server_url,
+            "/pilot/complete",
+            {
+                "pilot_id": pilot_id,
+                "task_id": lease["task_id"],
+                "status": status,
+                "msg": msg,
+            },
+            30,
+            end or time.monotonic() + settings.PILOT_LOST_AFTER,
+        )
+        idle_since = time.monotonic()
+    try:
+        post(server_url, "/pilot/release", {"pilot_id": pilot_id}, 30)
+    except (OSError, ValueError) as e:
+        print(f"failed to release pilot: {e}")
+    print(f"Pilot {pilot_id} is idle or reached its elapse. exit")
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as f:
+        pilot_config = pickle.load(f)
+    asyncio.run(
+        main(
+            pilot_config["server_url"],
+            pilot_config["pilot_id"],
+            pilot_config["idle_timeout"],
+            pilot_config.get("elapse"),
+        )
+    )
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 from pydantic import BaseModel, Field
 
 
@@ -6,16 +6,20 @@ class InputModel(BaseModel):
     node: Optional[int] = Field(
         None, description="ノード数の指定（１ノード以上の資源を使用する場合に必須）"
     )
-    vnode_core: Optional[int] = Field(
+    vnode_core: Optional[Union[int, Literal["auto"]]] = Field(
         1,
-        description="コア数の指定（ノードグループAで１ノード未満の資源を利用する場合に必須）",
+        description="コア数の指定（ノードグループAで１ノード未満の資源を利用する場合に必須）. 'auto'の場合は過去の実績から決める",
     )
     gpu: Optional[int] = Field(
         None,
         description="GPU数の指定（ノードグループB,Cで１ノード未満の資源を利用する場合に必須）",
     )
     elapse: Optional[str] = Field(
-        "01:00:00", description="ジョブの実行時間の上限を指定"
+        "01:00:00",
+        description="ジョブの実行時間の上限を指定. 'auto'の場合は過去の実績から決める",
+    )
+    resource_group: Optional[str] = Field(
+        None, description="投入先のリソースグループ. 省略時はRESOURCE_GROUP"
     )
     params: Optional[dict] = Field({}, description="実験に関するパラメータ設定")
     project: str = Field("hpc-ops", description="wandbのプロジェクト名")
@@ -26,13 +30,38 @@ class InputModel(BaseModel):
         "sample_flow_logic:latest",
         description="wandbに保存したflow logicファイルの使用バージョン",
     )
+    memoize: bool = Field(
+        False,
+        description="同一の実験(flow logic, params, 入力Artifact)の結果があれば再投入せずに再利用する",
+    )
+    input_artifacts: List[str] = Field(
+        ["dataset"],
+        description="入力Artifact名を値に持つparamsのキー. メモ化ではダイジェストで比較する",
+    )
 
 
 class MultiInputModel(BaseModel):
     jobs: List[InputModel] = Field([], description="投入するジョブ情報のリスト")
+    bulk: bool = Field(
+        False,
+        description="資源指定が共通のジョブをPJMのバルクジョブとしてまとめて投入する",
+    )
+    pack: bool = Field(
+        False,
+        description="1ノード未満のジョブをコア数と経過時間から少数の割り当てに詰め込んで投入する",
+    )
 
 
 class OutputModel(BaseModel):
     status: int = Field(0, description="ジョブの投入処理レスポンス")
     msg: str = Field("", description="ジョブの投入処理メッセージ")
     job_id: str = Field("", description="ジョブID")
+    memoized: str = Field(
+        "",
+        description="メモ化された結果('hit': 正常終了済のジョブ, 'attached': 実行中のジョブ)",
+    )
+
+
+class JobSubmissionModel(BaseModel):
+    output: OutputModel = Field(..., description="サブジョブの投入結果")
+    input: InputModel = Field(..., description="サブジョブに対応するジョブ情報")
@@ -1,7 +1,9 @@
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
+from schema.create_job_schema import InputModel
+
 
 class JobItems(BaseModel):
     job_ids: List[str] = Field([""], description="状態を取得するジョブIDのリスト")
@@ -22,3 +24,80 @@ class JobStatusModel(BaseModel):
     vnode: str = Field("", description="VNODE")
     core: str = Field("", description="コア数")
     v_mem: str = Field("", description="V_MEM")
+
+
+class StatusCacheModel(BaseModel):
+    hits: int = Field(0, description="スナップショットから応答した回数")
+    misses: int = Field(0, description="スナップショットを更新した回数")
+    refreshes: int = Field(0, description="pjstatの実行回数")
+    history_queries: int = Field(0, description="pjstat -Hの実行回数")
+    running_jobs: int = Field(0, description="スナップショット内のジョブ数")
+    history_jobs: int = Field(0, description="保持している終了済ジョブ数")
+    ttl: float = Field(0.0, description="スナップショットの有効期間(秒)")
+
+
+class JobRecordModel(BaseModel):
+    job_id: str = Field("", description="JOB_ID")
+    project: str = Field("", description="wandbのプロジェクト名")
+    group: Optional[str] = Field(None, description="wandbのプロジェクトグループ")
+    jobtype: Optional[str] = Field(None, description="wandbのプロジェクトジョブタイプ")
+    run: Optional[str] = Field(None, description="wandbのプロジェクトラン")
+    flow_logic: str = Field("", description="flow logicの使用バージョン")
+    input_model: InputModel = Field(..., description="投入時のジョブ情報")
+    tmp_dir: str = Field("", description="ジョブの一時ディレクトリ")
+    job_status: str = Field(
+        "",
+        description="最後に確認したジョブの状態('SUBMITTED': 確認前, 'UNKNOWN': 追跡不能, その他はpjstatの状態)",
+    )
+    submitted_at: float = Field(0.0, description="投入時刻(UNIX時間)")
+    updated_at: float = Field(0.0, description="状態の更新時刻(UNIX時間)")
+
+
+class JobStatusEventModel(BaseModel):
+    job_id: str = Field("", description="JOB_ID")
+    previous_status: str = Field("", description="遷移前のジョブの状態")
+    job_status: str = Field("", description="遷移後のジョブの状態")
+    job_name: str = Field("", description="JOB_NAME")
+    start_date: str = Field("", description="ジョブの開始時刻")
+    elapse_lim: str = Field("", description="ジョブタイムアウトまでの残り時間")
+
+
+class JobTimingsModel(BaseModel):
+    job_id: str = Field("", description="JOB_ID")
+    status: str = Field(
+        "", description="ジョブの終了状態('ok': 正常終了, 'error': 異常終了)"
+    )
+    started_at: float = Field(0.0, description="ジョブの開始時刻(UNIX時間)")
+    finished_at: float = Field(0.0, description="ジョブの終了時刻(UNIX時間)")
+    queue_wait: float = Field(0.0, description="投入から開始までの待ち時間(秒)")
+    phases: Dict[str, float] = Field({}, description="フェーズごとの実行時間(秒)")
+    flow_logic: str = Field("", description="実行したflow logicのダイジェスト")
+    cpu_seconds: Dict[str, float] = Field(
+        {}, description="フェーズごとのCPU時間(秒). 他ノードのワーカーは含まない"
+    )
+    max_rss_mb: float = Field(0.0, description="ジョブの最大常駐メモリ(MB)")
+    n_workers: int = Field(0, description="タスクを実行したワーカー数")
+    tasks: Dict[str, float] = Field({}, description="タスクの実行時間(秒)の要約統計量")
+    utilization: float = Field(0.0, description="run_tasks中のワーカーの稼働率")
+    workers: Dict[str, Dict[str, float]] = Field(
+        {}, description="ワーカーごとのタスク数・稼働時間(秒)・稼働率"
+    )
+    n_stragglers: int = Field(0, description="中央値の2倍以上の時間がかかったタスク数")
+    stragglers: List[Dict[str, Any]] = Field(
+        [], description="実行時間の長いストラグラー(タスク番号・ワーカー・実行時間)"
+    )
+    task_seconds: List[Optional[float]] = Field(
+        [], description="タスク番号順のタスクの実行時間(秒)"
+    )
+
+
+class JobOutputModel(BaseModel):
+    job_id: str = Field("", description="JOB_ID")
+    offset: int = Field(0, description="読み込みを開始したバイトオフセット")
+    next_offset: int = Field(0, description="次の読み込みを開始するバイトオフセット")
+    size: int = Field(0, description="読み込み時の出力ファイルのサイズ(バイト)")
+    data: str = Field("", description="読み込んだ出力")
+    eof: bool = Field(False, description="ファイルの末尾まで読み込んだか")
+    truncated: bool = Field(
+        False, description="ファイルがoffsetより小さくなり先頭から読み直したか"
+    )
@@ -0,0 +1,62 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from schema.create_job_schema import InputModel
+
+
+class PilotTaskModel(BaseModel):
+    task_id: str = Field("", description="パイロットジョブ上で実行するジョブのID")
+    status: int = Field(0, description="リクエスト結果のステータス")
+    state: str = Field(
+        "",
+        description="ジョブの状態('QUEUED': 待ち状態, 'RUNNING': 実行中, 'DONE': 正常終了, 'FAILED': 異常終了)",
+    )
+    msg: str = Field("", description="リクエストに対するレスポンスメッセージ")
+    pilot_id: str = Field("", description="ジョブを実行したパイロットのID")
+    tmp_dir: str = Field("", description="ジョブの一時ディレクトリ")
+
+
+class PilotLeaseRequest(BaseModel):
+    pilot_id: str = Field(..., description="パイロットのID")
+    wait: float = Field(30.0, description="キューが空の場合に待機する最大時間(秒)")
+    walltime: Optional[float] = Field(
+        None,
+        description="パイロットの残りの経過時間(秒). 指定した場合は時間内に終わるジョブのみ割り当てる",
+    )
+
+
+class PilotHeartbeatRequest(BaseModel):
+    pilot_id: str = Field(..., description="ジョブを実行中のパイロットのID")
+
+
+class PilotLeaseModel(BaseModel):
+    task_id: str = Field(
+        "", description="割り当てられたジョブのID. 空の場合は割り当てなし"
+    )
+    input_model: Optional[InputModel] = Field(None, description="実行するジョブ情報")
+    work_dir: str = Field(
+        "", description="ジョブの一時ディレクトリ. 実行時間・メトリクス等を出力する"
+    )
+
+
+class PilotCompleteRequest(BaseModel):
+    pilot_id: str = Field(..., description="パイロットのID")
+    task_id: str = Field(..., description="完了したジョブのID")
+    status: int = Field(0, description="ジョブの終了ステータス")
+    msg: str = Field("", description="ジョブの終了メッセージ")
+
+
+class PilotReleaseRequest(BaseModel):
+    pilot_id: str = Field(..., description="アイドル状態で終了するパイロットのID")
+
+
+class PilotPoolModel(BaseModel):
+    pilots: int = Field(0, description="投入済みのパイロット数")
+    active_pilots: int = Field(0, description="サーバーに接続済みのパイロット数")
+    queued: int = Field(0, description="待ち状態のジョブ数")
+    running: int = Field(0, description="実行中のジョブ数")
+    pool_size: int = Field(0, description="パイロット数の上限")
+    idle_timeout: float = Field(
+        0.0, description="パイロットが終了するまでのアイドル時間(秒)"
+    )
@@ -0,0 +1,45 @@
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+from schema.create_job_schema import InputModel, OutputModel
+
+
+class SubmissionRequest(BaseModel):
+    jobs: List[InputModel] = Field([], description="投入するジョブ情報のリスト")
+    priority: Literal["high", "normal", "low"] = Field(
+        "normal", description="優先度. 上位の優先度のジョブから投入される"
+    )
+
+
+class SubmissionTicketModel(BaseModel):
+    ticket_id: str = Field("", description="投入キュー内のジョブのID")
+    status: int = Field(0, description="リクエスト結果のステータス")
+    state: str = Field(
+        "",
+        description="投入の状態('QUEUED': 待ち状態, 'SUBMITTING': 投入中, 'SUBMITTED': 投入済, 'FAILED': 投入失敗, 'CANCELLED': 取り消し)",
+    )
+    priority: str = Field("normal", description="優先度")
+    project: str = Field("", description="wandbのプロジェクト名")
+    resource_group: str = Field("", description="投入先のリソースグループ")
+    attempts: int = Field(0, description="pjsubの実行回数")
+    msg: str = Field("", description="リクエストに対するレスポンスメッセージ")
+    output: Optional[OutputModel] = Field(None, description="ジョブの投入結果")
+
+
+class SubmissionGroupModel(BaseModel):
+    queued: int = Field(0, description="待ち状態のジョブ数")
+    in_flight: int = Field(0, description="投入中・未終了のジョブ数")
+    max_in_flight: int = Field(0, description="未終了のジョブ数の上限")
+    tokens: float = Field(0.0, description="投入可能なジョブ数(トークン数)")
+    paused_for: float = Field(0.0, description="投入を再開するまでの時間(秒)")
+
+
+class SubmissionQueueModel(BaseModel):
+    groups: Dict[str, SubmissionGroupModel] = Field(
+        {}, description="リソースグループごとの状態"
+    )
+    queued: Dict[str, int] = Field({}, description="優先度ごとの待ち状態のジョブ数")
+    submitted: int = Field(0, description="投入したジョブ数")
+    failed: int = Field(0, description="投入に失敗したジョブ数")
+    retries: int = Field(0, description="一時的な拒否により再投入した回数")
@@ -0,0 +1,133 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING, Iterator
+from uuid import uuid4
+
+from utils.config import settings
+
+if TYPE_CHECKING:
+    import wandb
+
+
+class ArtifactCache:
+    """wandb Artifactをダイジェスト単位で保持するローカルキャッシュ.
+
+    同一ダイジェストのダウンロードはファイルロックにより高々1回となり，
+    エイリアス(":latest"等)からダイジェストへの解決はTTL内で再利用される．
+    """
+
+    def __init__(self, root: str, alias_ttl: float) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.root = Path(root)
+        self.alias_ttl = alias_ttl
+        os.makedirs(self.root, exist_ok=True)
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[None]:
+        with open(self.root / f"{name}.lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _artifact(self, project: str, name: str) -> "wandb.Artifact":
+        # wandbのimportは時間がかかるため，キャッシュに無い場合のみimportする
+        import wandb
+
+        api = wandb.Api(api_key=settings.WANDB_APIKEY)
+        return api.artifact(f"{project}/{name}")
+
+    def resolve(self, project: str, name: str) -> str:
+        """Artifact名(エイリアス付き)をダイジェストに解決する.
+
+        Args:
+            project (str): wandbのプロジェクト名.
+            name (str): "<artifact名>:<エイリアス or バージョン>".
+
+        Returns:
+            str: Artifactのダイジェスト.
+        """
+        key = f"{project}/{name}"
+        index_path = self.root / "aliases.json"
+        with self.lock("aliases"):
+            index = json.loads(index_path.read_text()) if index_path.exists() else {}
+            entry = index.get(key)
+            if entry and time.time() - entry["resolved_at"] < self.alias_ttl:
+                return entry["digest"]
+            digest = self._artifact(project, name).digest
+            index[key] = {"digest": digest, "resolved_at": time.time()}
+            tmp_path = self.root / f"aliases.{uuid4()}.json"
+            tmp_path.write_text(json.dumps(index))
+            os.replace(tmp_path, index_path)
+        self._logger.info(f"artifact {key} is resolved to {digest}")
+        return digest
+
+    def fetch(self, project: str, name: str) -> Path:
+        """Artifactをキャッシュから取得する. 未取得の場合のみダウンロードする.
+
+        Args:
+            project (str): wandbのプロジェクト名.
+            name (str): "<artifact名>:<エイリアス or バージョン>".
+
+        Returns:
+            Path: Artifactのファイルを格納したディレクトリ.
+        """
+        digest = self.resolve(project, name)
+        artifact_dir = self.root / digest
+        if (artifact_dir / ".complete").exists():
+            return artifact_dir
+        with self.lock(digest):
+            if (artifact_dir / ".complete").exists():
+                return artifact_dir
+            artifact = self._artifact(project, name)
+            # 解決後にエイリアスが更新された場合は実際のダイジェストで保存する
+            artifact_dir = self.root / artifact.digest
+            # 途中で失敗しても不完全なディレクトリを参照しないよう一時領域に展開する
+            tmp_dir = self.root / f"{artifact.digest}.{uuid4()}.tmp"
+            artifact.download(root=str(tmp_dir))
+            (tmp_dir / ".complete").touch()
+            if artifact_dir.exists():
+                shutil.rmtree(artifact_dir)
+            os.replace(tmp_dir, artifact_dir)
+        self._logger.info(f"artifact {project}/{name} is downloaded to {artifact_dir}")
+        return artifact_dir
+
+    def import_module(self, project: str, name: str) -> ModuleType:
+        """Artifact内のPythonファイルをバージョン固有のモジュール名でimportする.
+
+        Args:
+            project (str): wandbのプロジェクト名.
+            name (str): "<ファイル名>:<エイリアス or バージョン>".
+
+        Returns:
+            ModuleType: importしたモジュール.
+        """
+        artifact_dir = self.fetch(project, name)
+        base_name = name.split(":")[0]
+        module_name = f"flow_logic_{artifact_dir.name[:16]}.{base_name}"
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+        spec = spec_from_file_location(module_name, artifact_dir / f"{base_name}.py")
+        module = module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        return module
+
+
+@lru_cache
+def get_artifact_cache() -> ArtifactCache:
+    return ArtifactCache(
+        root=settings.ARTIFACT_CACHE_DIR,
+        alias_ttl=settings.ARTIFACT_ALIAS_TTL,
+    )
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+import numpy as np
+import pandas as pd
+
+from services.artifact_cache import ArtifactCache, get_artifact_cache
+
+
+def _select(obj: Any, key: str) -> Any:
+    return obj[key]
+
+
+def _get_dummies(obj: Any, **kwargs) -> pd.DataFrame:
+    return pd.get_dummies(obj, **kwargs)
+
+
+def _equals(obj: Any, value: Any) -> np.ndarray:
+    return (np.asarray(obj) == value).astype(np.int64)
+
+
+def _astype(obj: Any, dtype: str) -> Any:
+    return obj.astype(dtype)
+
+
+def _fillna(obj: Any, value: Any) -> Any:
+    return obj.fillna(value)
+
+
+# 宣言的に指定できる前処理. {"op": <名前>, **引数}の形式で指定する
+PREPROCESS_STEPS: Dict[str, Callable[..., Any]] = {
+    "select": _select,
+    "get_dummies": _get_dummies,
+    "equals": _equals,
+    "astype": _astype,
+    "fillna": _fillna,
+}
+
+
+class StagedDataset:
+    """列指向で保存したデータセットをmmapで参照するオブジェクト.
+
+    各テーブルはFortran順(列連続)の.npyとして保存されており，
+    array/frameはファイルをコピーせず読み取り専用のmmapとして返す．
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.meta: Dict[str, Dict[str, Any]] = json.loads(
+            (self.path / "meta.json").read_text()
+        )
+
+    @property
+    def tables(self) -> List[str]:
+        return list(self.meta)
+
+    def array(self, name: str) -> np.ndarray:
+        return np.load(self.path / f"{name}.npy", mmap_mode="r")
+
+    def frame(self, name: str) -> pd.DataFrame:
+        return pd.DataFrame(
+            self.array(name), columns=self.meta[name]["columns"], copy=False
+        )
+
+    def __getitem__(self, name: str) -> Any:
+        if self.meta[name]["columns"] is None:
+            return self.array(name)
+        return self.frame(name)
+
+
+class DatasetStager:
+    """データセットArtifactを前処理済みの列指向形式に一度だけ変換する.
+
+    変換結果はArtifactのダイジェストと前処理定義のハッシュで識別され，
+    同一の組み合わせに対する以降のジョブ・タスクは変換済みファイルを共有する．
+    """
+
+    def __init__(self, artifact_cache: ArtifactCache) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.artifact_cache = artifact_cache
+        self.root = artifact_cache.root / "staged"
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def apply_steps(obj: Any, steps: List[Dict[str, Any]]) -> Any:
+        """前処理定義を順に適用する."""
+        for step in steps:
+            step = dict(step)
+            obj = PREPROCESS_STEPS[step.pop("op")](obj, **step)
+        return obj
+
+    @staticmethod
+    def _write_table(path: Path, obj: Any) -> Dict[str, Any]:
+        columns = None
+        if isinstance(obj, pd.DataFrame):
+            columns = [str(c) for c in obj.columns]
+            obj = obj.to_numpy()
+        elif isinstance(obj, pd.Series):
+            obj = obj.to_numpy()
+        arr = np.asfortranarray(np.asarray(obj))
+        if arr.dtype == object:
+            raise ValueError(f"table {path.stem} has object dtype and cannot be mapped")
+        np.save(path, arr)
+        return {"columns": columns, "dtype": str(arr.dtype), "shape": list(arr.shape)}
+
+    def stage(
+        self,
+        project: str,
+        name: str,
+        tables: Dict[str, List[Dict[str, Any]]],
+        file_name: Optional[str] = None,
+    ) -> StagedDataset:
+        """データセットArtifactを変換し，変換済みデータセットを返す.
+
+        Args:
+            project (str): wandbのプロジェクト名.
+            name (str): "<artifact名>:<エイリアス or バージョン>".
+            tables (Dict[str, List[Dict[str, Any]]]): 出力テーブル名と前処理定義.
+                例: {"y": [{"op": "select", "key": "target"},
+                {"op": "equals", "value": ">50K"}]}
+            file_name (Optional[str]): Artifact内のpickleファイル名.
+                省略時は"<artifact名>.pkl".
+
+        Returns:
+            StagedDataset: mmapで参照可能な変換済みデータセット.
+        """
+        file_name = file_name or f"{name.split(':')[0]}.pkl"
+        digest = self.artifact_cache.resolve(project, name)
+        spec = json.dumps({"file": file_name, "tables": tables}, sort_keys=True)
+        key = f"{digest}-{hashlib.sha256(spec.encode()).hexdigest()[:16]}"
+        staged_dir = self.root / key
+        if (staged_dir / "meta.json").exists():
+            return StagedDataset(staged_dir)
+        with self.artifact_cache.lock(f"staged-{key}"):
+            if (staged_dir / "meta.json").exists():
+                return StagedDataset(staged_dir)
+            artifact_dir = self.artifact_cache.fetch(project, name)
+            with open(artifact_dir / file_name, "rb") as f:
+                data = pickle.load(f)
+            tmp_dir = self.root / f"{key}.{uuid4()}.tmp"
+            os.makedirs(tmp_dir)
+            meta = {
+                table: self._write_table(
+                    tmp_dir / f"{table}.npy", self.apply_steps(data, steps)
+                )
+                for table, steps in tables.items()
+            }
+            # meta.jsonの存在を変換完了の印とする
+            (tmp_dir / "meta.json").write_text(json.dumps(meta))
+            if staged_dir.exists():
+                shutil.rmtree(staged_dir)
+            os.replace(tmp_dir, staged_dir)
+        self._logger.info(f"dataset {project}/{name} is staged to {staged_dir}")
+        return StagedDataset(staged_dir)
+
+
+def get_dataset_stager() -> DatasetStager:
+    return DatasetStager(get_artifact_cache())
@@ -0,0 +1,369 @@
+import asyncio
+import logging
+import os
+import pickle
+import socket
+import struct
+import sys
+import time
+import traceback
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from core.base_flow_logic import BaseFlowLogic
+from services.job_timing import JobTimings
+from services.log_sink import WorkerLog, set_wandb_apikey
+from services.task_checkpoint import TaskCheckpoint
+from services.task_dispatch import ChunkSizer, pin_blas_threads
+from utils.config import settings
+
+# メッセージは「8byteの長さ + pickle」の形式で送受信する
+HEADER = struct.Struct("!Q")
+LOCAL_HOSTS = ("localhost", "127.0.0.1")
+
+
+class ObjectRef:
+    """ワーカーへ一度だけ送信した大きなタスク入力への参照."""
+
+    def __init__(self, key: int) -> None:
+        self.key = key
+
+
+async def send_message(writer: asyncio.StreamWriter, message: Any) -> None:
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+
+async def recv_message(reader: asyncio.StreamReader) -> Any:
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def _send(sock: socket.socket, message: Any) -> None:
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        data = sock.recv(size - len(buf))
+        if not data:
+            raise ConnectionError("connection closed by driver")
+        buf += data
+    return bytes(buf)
+
+
+def _recv(sock: socket.socket) -> Any:
+    (size,) = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return pickle.loads(_recv_exact(sock, size))
+
+
+def pjm_hosts() -> List[str]:
+    """PJMが割り当てたノードのホスト名一覧を取得する."""
+    nodeinf = os.getenv("PJM_O_NODEINF")
+    if not nodeinf or not os.path.exists(nodeinf):
+        return []
+    with open(nodeinf) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_flow_logic(
+    project: str, flow_logic_name: str, payload: bytes
+) -> BaseFlowLogic:
+    """driverから受け取ったflow logicを復元する.
+
+    flow logicのモジュールが未importの場合はArtifactキャッシュからimportする．
+    """
+    try:
+        return pickle.loads(payload)
+    except (ModuleNotFoundError, AttributeError):
+        from services.artifact_cache import get_artifact_cache
+
+        get_artifact_cache().import_module(project, flow_logic_name)
+        return pickle.loads(payload)
+
+
+def worker_main(host: str, port: int, node_id: int) -> None:
+    """ノード上の1ワーカープロセス. driverからタスクを取得して実行する."""
+    set_wandb_apikey()
+    sock = socket.create_connection((host, port))
+    _send(sock, ("hello", node_id, os.getpid()))
+    _, project, flow_logic_name, payload, blas_threads = _recv(sock)
+    pin_blas_threads(blas_threads)
+    flow_logic = load_flow_logic(project, flow_logic_name, payload)
+    # メトリクスはタスクの結果と同じ接続でdriverへ送る
+    flow_logic.sink = WorkerLog(
+        lambda records: _send(sock, ("log", records)), settings.LOG_FLUSH_INTERVAL
+    )
+    objects: Dict[int, Any] = {}
+    _send(sock, ("get",))
+    while True:
+        message = _recv(sock)
+        if message[0] == "done":
+            break
+        _, indices, task_inputs, new_objects = message
+        objects.update(new_objects)
+        start = time.perf_counter()
+        results, durations = [], []
+        try:
+            for task_input in task_inputs:
+                task_start = time.perf_counter()
+                results.append(
+                    flow_logic.run_task(
+                        **{
+                            key: objects[value.key]
+                            if isinstance(value, ObjectRef)
+                            else value
+                            for key, value in task_input.items()
+                        }
+                    )
+                )
+                durations.append(time.perf_counter() - task_start)
+        except Exception:
+            flow_logic.sink.flush()
+            _send(sock, ("error", traceback.format_exc()))
+            break
+        flow_logic.sink.flush()
+        _send(
+            sock, ("result", indices, results, time.perf_counter() - start, durations)
+        )
+    sock.close()
+
+
+class DistributedExecutor:
+    """複数ノードにワーカーを起動し，TCP経由でタスクを分配する.
+
+    タスクは最初にノードごとの連続した区間に分割され，自ノードの区間を
+    消化したワーカーは残りタスクが最も多いノードの末尾から奪って実行する．
+    大きな配列・DataFrameはワーカーごとに一度だけ送信される．
+    """
+
+    def __init__(
+        self,
+        hosts: List[str],
+        workers_per_node: int,
+        blas_threads: int,
+        launcher: str,
+        min_bytes: int,
+        timings: Optional[JobTimings] = None,
+        checkpoint: Optional[TaskCheckpoint] = None,
+    ) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.hosts = hosts
+        self.workers_per_node = workers_per_node
+        self.blas_threads = blas_threads
+        self.launcher = launcher
+        self.min_bytes = min_bytes
+        self.timings = timings
+        self.checkpoint = checkpoint
+
+    def _is_local(self, host: str) -> bool:
+        return host in LOCAL_HOSTS or host == socket.gethostname()
+
+    def _advertised_host(self) -> str:
+        if all(host in LOCAL_HOSTS for host in self.hosts):
+            return "127.0.0.1"
+        return socket.gethostname()
+
+    def _share(self, task_inputs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """大きなタスク入力をObjectRefに置き換える."""
+        self._objects: Dict[int, Any] = {}
+        # import済みの場合のみ型を判定し，numpy/pandasのimportを避ける
+        np, pd = sys.modules.get("numpy"), sys.modules.get("pandas")
+        shared_inputs = []
+        for task_input in task_inputs:
+            shared_input = {}
+            for key, value in task_input.items():
+                if np is not None and isinstance(value, np.ndarray):
+                    nbytes = value.nbytes
+                elif pd is not None and isinstance(value, pd.DataFrame):
+                    nbytes = value.memory_usage(index=False).sum()
+                else:
+                    nbytes = 0
+                if nbytes >= self.min_bytes:
+                    self._objects[id(value)] = value
+                    value = ObjectRef(id(value))
+                shared_input[key] = value
+            shared_inputs.append(shared_input)
+        return shared_inputs
+
+    def _take(self, node_id: int) -> List[int]:
+        """ノードが次に実行するタスクを取り出す. 自ノードの分が無ければ他ノードから奪う."""
+        queue = self._queues[node_id % len(self._queues)]
+        stolen = False
+        if not queue:
+            queue = max(self._queues, key=len)
+            stolen = True
+        if not queue:
+            return []
+        size = self._sizer.next_size(sum(len(q) for q in self._queues))
+        if stolen:
+            return [queue.pop() for _ in range(min(size, len(queue)))]
+        return [queue.popleft() for _ in range(min(size, len(queue)))]
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        in_flight: List[int] = []
+        _, node_id, pid = await recv_message(reader)
+        try:
+            await send_message(writer, self._init_message)
+            sent_keys = set()
+            while not self._done.is_set():
+                message = await recv_message(reader)
+                if message[0] == "log":
+                    if self._flow_logic.sink is not None:
+                        self._flow_logic.sink.extend(message[1])
+                    continue
+                if message[0] == "error":
+                    self._error = RuntimeError(
+                        f"task failed on node {node_id} (pid {pid}):\n{message[1]}"
+                    )
+                    self._done.set()
+                    break
+                if message[0] == "result":
+                    _, indices, results, elapsed, durations = message
+                    in_flight = []
+                    self._sizer.record(len(results), elapsed)
+                    if self.timings is not None:
+                        self.timings.record_tasks(
+                            f"{node_id}:{pid}", indices, durations
+                        )
+                    if self.checkpoint is not None:
+                        self.checkpoint.record(indices, results)
+                    for result in results:
+                        if self._streaming:
+                            await self._flow_logic.consume_result(result)
+                        else:
+                            self._results.append(result)
+                    self._remaining -= len(results)
+                    if self._remaining == 0:
+                        self._done.set()
+                    if self._done.is_set():
+                        break
+                indices = self._take(node_id)
+                while not indices and not self._done.is_set():
+                    # 他ワーカーの障害で再投入されるタスクを待つ
+                    async with self._requeued:
+                        try:
+                            await asyncio.wait_for(self._requeued.wait(), 1.0)
+                        except asyncio.TimeoutError:
+                            pass
+                    indices = self._take(node_id)
+                if not indices:
+                    break
+                in_flight = indices
+                task_inputs = [self._inputs[i] for i in indices]
+                keys = {
+                    value.key
+                    for task_input in task_inputs
+                    for value in task_input.values()
+                    if isinstance(value, ObjectRef)
+                }
+                new_objects = {key: self._objects[key] for key in keys - sent_keys}
+                sent_keys |= keys
+                await send_message(writer, ("task", indices, task_inputs, new_objects))
+            await send_message(writer, ("done",))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self._logger.error(f"worker on node {node_id} (pid {pid}) is lost: {e}")
+            if in_flight:
+                self._queues[node_id % len(self._queues)].extend(in_flight)
+                async with self._requeued:
+                    self._requeued.notify_all()
+        finally:
+            writer.close()
+
+    async def _launch(self, host: str, node_id: int, address: str, port: int):
+        command = [
+            sys.executable,
+            str(Path(settings.BASE_DIR_PATH) / "app/node_worker.py"),
+            address,
+            str(port),
+            str(node_id),
+            str(self.workers_per_node),
+        ]
+        if not self._is_local(host):
+            command = [self.launcher, host, *command]
+        self._logger.info(f"command: {command}")
+        return await asyncio.create_subprocess_exec(*command)
+
+    async def run(
+        self,
+        flow_logic: BaseFlowLogic,
+        task_inputs: List[Dict[str, Any]],
+        flow_logic_id: Tuple[str, str],
+    ) -> List[Any]:
+        """全ノードでタスクを実行する.
+
+        Args:
+            flow_logic (BaseFlowLogic): 実行するflow logic.
+            task_inputs (List[Dict[str, Any]]): パラメータを結合済みのタスク入力.
+            flow_logic_id (Tuple[str, str]): wandbのプロジェクト名とflow logic名.
+                リモートのワーカーがflow logicをimportするために使用する.
+
+        Returns:
+            List[Any]: タスク結果. consume_resultを実装している場合は空のリスト.
+        """
+        self._flow_logic = flow_logic
+        self._streaming = flow_logic.is_streaming()
+        self._inputs = self._share(task_inputs)
+        self._results: List[Any] = []
+        self._remaining = len(task_inputs)
+        self._error: Optional[Exception] = None
+        self._done = asyncio.Event()
+        self._requeued = asyncio.Condition()
+        self._init_message = (
+            "init",
+            *flow_logic_id,
+            pickle.dumps(flow_logic, protocol=pickle.HIGHEST_PROTOCOL),
+            self.blas_threads,
+        )
+        n_nodes = len(self.hosts)
+        block = -(-len(task_inputs) // n_nodes)
+        self._queues: List[Deque[int]] = [
+            deque(range(i * block, min((i + 1) * block, len(task_inputs))))
+            for i in range(n_nodes)
+        ]
+        self._sizer = ChunkSizer(
+            n_nodes * self.workers_per_node,
+            settings.TASK_CHUNK_SECONDS,
+            settings.TASK_MAX_CHUNK,
+        )
+        if not task_inputs:
+            return []
+
+        server = await asyncio.start_server(self._handle, "0.0.0.0", 0)
+        port = server.sockets[0].getsockname()[1]
+        address = self._advertised_host()
+        procs = [
+            await self._launch(host, node_id, address, port)
+            for node_id, host in enumerate(self.hosts)
+        ]
+        waiter = asyncio.ensure_future(asyncio.gather(*[proc.wait() for proc in procs]))
+        try:
+            await asyncio.wait(
+                [asyncio.ensure_future(self._done.wait()), waiter],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not self._done.is_set():
+                raise RuntimeError("all node workers exited before tasks completed")
+            if self._error:
+                raise self._error
+        finally:
+            server.close()
+            async with self._requeued:
+                self._requeued.notify_all()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), 30)
+            except asyncio.TimeoutError:
+                for proc in procs:
+                    if proc.returncode is None:
+                        proc.kill()
+        self._logger.info(
+            f"{len(task_inputs)} tasks are executed on {n_nodes} nodes "
+            f"in {self._sizer.n_chunks} chunks"
+        )
+        return self._results
@@ -1,26 +1,51 @@
+import asyncio
 import concurrent.futures
+import inspect
 import logging
 import pickle
 import os
 import subprocess
 import sys
-from importlib import import_module
+import tempfile
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import uuid4
 
-import pandas as pd
-import wandb
-
 from core.base_flow_logic import BaseFlowLogic
 from schema.create_job_schema import InputModel, OutputModel
+from services.artifact_cache import get_artifact_cache
+from services.distributed_executor import DistributedExecutor, pjm_hosts
+from services.job_packing import JST, packed_job_id, sub_job_dir
+from services.job_registry import get_job_registry
+from services.job_timing import JobTimings, timings_path
+from services.log_sink import LogBuffer, create_log_sink, set_wandb_apikey
+from services.result_cache import get_result_cache
+from services.scheduler_command import get_scheduler_command
+from services.shared_task_input import SharedTaskInputs, init_worker, run_shared_chunk
+from services.task_checkpoint import TaskCheckpoint, checkpoint_path, copy_checkpoint
+from services.task_dispatch import ChunkSizer, granted_cores
 from utils.config import settings
 
 sys.path.append(settings.BASE_DIR_PATH)
 
 
+def create_tmp_dir(job_number: str) -> str:
+    """投入時刻とジョブ番号から一時ディレクトリを作成する."""
+    ts_str = datetime.now(JST).strftime("%Y%m%d%H%M%S")
+    tmp_dir = str(Path(settings.BASE_DIR_PATH) / Path(f"tmp/{ts_str}_{job_number}/"))
+    os.makedirs(tmp_dir, exist_ok=True)
+    return tmp_dir
+
+
 class JobExecutor:
-    def __init__(self, input_model: InputModel) -> None:
+    def __init__(self, input_model: InputModel, work_dir: Optional[str] = None) -> None:
         self._logger = logging.getLogger("uvicorn")
+        self.input_model = input_model
+        # ジョブの一時ディレクトリ(計算ノード上での実行時のみ)
+        self.work_dir = work_dir
         self.cfg = input_model.model_dump()
         self.wandb_apikey = settings.WANDB_APIKEY
         self.params = input_model.params
@@ -31,86 +56,525 @@ class JobExecutor:
         self.run_name = input_model.run
         # flow logicのバージョン
         self.flow_logic_name = input_model.flow_logic
+        # ジョブ内の各フェーズ・タスクの実行時間
+        self.timings = JobTimings()
 
-    def submit_job(self, input_model: InputModel) -> OutputModel:
-        """1つのジョブを投入する."""
-        self._logger.info("Start to submit job")
+    def _prepare_job(
+        self, payload: Any, script: str = "app/job_script.py"
+    ) -> Tuple[str, str, str, str]:
+        """ジョブの一時ディレクトリに入力ファイルとジョブスクリプトを作成する.
+
+        Args:
+            payload (Any): job_script.pyに渡すInputModel(バルクジョブではそのリスト).
+            script (str): ジョブで実行するPythonスクリプトのパス.
+
+        Returns:
+            Tuple[str, str, str, str]: ジョブ番号, 一時ディレクトリ, 入力ファイル,
+                ジョブスクリプトのパス.
+        """
         job_number = str(uuid4())
-        ts_str = pd.Timestamp.now(tz="Asia/Tokyo").strftime("%Y%m%d%H%M%S")
-        tmp_dir = str(
-            Path(settings.BASE_DIR_PATH) / Path(f"tmp/{ts_str}_{job_number}/")
-        )
-        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_dir = create_tmp_dir(job_number)
         pkl_path = str(Path(tmp_dir) / Path(f"tmp_{job_number}.pkl"))
         with open(pkl_path, "wb") as f:
-            pickle.dump(input_model, f)
-        py_path = str(Path(settings.BASE_DIR_PATH) / Path("app/job_script.py"))
+            pickle.dump(payload, f)
+        py_path = str(Path(settings.BASE_DIR_PATH) / Path(script))
         sh_path = str(Path(tmp_dir) / Path(f"job_{job_number}.sh"))
         with open(sh_path, "w") as f:
             f.writelines([f"cd {settings.BASE_DIR_PATH}\n"])
             f.writelines([f"python {py_path} {pkl_path}"])
         self._logger.info("InputModel info:")
-        self._logger.info(f"\tInputModel: {input_model}")
+        self._logger.info(f"\tInputModel: {payload}")
         self._logger.info(f"\tInputModel path: {pkl_path}")
         self._logger.info("path info:")
         self._logger.info(f"\tpy script path: {py_path}")
         self._logger.info(f"\tsh script path: {sh_path}")
+        return job_number, tmp_dir, pkl_path, sh_path
 
-        command = ["pjsub", "-L", f"rscgrp={settings.RESOURCE_GROUP}"]
+    @staticmethod
+    def resource_option(input_model: InputModel) -> str:
+        """pjsubの-Lオプションに渡す資源指定を作成する."""
+        option = f"rscgrp={input_model.resource_group or settings.RESOURCE_GROUP}"
         if input_model.node:
-            command[-1] += f",node={input_model.node}"
+            option += f",node={input_model.node}"
         if input_model.vnode_core:
-            command[-1] += f",vnode-core={input_model.vnode_core}"
+            option += f",vnode-core={input_model.vnode_core}"
         if input_model.gpu:
-            command[-1] += f",gpu={input_model.gpu}"
+            option += f",gpu={input_model.gpu}"
         if input_model.elapse:
-            command[-1] += f",elapse={input_model.elapse}"
+            option += f",elapse={input_model.elapse}"
+        return option
+
+    async def _pjsub(
+        self, command: List[str], cwd: Optional[str] = None
+    ) -> Tuple[subprocess.CompletedProcess, str]:
+        """pjsubを実行し，実行結果と採番されたジョブIDを返す."""
+        # タイムアウト後の再実行は二重投入となり得るためリトライしない
+        r = await get_scheduler_command().run(command, retry_on_timeout=False, cwd=cwd)
+        job_id = r.stdout.split(" ")[-2] if r.stdout else ""
+        if not job_id:
+            self._logger.error(f"submit error: {r.stdout}{r.stderr}")
+        return r, job_id
+
+    async def submit_job(self, input_model: InputModel) -> OutputModel:
+        """1つのジョブを投入する.
+
+        memoizeが指定された場合，同一の実験の正常終了済・実行中のジョブがあれば
+        投入せずにそのジョブの投入結果を返す．
+        """
+        if input_model.memoize:
+            return await get_result_cache().submit(
+                input_model, lambda: self._submit_job(input_model)
+            )
+        return await self._submit_job(input_model)
+
+    async def _submit_job(
+        self, input_model: InputModel, checkpoint: Optional[Path] = None
+    ) -> OutputModel:
+        self._logger.info("Start to submit job")
+        job_number, tmp_dir, _, sh_path = self._prepare_job(input_model)
+        # 再投入では以前のジョブの完了済みのタスク結果を引き継ぐ
+        if checkpoint is not None and copy_checkpoint(checkpoint, tmp_dir):
+            self._logger.info(f"\tcheckpoint: {checkpoint}")
+
+        command = ["pjsub", "-L", self.resource_option(input_model)]
         log_path = str(Path(tmp_dir) / Path(f"result_{job_number}.out"))
         self._logger.info(f"\tstdout path: {log_path}")
         command += ["-j", "-o", log_path, sh_path]
 
-        self._logger.info(f"command: {command}")
-        r = subprocess.run(command, stdout=subprocess.PIPE, text=True)
-        job_id = r.stdout.split(" ")[-2] if r.stdout else ""
+        r, job_id = await self._pjsub(command)
         msg = r.stdout
         if not job_id:
-            msg += "(submit error)"
-            self._logger.error(f"submit error: {r.stdout}")
+            msg += r.stderr + "(submit error)"
         response = OutputModel(status=r.returncode, msg=msg, job_id=job_id)
+        get_job_registry().record(input_model, response, tmp_dir)
         return response
 
+    async def resubmit_job(
+        self, input_model: InputModel, checkpoint: Path
+    ) -> OutputModel:
+        """終了したジョブを完了済みのタスク結果を引き継いで再投入する.
+
+        結果キャッシュは使用せず，常に新しいジョブとして投入する．
+
+        Args:
+            input_model (InputModel): 再投入するジョブ情報.
+            checkpoint (Path): 以前のジョブのタスク結果のファイル.
+        """
+        return await self._submit_job(input_model, checkpoint)
+
+    async def submit_bulk_job(
+        self, input_models: List[InputModel]
+    ) -> List[OutputModel]:
+        """資源指定が共通の複数ジョブを1つのバルクジョブとして投入する.
+
+        ジョブスクリプトと入力ファイルは全サブジョブで共有し，
+        job_script.pyがバルク番号(PJM_BULKNUM)に対応するInputModelを選択する．
+
+        Args:
+            input_models (List[InputModel]): 投入するジョブ情報のリスト.
+                資源指定はこのJobExecutorのInputModelのものが使用される.
+
+        Returns:
+            List[OutputModel]: input_modelsと同じ順序のサブジョブの投入結果.
+        """
+        self._logger.info(f"Start to submit bulk job ({len(input_models)} sub jobs)")
+        _, tmp_dir, _, sh_path = self._prepare_job(list(input_models))
+
+        command = ["pjsub", "-L", self.resource_option(self.input_model)]
+        # 標準出力はサブジョブごとに一時ディレクトリへ出力される
+        command += ["-j", "--bulk", "--sparam", f"0-{len(input_models) - 1}"]
+        command += [sh_path]
+
+        r, job_id = await self._pjsub(command, cwd=tmp_dir)
+        if not job_id:
+            msg = r.stdout + r.stderr + "(submit error)"
+            return [OutputModel(status=r.returncode, msg=msg) for _ in input_models]
+        outputs = [
+            OutputModel(status=r.returncode, msg=r.stdout, job_id=f"{job_id}[{i}]")
+            for i in range(len(input_models))
+        ]
+        for input_model, output in zip(input_models, outputs):
+            get_job_registry().record(input_model, output, tmp_dir)
+        return outputs
+
+    async def submit_packed_job(
+        self, input_models: List[InputModel], cores: List[List[int]]
+    ) -> List[OutputModel]:
+        """小さな複数ジョブを1つの割り当てにまとめたパックジョブとして投入する.
+
+        サブジョブはpack_script.pyにより割り当てたコアに固定して並行実行され，
+        "<job_id>.<サブジョブ番号>"のIDで個別に状態を取得できる．
+        資源指定はこのJobExecutorのInputModelのものが使用される．
+
+        Args:
+            input_models (List[InputModel]): 計画した開始順のサブジョブ情報.
+            cores (List[List[int]]): サブジョブごとに割り当てたパック内のコア番号.
+
+        Returns:
+            List[OutputModel]: input_modelsと同じ順序のサブジョブの投入結果.
+        """
+        self._logger.info(f"Start to submit packed job ({len(input_models)} sub jobs)")
+        sub_jobs = [
+            {"sub_num": i, "input_model": input_model, "cores": sub_cores}
+            for i, (input_model, sub_cores) in enumerate(zip(input_models, cores))
+        ]
+        job_number, tmp_dir, _, sh_path = self._prepare_job(
+            sub_jobs, script="app/pack_script.py"
+        )
+        command = ["pjsub", "-L", self.resource_option(self.input_model)]
+        log_path = str(Path(tmp_dir) / Path(f"result_{job_number}.out"))
+        command += ["-j", "-o", log_path, sh_path]
+
+        r, job_id = await self._pjsub(command)
+        if not job_id:
+            msg = r.stdout + r.stderr + "(submit error)"
+            return [OutputModel(status=r.returncode, msg=msg) for _ in input_models]
+        outputs = [
+            OutputModel(
+                status=r.returncode, msg=r.stdout, job_id=packed_job_id(job_id, i)
+            )
+            for i in range(len(input_models))
+        ]
+        for i, (input_model, output) in enumerate(zip(input_models, outputs)):
+            get_job_registry().record(input_model, output, sub_job_dir(tmp_dir, i))
+        return outputs
+
+    async def submit_pilot_job(self, pilot_config: Dict[str, Any]) -> OutputModel:
+        """ウォームワーカーを常駐させるパイロットジョブを投入する.
+
+        Args:
+            pilot_config (Dict[str, Any]): pilot_worker.pyに渡す設定.
+
+        Returns:
+            OutputModel: パイロットジョブの投入結果.
+        """
+        self._logger.info("Start to submit pilot job")
+        job_number, tmp_dir, _, sh_path = self._prepare_job(
+            pilot_config, script="app/pilot_worker.py"
+        )
+        command = ["pjsub", "-L", self.resource_option(self.input_model)]
+        log_path = str(Path(tmp_dir) / Path(f"result_{job_number}.out"))
+        command += ["-j", "-o", log_path, sh_path]
+        r, job_id = await self._pjsub(command)
+        msg = r.stdout if job_id else r.stdout + r.stderr + "(submit error)"
+        return OutputModel(status=r.returncode, msg=msg, job_id=job_id)
+
     async def execute_single_job(self) -> None:
         """シングルジョブの実行"""
-        # wandbログイン
-        wandb.login(key=self.wandb_apikey)
-        expt_size_dict = {"project": self.project_name}
-        if self.group_name:
-            expt_size_dict["group"] = self.group_name
-        if self.jobtype_name:
-            expt_size_dict["job_type"] = self.jobtype_name
-        # flow logicの取得
-        download_path = str(Path(settings.BASE_DIR_PATH) / Path("dl_logics"))
-        run = wandb.init(**expt_size_dict, name="fetch-flow-logic")
-        fl_artifact = run.use_artifact(self.flow_logic_name)
-        fl_artifact.download(root=download_path)
-        run.finish()
-        flow_logic: BaseFlowLogic = import_module(
-            f"dl_logics.{self.flow_logic_name.split(':')[0]}"
-        ).MyFlowLogic(self.cfg)
-
-        # タスクの入力を取得
-        task_inputs = await flow_logic.task_scheduler()
-        print("Successfuly get task inputs")
-        # タスクを実行
+        timings = self.timings
+        work_dir = self.work_dir or tempfile.mkdtemp(prefix="hpc-ops-")
+        bulk_num = os.getenv("PJM_BULKNUM")
+        status = "error"
+        try:
+            with timings.phase("load_flow_logic"):
+                # wandbの認証情報. flow logicのimport時にwandbを使用する場合に備え先に設定する
+                set_wandb_apikey()
+                # flow logicの取得(ダイジェスト単位でキャッシュし，バージョンごとにimportする)
+                flow_logic_module = get_artifact_cache().import_module(
+                    self.project_name, self.flow_logic_name
+                )
+                flow_logic: BaseFlowLogic = flow_logic_module.MyFlowLogic(self.cfg)
+                # 実行時間の履歴をflow logicのバージョンごとに集計するために記録する
+                timings.flow_logic = get_artifact_cache().resolve(
+                    self.project_name, self.flow_logic_name
+                )
+            flow_logic.work_dir = work_dir
+            flow_logic.parallelism = self.parallelism(flow_logic)
+            timings.n_workers = flow_logic.parallelism
+            timings.cores = granted_cores(self.input_model)
+            if flow_logic.task_execution_mode() == "process":
+                _, timings.cores_per_task = self.pool_size(flow_logic)
+            # ジョブ全体で1つのrunにメトリクスをまとめて書き込む
+            flow_logic.sink = LogBuffer(
+                create_log_sink(self.cfg, flow_logic.work_dir),
+                settings.LOG_FLUSH_INTERVAL,
+            )
+            try:
+                # タスクの入力を取得
+                with timings.phase("task_scheduler"):
+                    task_inputs = await flow_logic.task_scheduler()
+                print("Successfuly get task inputs")
+                # タスクを実行
+                with timings.phase("run_tasks"):
+                    task_results = await self.run_tasks(flow_logic, task_inputs)
+                print("Successfuly complete tasks")
+                # ジョブの結果をwandbに出力
+                with timings.phase("create_result"):
+                    await flow_logic.create_result(task_results)
+                print("Successfuly save results")
+            finally:
+                with timings.phase("close_log_sink"):
+                    flow_logic.sink.close()
+                timings.dropped_metrics = flow_logic.sink.n_dropped
+            status = "ok"
+        finally:
+            timings.phases["total"] = time.time() - timings.started_at
+            try:
+                timings.write(
+                    timings_path(work_dir, int(bulk_num) if bulk_num else None),
+                    status,
+                )
+            except OSError as e:
+                self._logger.error(f"failed to write job timings: {e}")
+
+    def pool_size(self, flow_logic: BaseFlowLogic) -> Tuple[int, int]:
+        """1ノードあたりのワーカー数とワーカーごとのBLASスレッド数を決める."""
+        cores = granted_cores(self.input_model)
+        n_workers = max(1, cores // flow_logic.threads_per_worker)
+        blas_threads = max(1, cores // n_workers)
+        self._logger.info(
+            f"{cores} cores granted: {n_workers} workers x {blas_threads} threads"
+        )
+        return n_workers, blas_threads
+
+    def parallelism(self, flow_logic: BaseFlowLogic) -> int:
+        """ジョブ全体でタスクを同時に実行する数."""
+        mode = flow_logic.task_execution_mode()
+        if mode == "inline":
+            return 1
+        if mode in ("thread", "asyncio"):
+            return flow_logic.max_concurrency or settings.TASK_CONCURRENCY
+        n_workers, _ = self.pool_size(flow_logic)
+        return n_workers * max(1, len(self.hosts()))
+
+    def hosts(self) -> List[str]:
+        """タスクを実行するノードの一覧. 1ノードの場合は空のリスト."""
+        hosts = pjm_hosts() if (self.input_model.node or 1) > 1 else []
+        return hosts if len(hosts) > 1 else []
+
+    async def run_tasks(
+        self, flow_logic: BaseFlowLogic, task_inputs: List[Dict[str, Any]]
+    ) -> List[Any]:
+        """割り当てられたコア数に合わせたプロセスプールでタスクを実行する.
+
+        タスクは実行時間に応じて自動調整されるチャンク単位で投入され，
+        大きな配列は共有メモリに一度だけ配置してワーカーにはハンドルのみ渡す．
+        node > 1の場合はPJMのホスト一覧(PJM_O_NODEINF)の全ノードで実行する．
+        完了したタスクの結果はジョブの一時ディレクトリに記録され，
+        タイムアウト等で再実行されたジョブは完了済みのタスクを実行しない．
+
+        Args:
+            flow_logic (BaseFlowLogic): 実行するflow logic.
+            task_inputs (List[Dict[str, Any]]): task_schedulerの出力.
+
+        Returns:
+            List[Any]: タスク結果. consume_resultを実装している場合は空のリスト.
+        """
+        task_inputs = [dict(**param, **self.params) for param in task_inputs]
+        streaming = flow_logic.is_streaming()
         task_results = []
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            result = [
-                executor.submit(flow_logic.run_task, **dict(**param, **self.params))
-                for param in task_inputs
-            ]
-            for result in concurrent.futures.as_completed(result):
-                task_results.append(result.result())
-        print("Successfuly complete tasks")
-        # ジョブの結果をwandbに出力
-        await flow_logic.create_result(task_results)
-        print("Successfuly save results")
+        checkpoint = self.task_checkpoint(flow_logic)
+        if checkpoint is not None:
+            # 以前の実行で完了したタスクは実行せず記録した結果を使用する
+            task_inputs, finished = checkpoint.resume(task_inputs)
+            for result in finished:
+                if streaming:
+                    await flow_logic.consume_result(result)
+                else:
+                    task_results.append(result)
+        try:
+            return await self._run_tasks(
+                flow_logic, task_inputs, task_results, checkpoint
+            )
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    def task_checkpoint(self, flow_logic: BaseFlowLogic) -> Optional[TaskCheckpoint]:
+        """ジョブの一時ディレクトリのタスク結果のストア. 記録しない場合はNone."""
+        if not (
+            settings.TASK_CHECKPOINT and flow_logic.checkpoint_tasks and self.work_dir
+        ):
+            return None
+        bulk_num = os.getenv("PJM_BULKNUM")
+        return TaskCheckpoint(
+            checkpoint_path(self.work_dir, int(bulk_num) if bulk_num else None)
+        )
+
+    async def _run_tasks(
+        self,
+        flow_logic: BaseFlowLogic,
+        task_inputs: List[Dict[str, Any]],
+        task_results: List[Any],
+        checkpoint: Optional[TaskCheckpoint],
+    ) -> List[Any]:
+        """記録済みのものを除いたタスクを実行し，結果をtask_resultsに追加する."""
+        mode = flow_logic.task_execution_mode()
+        hosts = self.hosts()
+        if mode != "process":
+            if len(hosts) > 1:
+                self._logger.warning(f"tasks in {mode} mode run only on the first node")
+            return await self._run_in_driver(
+                flow_logic, mode, task_inputs, task_results, checkpoint
+            )
+        n_workers, blas_threads = self.pool_size(flow_logic)
+        # 複数ノードが割り当てられている場合は全ノードにワーカーを起動する
+        if len(hosts) > 1:
+            executor = DistributedExecutor(
+                hosts,
+                n_workers,
+                blas_threads,
+                settings.NODE_LAUNCHER,
+                settings.SHARED_INPUT_MIN_BYTES,
+                timings=self.timings,
+                checkpoint=checkpoint,
+            )
+            return task_results + await executor.run(
+                flow_logic, task_inputs, (self.project_name, self.flow_logic_name)
+            )
+        max_in_flight = flow_logic.max_in_flight or n_workers * 2
+        streaming = flow_logic.is_streaming()
+        sizer = ChunkSizer(
+            n_workers, settings.TASK_CHUNK_SECONDS, settings.TASK_MAX_CHUNK
+        )
+        with SharedTaskInputs(
+            settings.SHARED_INPUT_DIR, settings.SHARED_INPUT_MIN_BYTES
+        ) as shared_inputs, concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=init_worker,
+            initargs=(
+                flow_logic,
+                blas_threads,
+                getattr(flow_logic.sink, "queue", None),
+            ),
+        ) as executor:
+            pending = set()
+            # チャンク -> 先頭のタスク番号
+            offsets = {}
+            submitted = 0
+            while True:
+                # 処理中のチャンク数を上限以下に保ち，結果の消費が遅い場合は投入を待つ
+                while submitted < len(task_inputs) and len(pending) < max_in_flight:
+                    size = sizer.next_size(len(task_inputs) - submitted)
+                    chunk = [
+                        shared_inputs.share(param)
+                        for param in task_inputs[submitted : submitted + size]
+                    ]
+                    future = asyncio.wrap_future(
+                        executor.submit(run_shared_chunk, chunk)
+                    )
+                    offsets[future] = submitted
+                    submitted += size
+                    pending.add(future)
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    results, elapsed, durations, pid = future.result()
+                    offset = offsets.pop(future)
+                    indices = list(range(offset, offset + len(results)))
+                    sizer.record(len(results), elapsed)
+                    self.timings.record_tasks(str(pid), indices, durations)
+                    if checkpoint is not None:
+                        checkpoint.record(indices, results)
+                    for result in results:
+                        if streaming:
+                            await flow_logic.consume_result(result)
+                        else:
+                            task_results.append(result)
+        self._logger.info(
+            f"{len(task_inputs)} tasks are executed in {sizer.n_chunks} chunks"
+        )
+        return task_results
+
+    async def _run_in_driver(
+        self,
+        flow_logic: BaseFlowLogic,
+        mode: str,
+        task_inputs: List[Dict[str, Any]],
+        task_results: List[Any],
+        checkpoint: Optional[TaskCheckpoint],
+    ) -> List[Any]:
+        """タスクをdriverのプロセス内でスレッドプール・asyncio・インラインで実行する.
+
+        完了したタスクの結果はTASK_CHUNK_SECONDSごとにまとめて記録する．
+        """
+        streaming = flow_logic.is_streaming()
+        concurrency = self.parallelism(flow_logic)
+        is_async = inspect.iscoroutinefunction(flow_logic.run_task)
+        unrecorded: Tuple[List[int], List[Any]] = ([], [])
+        recorded_at = time.perf_counter()
+
+        def call(task_input: Dict[str, Any]) -> Tuple[Any, float, str]:
+            start = time.perf_counter()
+            result = flow_logic.run_task(**task_input)
+            # async defと判定できないrun_task(デコレータ等)がコルーチンを返した場合
+            if inspect.iscoroutine(result):
+                result.close()
+                raise TypeError(
+                    f"run_task returned a coroutine in {mode} mode. use asyncio mode"
+                )
+            return result, time.perf_counter() - start, threading.current_thread().name
+
+        async def call_async(task_input: Dict[str, Any]) -> Tuple[Any, float, str]:
+            start = time.perf_counter()
+            result = await flow_logic.run_task(**task_input)
+            return result, time.perf_counter() - start, mode
+
+        async def complete(
+            index: int, result: Any, seconds: float, worker: str
+        ) -> None:
+            nonlocal recorded_at
+            self.timings.record_tasks(worker, [index], [seconds])
+            if checkpoint is not None:
+                unrecorded[0].append(index)
+                unrecorded[1].append(result)
+                if time.perf_counter() - recorded_at >= settings.TASK_CHUNK_SECONDS:
+                    checkpoint.record(*unrecorded)
+                    unrecorded[0].clear()
+                    unrecorded[1].clear()
+                    recorded_at = time.perf_counter()
+            if streaming:
+                await flow_logic.consume_result(result)
+            else:
+                task_results.append(result)
+
+        try:
+            if mode == "inline":
+                for index, task_input in enumerate(task_inputs):
+                    if is_async:
+                        await complete(index, *await call_async(task_input))
+                    else:
+                        await complete(index, *call(task_input))
+                return task_results
+            if mode == "asyncio" and not is_async:
+                raise ValueError("run_task must be async def in asyncio mode")
+            loop = asyncio.get_running_loop()
+            executor = (
+                concurrent.futures.ThreadPoolExecutor(
+                    concurrency, thread_name_prefix="task"
+                )
+                if mode == "thread"
+                else None
+            )
+            pending: Dict[asyncio.Future, int] = {}
+            submitted = 0
+            try:
+                while True:
+                    # 同時実行数を上限以下に保つ
+                    while submitted < len(task_inputs) and len(pending) < concurrency:
+                        task_input = task_inputs[submitted]
+                        if executor is not None:
+                            future = loop.run_in_executor(executor, call, task_input)
+                        else:
+                            future = asyncio.ensure_future(call_async(task_input))
+                        pending[future] = submitted
+                        submitted += 1
+                    if not pending:
+                        break
+                    done, _ = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        await complete(pending.pop(future), *future.result())
+            finally:
+                for future in pending:
+                    future.cancel()
+                if executor is not None:
+                    executor.shutdown()
+            return task_results
+        finally:
+            if checkpoint is not None and unrecorded[0]:
+                checkpoint.record(*unrecorded)
@@ -0,0 +1,178 @@
+import fcntl
+import glob
+import os
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from schema.monitor_job_schema import JobRecordModel
+from services.job_timing import BULK_JOB_ID
+
+# 行インデックスのヘッダ(索引済みのバイト数, 索引済みの行数, 間隔)とオフセット
+INDEX_HEADER = struct.Struct("<QQQ")
+INDEX_OFFSET = struct.Struct("<Q")
+INDEX_SUFFIX = ".lineidx"
+SCAN_BLOCK = 1 << 20
+
+
+def job_output_path(record: JobRecordModel) -> Optional[Path]:
+    """ジョブの標準出力ファイルを一時ディレクトリから探す.
+
+    通常のジョブは"result_<ジョブ番号>.out"，パックジョブのサブジョブは
+    "result.out"，バルクジョブのサブジョブはPJMが作成する"<...>.<job_id>.out"．
+    """
+    if not record.tmp_dir:
+        return None
+    tmp_dir = Path(record.tmp_dir)
+    if BULK_JOB_ID.search(record.job_id):
+        pattern = f"*{glob.escape(record.job_id)}.out"
+    elif (tmp_dir / "result.out").exists():
+        return tmp_dir / "result.out"
+    else:
+        pattern = "result_*.out"
+    paths = sorted(tmp_dir.glob(pattern))
+    return paths[0] if paths else None
+
+
+def read_chunk(path: Path, offset: int, max_bytes: int) -> Tuple[bytes, int, int, bool]:
+    """offsetから最大max_bytesを読み込む.
+
+    読み込みが上限に達した場合は最後の改行までとし，次の読み込みが行頭から始まるようにする．
+
+    Returns:
+        Tuple[bytes, int, int, bool]: 読み込んだデータ, 次のオフセット, ファイルサイズ,
+            ファイルがoffsetより小さくなり先頭から読み直したか.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        truncated = offset > size
+        if truncated:
+            offset = 0
+        f.seek(offset)
+        data = f.read(max_bytes)
+    if len(data) == max_bytes and offset + len(data) < size:
+        newline = data.rfind(b"\n")
+        if newline >= 0:
+            data = data[: newline + 1]
+    return data, offset + len(data), size, truncated
+
+
+class LineIndex:
+    """出力ファイルの行オフセットの索引. ファイルと同じディレクトリのサイドカーに保存する.
+
+    stride行ごとの行頭のバイトオフセットを保持し，追記された部分のみを索引する．
+    複数の閲覧者からの更新はファイルロックで直列化する．
+    """
+
+    def __init__(self, path: Path, stride: int) -> None:
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + INDEX_SUFFIX)
+        self.stride = stride
+        self.indexed_bytes = 0
+        self.n_lines = 0
+        # offsets[k]はk*stride行目の行頭
+        self.offsets: List[int] = [0]
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        with open(self.index_path.with_suffix(".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self) -> None:
+        self.indexed_bytes, self.n_lines, self.offsets = 0, 0, [0]
+        try:
+            data = self.index_path.read_bytes()
+            indexed_bytes, n_lines, stride = INDEX_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return
+        if stride != self.stride:
+            return
+        self.indexed_bytes, self.n_lines = indexed_bytes, n_lines
+        body = data[INDEX_HEADER.size :]
+        self.offsets = [
+            INDEX_OFFSET.unpack_from(body, i)[0]
+            for i in range(0, len(body), INDEX_OFFSET.size)
+        ]
+
+    def _save(self, n_saved: int) -> None:
+        mode = "r+b" if self.index_path.exists() and n_saved else "wb"
+        with open(self.index_path, mode) as f:
+            f.seek(0)
+            f.write(INDEX_HEADER.pack(self.indexed_bytes, self.n_lines, self.stride))
+            # 既存のオフセットは変化しないため追加分のみ書き込む
+            f.seek(INDEX_HEADER.size + n_saved * INDEX_OFFSET.size)
+            f.write(b"".join(INDEX_OFFSET.pack(o) for o in self.offsets[n_saved:]))
+
+    def update(self) -> "LineIndex":
+        """ファイルの追記分を索引する."""
+        with self._lock():
+            self._load()
+            size = self.path.stat().st_size
+            if size < self.indexed_bytes:
+                # ファイルが切り詰められた場合は作り直す
+                self.indexed_bytes, self.n_lines, self.offsets = 0, 0, [0]
+            n_saved = len(self.offsets) if self.indexed_bytes else 0
+            if size == self.indexed_bytes and n_saved:
+                return self
+            with open(self.path, "rb") as f:
+                f.seek(self.indexed_bytes)
+                position = self.indexed_bytes
+                while position < size:
+                    block = f.read(min(SCAN_BLOCK, size - position))
+                    if not block:
+                        break
+                    count = block.count(b"\n")
+                    # 次の区切りの行がこのブロック内に無ければ数えるだけ
+                    next_mark = len(self.offsets) * self.stride
+                    if self.n_lines + count >= next_mark:
+                        start = 0
+                        for _ in range(count):
+                            newline = block.index(b"\n", start)
+                            start = newline + 1
+                            self.n_lines += 1
+                            if self.n_lines % self.stride == 0:
+                                self.offsets.append(position + start)
+                    else:
+                        self.n_lines += count
+                    position += len(block)
+                self.indexed_bytes = position
+            self._save(n_saved)
+        return self
+
+    def line_offset(self, line: int) -> int:
+        """line行目(0始まり)の行頭のバイトオフセット."""
+        line = max(0, min(line, self.n_lines))
+        k = min(line // self.stride, len(self.offsets) - 1)
+        offset = self.offsets[k]
+        skip = line - k * self.stride
+        if skip == 0:
+            return offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while skip > 0:
+                block = f.read(SCAN_BLOCK)
+                if not block:
+                    break
+                start = 0
+                while skip > 0:
+                    newline = block.find(b"\n", start)
+                    if newline < 0:
+                        break
+                    start = newline + 1
+                    skip -= 1
+                offset += start if skip == 0 else len(block)
+        return offset
+
+    def tail_offset(self, n: int) -> int:
+        """末尾n行の先頭のバイトオフセット. 改行で終わらない最後の行も1行と数える."""
+        partial = self.path.stat().st_size > self.offsets_end()
+        return self.line_offset(self.n_lines - n + (1 if partial else 0))
+
+    def offsets_end(self) -> int:
+        """索引済みの最後の改行の直後のオフセット."""
+        return self.line_offset(self.n_lines)
@@ -0,0 +1,173 @@
+import json
+import os
+import re
+import time
+from datetime import timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from schema.create_job_schema import InputModel
+from schema.monitor_job_schema import JobStatusModel
+
+# パックジョブのサブジョブIDは"<job_id>.<sub_num>"
+PACKED_JOB_ID = re.compile(r"^(?P<job_id>.+)\.(?P<sub_num>\d+)$")
+SUB_STATUS_FILE = "status.json"
+# 日本標準時. pandasのimportを避けるため固定のオフセットで扱う(夏時間は無い)
+JST = timezone(timedelta(hours=9), "JST")
+
+
+def elapse_seconds(elapse: Optional[str]) -> int:
+    """PJMの経過時間指定("[[hh:]mm:]ss")を秒に変換する."""
+    seconds = 0
+    for part in (elapse or "01:00:00").split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def format_elapse(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def packed_job_id(job_id: str, sub_num: int) -> str:
+    return f"{job_id}.{sub_num}"
+
+
+def parse_packed_job_id(job_id: str) -> Optional[Tuple[str, int]]:
+    """サブジョブIDをパックジョブのIDとサブジョブ番号に分解する."""
+    m = PACKED_JOB_ID.match(job_id)
+    if m is None:
+        return None
+    return m.group("job_id"), int(m.group("sub_num"))
+
+
+def sub_job_dir(tmp_dir: str, sub_num: int) -> str:
+    """サブジョブの入力・標準出力・状態ファイルを置くディレクトリ."""
+    return str(Path(tmp_dir) / f"sub_{sub_num}")
+
+
+def is_packable(input_model: InputModel, max_cores: int) -> bool:
+    """1ノード未満のコアのみを使用するジョブはパック可能."""
+    return (
+        not input_model.node
+        and not input_model.gpu
+        and (input_model.vnode_core or 1) <= max_cores
+    )
+
+
+class Pack:
+    """1つの割り当てにまとめるサブジョブの集合.
+
+    サブジョブは計画した開始順に並び，それぞれ割り当てたコア(パック内の番号)を持つ．
+    """
+
+    def __init__(self, max_cores: int) -> None:
+        self.indices: List[int] = []
+        self.cores: List[List[int]] = []
+        # コアごとの空き時刻(秒)
+        self._free_at = [0] * max_cores
+
+    @property
+    def n_cores(self) -> int:
+        return sum(1 for t in self._free_at if t > 0)
+
+    @property
+    def elapse(self) -> int:
+        return max(self._free_at)
+
+    def place(self, index: int, n_cores: int, seconds: int, max_elapse: int) -> bool:
+        """最も早く空くコアにサブジョブを配置する. 経過時間の上限を超える場合は配置しない."""
+        cores = sorted(range(len(self._free_at)), key=lambda c: self._free_at[c])[
+            :n_cores
+        ]
+        end = max(self._free_at[c] for c in cores) + seconds
+        if end > max_elapse:
+            return False
+        for c in cores:
+            self._free_at[c] = end
+        self.indices.append(index)
+        self.cores.append(sorted(cores))
+        return True
+
+
+def plan_packs(
+    input_models: List[InputModel], max_cores: int, max_elapse: int
+) -> List[Pack]:
+    """コア数と経過時間の指定からジョブを少数の割り当てに詰め込む.
+
+    経過時間の長い順にFirst-Fitで配置する．パックジョブの実行時は計画した順序と
+    コアでサブジョブを起動するため，各サブジョブが指定時間内に終了すれば
+    パック全体も計画した経過時間内に終了する．
+    """
+    order = sorted(
+        range(len(input_models)),
+        key=lambda i: (
+            -elapse_seconds(input_models[i].elapse),
+            -(input_models[i].vnode_core or 1),
+        ),
+    )
+    packs: List[Pack] = []
+    for i in order:
+        n_cores = input_models[i].vnode_core or 1
+        seconds = elapse_seconds(input_models[i].elapse)
+        for pack in packs:
+            if pack.place(i, n_cores, seconds, max_elapse):
+                break
+        else:
+            pack = Pack(max_cores)
+            if not pack.place(i, n_cores, seconds, max(max_elapse, seconds)):
+                raise ValueError(f"job {i} does not fit in a pack")
+            packs.append(pack)
+    return packs
+
+
+def write_sub_status(sub_dir: str, **status: Any) -> None:
+    """サブジョブの状態を書き込む. パックジョブ内の実行スクリプトが使用する."""
+    path = Path(sub_dir) / SUB_STATUS_FILE
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(dict(status, updated_at=time.time())))
+    os.replace(tmp_path, path)
+
+
+def read_sub_status(sub_dir: str) -> Dict[str, Any]:
+    try:
+        return json.loads((Path(sub_dir) / SUB_STATUS_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def sub_job_status(
+    sub_job_id: str, parent: JobStatusModel, sub_dir: str
+) -> JobStatusModel:
+    """パックジョブの状態とサブジョブの状態ファイルからサブジョブの状態を作成する.
+
+    パックジョブの実行前はパックジョブの状態となり，実行中・終了後は
+    状態ファイルの状態となる．パックジョブの終了時に完了していない
+    サブジョブは，キャンセルされた場合は"CCL"，それ以外は"ERR"となる．
+    """
+    status = parent.model_copy(update={"job_id": sub_job_id})
+    if not parent.job_status:
+        return status
+    sub = read_sub_status(sub_dir)
+    sub_state = sub.get("state")
+    if parent.job_status in ("RUN", "RNO"):
+        job_status = sub_state or "QUE"
+    elif parent.job_status in ("EXT", "CCL", "ERR"):
+        if sub_state == "EXT":
+            job_status = "EXT"
+        else:
+            job_status = "CCL" if parent.job_status == "CCL" else "ERR"
+    else:
+        job_status = parent.job_status
+    msg = parent.msg
+    if "exit_code" in sub:
+        msg = f"exit code {sub['exit_code']}"
+    if sub.get("reason"):
+        msg = f"{sub['reason']} ({msg})"
+    return status.model_copy(
+        update={
+            "job_status": job_status,
+            "msg": msg,
+            "start_date": sub.get("start_date", ""),
+            "core": str(len(sub["cores"])) if sub.get("cores") else parent.core,
+        }
+    )
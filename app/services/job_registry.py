@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from schema.create_job_schema import InputModel, OutputModel
+from schema.monitor_job_schema import JobRecordModel
+from utils.config import settings
+
+# これ以上状態が変化しないジョブの状態
+TERMINAL_STATUSES = ("EXT", "CCL", "ERR", "RJT", "UNKNOWN")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    project TEXT NOT NULL,
+    grp TEXT,
+    jobtype TEXT,
+    run TEXT,
+    flow_logic TEXT,
+    input_model TEXT NOT NULL,
+    tmp_dir TEXT,
+    job_status TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_project_status ON jobs (project, job_status);
+CREATE INDEX IF NOT EXISTS jobs_group_status ON jobs (grp, job_status);
+CREATE INDEX IF NOT EXISTS jobs_jobtype_status ON jobs (jobtype, job_status);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (job_status);
+"""
+
+
+class JobRegistry:
+    """投入したジョブを記録するSQLite(WALモード)のレジストリ."""
+
+    def __init__(self, path: str, lost_after: float) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.lost_after = lost_after
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def record(
+        self, input_model: InputModel, output: OutputModel, tmp_dir: str
+    ) -> None:
+        """投入に成功したジョブを記録する."""
+        if not output.job_id:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    output.job_id,
+                    input_model.project,
+                    input_model.group,
+                    input_model.jobtype,
+                    input_model.run,
+                    input_model.flow_logic,
+                    input_model.model_dump_json(),
+                    tmp_dir,
+                    "SUBMITTED",
+                    now,
+                    now,
+                ),
+            )
+
+    def active_job_ids(
+        self,
+        project: Optional[str] = None,
+        group: Optional[str] = None,
+        jobtype: Optional[str] = None,
+    ) -> List[str]:
+        """終了していないジョブのIDを取得する."""
+        conditions = [f"job_status NOT IN ({', '.join('?' * len(TERMINAL_STATUSES))})"]
+        values = list(TERMINAL_STATUSES)
+        for column, value in (
+            ("project", project),
+            ("grp", group),
+            ("jobtype", jobtype),
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                values.append(value)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT job_id FROM jobs WHERE {' AND '.join(conditions)}", values
+            ).fetchall()
+        return [row["job_id"] for row in rows]
+
+    def update_statuses(self, statuses: Dict[str, str]) -> None:
+        """ジョブの状態をまとめて更新する.
+
+        Args:
+            statuses (Dict[str, str]): ジョブIDをキーとしたジョブの状態.
+                状態が空のジョブはスケジューラから見つからなかったものとして扱う.
+        """
+        now = time.time()
+        found = [
+            (status, now, job_id, status)
+            for job_id, status in statuses.items()
+            if status
+        ]
+        lost = [job_id for job_id, status in statuses.items() if not status]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE jobs SET job_status = ?, updated_at = ? "
+                "WHERE job_id = ? AND job_status != ?",
+                found,
+            )
+            # 投入から一定時間経過しても見つからないジョブは追跡を終える
+            self._conn.executemany(
+                "UPDATE jobs SET job_status = 'UNKNOWN', updated_at = ? "
+                "WHERE job_id = ? AND submitted_at < ?",
+                [(now, job_id, now - self.lost_after) for job_id in lost],
+            )
+
+    def get(self, job_id: str) -> Optional[JobRecordModel]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._to_model(row) if row else None
+
+    def list_jobs(
+        self,
+        project: Optional[str] = None,
+        group: Optional[str] = None,
+        jobtype: Optional[str] = None,
+        job_status: Optional[List[str]] = None,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> List[JobRecordModel]:
+        """条件に一致するジョブを新しい順に取得する."""
+        conditions, values = [], []
+        for column, value in (
+            ("project", project),
+            ("grp", group),
+            ("jobtype", jobtype),
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                values.append(value)
+        if job_status:
+            conditions.append(f"job_status IN ({', '.join('?' * len(job_status))})")
+            values += job_status
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs {where} ORDER BY submitted_at DESC LIMIT ? OFFSET ?",
+                (*values, limit, offset),
+            ).fetchall()
+        return [self._to_model(row) for row in rows]
+
+    @staticmethod
+    def _to_model(row: sqlite3.Row) -> JobRecordModel:
+        return JobRecordModel(
+            job_id=row["job_id"],
+            project=row["project"],
+            group=row["grp"],
+            jobtype=row["jobtype"],
+            run=row["run"],
+            flow_logic=row["flow_logic"],
+            input_model=InputModel.model_validate_json(row["input_model"]),
+            tmp_dir=row["tmp_dir"] or "",
+            job_status=row["job_status"],
+            submitted_at=row["submitted_at"],
+            updated_at=row["updated_at"],
+        )
+
+
+async def reconcile_forever(registry: JobRegistry, interval: float) -> None:
+    """未終了ジョブの状態をスケジューラからまとめて取得し，レジストリを更新する."""
+    from services.job_status_cache import get_job_status_cache
+    from services.job_timing import collect_job_timings
+    from services.resource_history import get_resource_history
+    from services.log_sink import sync_offline_runs
+
+    logger = logging.getLogger("uvicorn")
+
+    async def post_process(job_id: str, name: str, func: Callable, *args: Any) -> Any:
+        try:
+            return await asyncio.to_thread(func, *args)
+        except Exception as e:
+            logger.error(f"failed to {name} finished job {job_id}: {e}")
+            return None
+
+    while True:
+        try:
+            job_ids = registry.active_job_ids()
+            if job_ids:
+                stats = await get_job_status_cache().get_job_stats(job_ids)
+                statuses = {job_id: s.job_status for job_id, s in zip(job_ids, stats)}
+                registry.update_statuses(statuses)
+                # 終了したジョブは以降確認されないため，1件・1つの処理の失敗で
+                # 他の処理を止めないようジョブ・処理ごとに例外を捕捉する
+                synced = set()
+                for job_id, status in statuses.items():
+                    if status not in TERMINAL_STATUSES:
+                        continue
+                    record = await post_process(job_id, "load", registry.get, job_id)
+                    if not (record and record.tmp_dir):
+                        continue
+                    # 終了したジョブの各フェーズ・タスクの実行時間をメトリクスに集計する
+                    await post_process(
+                        job_id, "collect timings of", collect_job_timings, record
+                    )
+                    # 実行時間・使用コア数を"auto"の資源指定の履歴に追加する
+                    await post_process(
+                        job_id,
+                        "observe resources of",
+                        lambda record: get_resource_history().observe_job(record),
+                        record,
+                    )
+                    if settings.WANDB_SYNC == "server" and record.tmp_dir not in synced:
+                        # 終了したジョブのオフラインrunをアップロードする
+                        synced.add(record.tmp_dir)
+                        asyncio.ensure_future(sync_offline_runs(record.tmp_dir))
+        except Exception as e:
+            logger.error(f"failed to reconcile job registry: {e}")
+        await asyncio.sleep(interval)
+
+
+@lru_cache
+def get_job_registry() -> JobRegistry:
+    return JobRegistry(
+        settings.JOB_REGISTRY_PATH, lost_after=settings.JOB_REGISTRY_LOST_AFTER
+    )
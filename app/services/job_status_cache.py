@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from schema.monitor_job_schema import JobStatusModel, StatusCacheModel
+from services.job_manager import not_found_status, parse_pjstat_output
+from services.job_packing import parse_packed_job_id, sub_job_status
+from services.job_registry import get_job_registry
+from services.scheduler_command import get_scheduler_command
+from utils.config import settings
+
+
+class JobStatusCache:
+    """pjstatのスナップショットをTTL単位で共有するキャッシュ.
+
+    TTL内の全リクエストは1回のpjstat(と1回のpjstat -H)の結果から応答する．
+    同時に発生したリフレッシュは1回のコマンド実行にまとめられる．
+    バルクジョブのサブジョブ("<job_id>[<bulk_num>]")も個別に保持する．
+    """
+
+    def __init__(self, ttl: float, history_size: int) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.ttl = ttl
+        self.history_size = history_size
+        self._running: Dict[str, JobStatusModel] = {}
+        self._taken_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        # 終了済ジョブ(pjstat -H)は状態が変化しないためLRUで保持する
+        self._history: "OrderedDict[str, JobStatusModel]" = OrderedDict()
+        # pjstat -Hでも見つからなかったジョブIDと確認時刻
+        self._unknown: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.history_queries = 0
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self._taken_at < self.ttl
+
+    def invalidate(self) -> None:
+        """次回参照時にスナップショットを取り直す."""
+        self._taken_at = 0.0
+
+    def _prune_unknown(self) -> None:
+        now = time.monotonic()
+        self._unknown = {
+            job_id: checked_at
+            for job_id, checked_at in self._unknown.items()
+            if now - checked_at < self.ttl
+        }
+
+    async def refresh(self) -> None:
+        """スナップショットを更新する. 実行中の更新があればそれを待つ."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self) -> None:
+        command = ["pjstat", "-E"]
+        r = await get_scheduler_command().run(command)
+        self._running = parse_pjstat_output(r.stdout, r.returncode)
+        self._prune_unknown()
+        self._taken_at = time.monotonic()
+        self.refreshes += 1
+
+    async def _fetch_history(self, job_ids: List[str]) -> None:
+        """実行中でないジョブをpjstat -Hでまとめて取得する."""
+        command = ["pjstat", "-H", *job_ids]
+        r = await get_scheduler_command().run(command)
+        self.history_queries += 1
+        now = time.monotonic()
+        self._unknown.update({job_id: now for job_id in job_ids})
+        for job_id, job_stats in parse_pjstat_output(r.stdout, r.returncode).items():
+            self._history[job_id] = job_stats
+            self._history.move_to_end(job_id)
+            self._unknown.pop(job_id, None)
+        while len(self._history) > self.history_size:
+            self._history.popitem(last=False)
+
+    async def get_job_stats(self, job_ids: List[str]) -> List[JobStatusModel]:
+        """複数ジョブの情報をスナップショットから取得する.
+
+        Args:
+            job_ids (List[str]): 取得するジョブIDのリスト.
+
+        Returns:
+            List[JobStatusModel]: job_idsと同じ順序のジョブの状態値.
+        """
+        if self.is_fresh():
+            self.hits += 1
+        else:
+            self.misses += 1
+            await self.refresh()
+
+        # パックジョブのサブジョブはパックジョブの状態と状態ファイルから求める
+        packed = {}
+        for job_id in job_ids:
+            parsed = parse_packed_job_id(job_id) if job_id else None
+            if parsed is not None:
+                packed[job_id] = parsed[0]
+        query_ids = [packed.get(job_id, job_id) for job_id in job_ids]
+
+        now = time.monotonic()
+        missing = [
+            job_id
+            for job_id in dict.fromkeys(query_ids)
+            if job_id
+            and job_id not in self._running
+            and job_id not in self._history
+            and now - self._unknown.get(job_id, -self.ttl) >= self.ttl
+        ]
+        if missing:
+            await self._fetch_history(missing)
+
+        output_models = []
+        for job_id, query_id in zip(job_ids, query_ids):
+            job_stats = self._running.get(query_id) or self._history.get(query_id)
+            record = get_job_registry().get(job_id) if job_id in packed else None
+            if job_stats is None or (job_id in packed and record is None):
+                self._logger.info(f"Maybe job_id {job_id} does not exist.")
+                job_stats = not_found_status(job_id)
+            elif job_id in packed:
+                job_stats = sub_job_status(job_id, job_stats, record.tmp_dir)
+            output_models.append(job_stats)
+        return output_models
+
+    def forget(self, job_ids: List[str]) -> None:
+        """削除したジョブをキャッシュから取り除く."""
+        for job_id in job_ids:
+            self._history.pop(job_id, None)
+            self._unknown.pop(job_id, None)
+        self.invalidate()
+
+    def stats(self) -> StatusCacheModel:
+        return StatusCacheModel(
+            hits=self.hits,
+            misses=self.misses,
+            refreshes=self.refreshes,
+            history_queries=self.history_queries,
+            running_jobs=len(self._running),
+            history_jobs=len(self._history),
+            ttl=self.ttl,
+        )
+
+
+@lru_cache
+def get_job_status_cache() -> JobStatusCache:
+    return JobStatusCache(
+        ttl=settings.JOB_STATUS_CACHE_TTL,
+        history_size=settings.JOB_STATUS_HISTORY_SIZE,
+    )
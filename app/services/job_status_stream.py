@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
+
+from schema.monitor_job_schema import JobStatusEventModel
+from services.job_registry import TERMINAL_STATUSES, get_job_registry
+from services.job_status_cache import get_job_status_cache
+from utils.config import settings
+
+
+class Subscription:
+    """状態遷移の通知先. ジョブIDまたはproject/group/jobtypeで対象を指定する."""
+
+    def __init__(
+        self,
+        job_ids: List[str],
+        project: Optional[str],
+        group: Optional[str],
+        jobtype: Optional[str],
+        queue_size: int,
+    ) -> None:
+        self.job_ids: Set[str] = set(job_ids)
+        # 終了を通知し監視対象から外したジョブ. レジストリが終了を反映するまで保持する
+        self.finished: Set[str] = set()
+        self.project = project
+        self.group = group
+        self.jobtype = jobtype
+        self.queue: "asyncio.Queue[JobStatusEventModel]" = asyncio.Queue(queue_size)
+
+    @property
+    def has_selector(self) -> bool:
+        return any(v is not None for v in (self.project, self.group, self.jobtype))
+
+    def put(self, event: JobStatusEventModel) -> None:
+        # 受信が遅いクライアントでは古いイベントを捨てる
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class JobStatusBroadcaster:
+    """1つのポーラーでジョブ状態の差分を検出し，全購読者に配信する.
+
+    購読者が存在する間だけポーラーが動作し，監視対象の和集合について
+    共有スナップショットから状態を取得するため，サーバー負荷は購読者数に依存しない．
+    """
+
+    def __init__(self, interval: float, queue_size: int) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.interval = interval
+        self.queue_size = queue_size
+        self.subscriptions: List[Subscription] = []
+        self.states: Dict[str, str] = {}
+        self._poller: Optional[asyncio.Task] = None
+
+    def subscribe(
+        self,
+        job_ids: List[str],
+        project: Optional[str] = None,
+        group: Optional[str] = None,
+        jobtype: Optional[str] = None,
+    ) -> Subscription:
+        subscription = Subscription(job_ids, project, group, jobtype, self.queue_size)
+        self.subscriptions.append(subscription)
+        # 既知の状態を初期値として通知する
+        for job_id in subscription.job_ids:
+            if job_id in self.states:
+                subscription.put(
+                    JobStatusEventModel(job_id=job_id, job_status=self.states[job_id])
+                )
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_forever())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+
+    def _watched(self) -> Set[str]:
+        """監視対象のジョブIDの和集合を作成する."""
+        watched: Set[str] = set()
+        registry = get_job_registry()
+        for subscription in self.subscriptions:
+            if subscription.has_selector:
+                active = set(
+                    registry.active_job_ids(
+                        subscription.project, subscription.group, subscription.jobtype
+                    )
+                )
+                # 一度対象となったジョブは終了まで通知する
+                subscription.finished &= active
+                subscription.job_ids |= active - subscription.finished
+            watched |= subscription.job_ids
+        return watched
+
+    async def poll(self) -> None:
+        """スナップショットを取得し，状態が変化したジョブを通知する."""
+        watched = self._watched()
+        if not watched:
+            return
+        job_ids = list(watched)
+        stats = await get_job_status_cache().get_job_stats(job_ids)
+        for job_id, job_stats in zip(job_ids, stats):
+            previous = self.states.get(job_id, "")
+            if job_stats.job_status == previous:
+                continue
+            self.states[job_id] = job_stats.job_status
+            event = JobStatusEventModel(
+                job_id=job_id,
+                previous_status=previous,
+                job_status=job_stats.job_status,
+                job_name=job_stats.job_name,
+                start_date=job_stats.start_date,
+                elapse_lim=job_stats.elapse_lim,
+            )
+            # 取得中に追加された購読者にも通知する
+            for subscription in self.subscriptions:
+                if job_id in subscription.job_ids:
+                    subscription.put(event)
+        # project/group/jobtypeで指定した購読では，終了を通知したジョブを監視対象から外す
+        for subscription in self.subscriptions:
+            if not subscription.has_selector:
+                continue
+            done = {
+                job_id
+                for job_id in subscription.job_ids
+                if self.states.get(job_id) in TERMINAL_STATUSES
+            }
+            subscription.job_ids -= done
+            subscription.finished |= done
+        # 購読されなくなったジョブの状態は保持しない
+        self.states = {
+            job_id: state for job_id, state in self.states.items() if job_id in watched
+        }
+
+    async def _poll_forever(self) -> None:
+        while self.subscriptions:
+            try:
+                await self.poll()
+            except Exception as e:
+                self._logger.error(f"failed to poll job status: {e}")
+            await asyncio.sleep(self.interval)
+
+
+@lru_cache
+def get_job_status_broadcaster() -> JobStatusBroadcaster:
+    return JobStatusBroadcaster(
+        interval=settings.JOB_STATUS_STREAM_INTERVAL,
+        queue_size=settings.JOB_STATUS_STREAM_QUEUE_SIZE,
+    )
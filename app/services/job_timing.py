@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import re
+import resource
+import statistics
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from schema.monitor_job_schema import JobRecordModel
+from services.metrics import get_metrics_registry
+
+# 中央値のこの倍以上の時間がかかったタスクをストラグラーとする
+STRAGGLER_FACTOR = 2.0
+MAX_STRAGGLERS = 20
+# バルクジョブのサブジョブIDは"<job_id>[<バルク番号>]"
+BULK_JOB_ID = re.compile(r"\[(?P<bulk_num>\d+)\]$")
+
+PHASE_SECONDS = get_metrics_registry().histogram(
+    "hpcops_job_phase_seconds", "Wall time of job phases.", ("phase",)
+)
+TASK_SECONDS = get_metrics_registry().histogram(
+    "hpcops_job_task_seconds", "Duration of individual run_task calls."
+)
+QUEUE_WAIT_SECONDS = get_metrics_registry().histogram(
+    "hpcops_job_queue_wait_seconds", "Time from pjsub to the start of the job."
+)
+UTILIZATION = get_metrics_registry().histogram(
+    "hpcops_job_worker_utilization",
+    "Busy fraction of task workers during the run_tasks phase.",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0),
+)
+STRAGGLERS = get_metrics_registry().counter(
+    "hpcops_job_stragglers_total", "Tasks slower than the straggler threshold."
+)
+
+
+def timings_path(tmp_dir: str, bulk_num: Optional[int] = None) -> Path:
+    """ジョブの実行時間を記録するファイル. バルクジョブではサブジョブごとに分ける."""
+    name = "timings.json" if bulk_num is None else f"timings_{bulk_num}.json"
+    return Path(tmp_dir) / name
+
+
+def job_timings_path(record: JobRecordModel) -> Path:
+    """レジストリのジョブに対応する実行時間のファイル."""
+    m = BULK_JOB_ID.search(record.job_id)
+    return timings_path(record.tmp_dir, int(m.group("bulk_num")) if m else None)
+
+
+def cpu_seconds() -> float:
+    """このプロセスと終了済みの子プロセス(ワーカー)のCPU時間."""
+    usages = [
+        resource.getrusage(resource.RUSAGE_SELF),
+        resource.getrusage(resource.RUSAGE_CHILDREN),
+    ]
+    return sum(usage.ru_utime + usage.ru_stime for usage in usages)
+
+
+def max_rss_mb() -> float:
+    """このプロセスと子プロセスの最大常駐メモリ(MB)."""
+    return (
+        max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        / 1024
+    )
+
+
+class JobTimings:
+    """ジョブ内の各フェーズとタスクの実行時間を記録する.
+
+    フェーズはflow logicの取得・task_scheduler・run_tasks・create_resultの各区間，
+    タスクはワーカーごとのrun_taskの実行時間であり，run_tasksの区間に対する
+    ワーカーの稼働率とストラグラーを集計してジョブの一時ディレクトリに書き出す．
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.phases: Dict[str, float] = {}
+        # フェーズごとのCPU時間. 他ノードのワーカーは含まない
+        self.cpu: Dict[str, float] = {}
+        self.n_workers = 0
+        # 割り当てられたコア数と，プロセスプールの1ワーカーが占有するコア数.
+        # プロセスプール以外で実行した場合はNone
+        self.cores = 0
+        self.cores_per_task: Optional[int] = None
+        # 出力先に書き込めなかったメトリクスの数
+        self.dropped_metrics = 0
+        # 実行したflow logicのダイジェスト
+        self.flow_logic = ""
+        # タスク番号 -> (ワーカー, 実行時間)
+        self.tasks: Dict[int, tuple] = {}
+        # タスクの(開始, 終了)時刻(driverのtime.perf_counter())
+        self.spans: List[Tuple[float, float]] = []
+        # ワーカー -> 最後に記録したタスクの終了時刻
+        self._worker_end: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start, start_cpu = time.perf_counter(), cpu_seconds()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+            self.cpu[name] = self.cpu.get(name, 0.0) + cpu_seconds() - start_cpu
+
+    def record_tasks(
+        self, worker: str, indices: List[int], durations: List[float]
+    ) -> None:
+        """ワーカーが実行したタスクの実行時間を記録する.
+
+        チャンク内のタスクは順に実行され，記録の直前に最後のタスクが終了したものとして
+        各タスクの実行区間を求める．ワーカーはタスクを順に実行するため，結果の転送の
+        遅れで同じワーカーの以前の区間と重なる場合は重ならないようずらす．
+        """
+        total = sum(durations)
+        start = max(time.perf_counter() - total, self._worker_end.get(worker, 0.0))
+        end = self._worker_end[worker] = start + total
+        for index, seconds in reversed(list(zip(indices, durations))):
+            self.tasks[index] = (worker, seconds)
+            self.spans.append((end - seconds, end))
+            end -= seconds
+
+    def peak_tasks(self) -> int:
+        """同時に実行されていたタスク数の最大値."""
+        # 同時刻では終了を先に数える
+        events = sorted(
+            [(end, -1) for _, end in self.spans]
+            + [(start, 1) for start, _ in self.spans]
+        )
+        peak = running = 0
+        for _, delta in events:
+            running += delta
+            peak = max(peak, running)
+        return peak
+
+    def summary(self, status: str) -> Dict[str, Any]:
+        durations = [seconds for _, seconds in self.tasks.values()]
+        run_seconds = self.phases.get("run_tasks", 0.0)
+        busy: Dict[str, List[float]] = {}
+        for worker, seconds in self.tasks.values():
+            busy.setdefault(worker, []).append(seconds)
+        workers = {
+            worker: {
+                "tasks": len(seconds),
+                "busy": sum(seconds),
+                "utilization": sum(seconds) / run_seconds if run_seconds else 0.0,
+            }
+            for worker, seconds in busy.items()
+        }
+        n_workers = max(self.n_workers, len(workers))
+        stragglers = []
+        if durations:
+            threshold = STRAGGLER_FACTOR * statistics.median(durations)
+            stragglers = sorted(
+                (
+                    {"index": index, "worker": worker, "seconds": seconds}
+                    for index, (worker, seconds) in self.tasks.items()
+                    if seconds > threshold
+                ),
+                key=lambda t: -t["seconds"],
+            )
+        return {
+            "status": status,
+            "started_at": self.started_at,
+            "finished_at": time.time(),
+            "phases": self.phases,
+            "flow_logic": self.flow_logic,
+            "cpu_seconds": self.cpu,
+            "max_rss_mb": max_rss_mb(),
+            "dropped_metrics": self.dropped_metrics,
+            "n_workers": n_workers,
+            "cores": self.cores,
+            "peak_cores": (
+                self.peak_tasks() * self.cores_per_task if self.cores_per_task else None
+            ),
+            "tasks": _describe(durations),
+            "utilization": (
+                sum(durations) / (n_workers * run_seconds)
+                if n_workers and run_seconds
+                else 0.0
+            ),
+            "workers": workers,
+            "n_stragglers": len(stragglers),
+            "stragglers": stragglers[:MAX_STRAGGLERS],
+            "task_seconds": [
+                self.tasks[i][1] if i in self.tasks else None
+                for i in range(max(self.tasks, default=-1) + 1)
+            ],
+        }
+
+    def write(self, path: Path, status: str) -> None:
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(self.summary(status)))
+        os.replace(tmp_path, path)
+
+
+def _describe(durations: List[float]) -> Dict[str, float]:
+    if not durations:
+        return {"count": 0}
+    ordered = sorted(durations)
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def read_job_timings(record: JobRecordModel) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(job_timings_path(record).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def collect_job_timings(record: JobRecordModel) -> bool:
+    """終了したジョブの実行時間のファイルをサーバーのメトリクスに集計する.
+
+    Returns:
+        bool: ファイルが存在し集計した場合True.
+    """
+    timings = read_job_timings(record)
+    if timings is None:
+        return False
+    try:
+        for phase, seconds in timings["phases"].items():
+            PHASE_SECONDS.observe(seconds, phase=phase)
+        for seconds in timings["task_seconds"]:
+            if seconds is not None:
+                TASK_SECONDS.observe(seconds)
+        QUEUE_WAIT_SECONDS.observe(
+            max(0.0, timings["started_at"] - record.submitted_at)
+        )
+        if timings["tasks"]["count"]:
+            UTILIZATION.observe(timings["utilization"])
+        STRAGGLERS.inc(timings["n_stragglers"])
+    except (KeyError, TypeError) as e:
+        logging.getLogger("uvicorn").error(
+            f"invalid timings of job {record.job_id}: {e}"
+        )
+        return False
+    return True
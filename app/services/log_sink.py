@@ -0,0 +1,267 @@
+import asyncio
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.config import settings
+
+# (メトリクス, ステップ)の組
+Record = Tuple[Dict[str, Any], Optional[int]]
+
+
+def _sync_command(paths: List[str]) -> List[str]:
+    return [sys.executable, "-m", "wandb", "sync", *paths]
+
+
+def _sync_env() -> Dict[str, str]:
+    return dict(os.environ, WANDB_API_KEY=settings.WANDB_APIKEY or "")
+
+
+def offline_run_dirs(work_dir: str) -> List[str]:
+    """ジョブの一時ディレクトリ内のオフラインrunの一覧."""
+    return sorted(glob.glob(os.path.join(work_dir, "wandb", "offline-run-*")))
+
+
+async def sync_offline_runs(work_dir: str) -> int:
+    """ジョブの一時ディレクトリ内のオフラインrunをwandbにアップロードする.
+
+    計算ノードから外部に接続できない場合に，ジョブ終了後にサーバー側で実行する．
+
+    Returns:
+        int: wandb syncの終了コード. 対象のrunが無い場合は0.
+    """
+    paths = offline_run_dirs(work_dir)
+    if not paths:
+        return 0
+    proc = await asyncio.create_subprocess_exec(
+        *_sync_command(paths),
+        env=_sync_env(),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    stdout, _ = await proc.communicate()
+    if proc.returncode:
+        logging.getLogger("uvicorn").error(
+            f"failed to sync offline runs in {work_dir}: {stdout.decode()}"
+        )
+    return proc.returncode
+
+
+class LogSink(metaclass=ABCMeta):
+    """ジョブのメトリクスの出力先."""
+
+    @abstractmethod
+    def write(self, records: List[Record]) -> None:
+        """メトリクスをまとめて書き込む."""
+        return NotImplementedError
+
+    def finish(self) -> None:
+        """ジョブの終了時に呼ばれる."""
+
+
+class WandbSink(LogSink):
+    """1ジョブにつき1つのwandb runに書き込む.
+
+    オフラインモードでは計算ノードのローカルに記録し，
+    sync="background"の場合は実行中に一定間隔でアップロードする．
+    """
+
+    def __init__(
+        self,
+        cfg: Dict[str, Any],
+        work_dir: str,
+        mode: str = "online",
+        sync: str = "server",
+        sync_interval: float = 300,
+    ) -> None:
+        import wandb
+
+        self._logger = logging.getLogger("uvicorn")
+        wandb.login(key=settings.WANDB_APIKEY)
+        self.run = wandb.init(
+            project=cfg["project"],
+            group=cfg["group"],
+            job_type=cfg["jobtype"],
+            name=cfg["run"],
+            config=cfg,
+            dir=work_dir,
+            mode=mode,
+        )
+        # 複数のワーカーが記録するステップは単調増加にならないため，
+        # ステップはメトリクスの1つとして記録し横軸に使用する
+        self.run.define_metric("step")
+        self.run.define_metric("*", step_metric="step")
+        self.offline = mode == "offline"
+        self._stop = threading.Event()
+        self._sync_thread: Optional[threading.Thread] = None
+        if self.offline and sync == "background":
+            self._sync_thread = threading.Thread(
+                target=self._sync_forever, args=(sync_interval,), daemon=True
+            )
+            self._sync_thread.start()
+
+    def _sync(self) -> None:
+        run_dir = os.path.dirname(self.run.dir)
+        r = subprocess.run(
+            _sync_command([run_dir]),
+            env=_sync_env(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        if r.returncode:
+            self._logger.error(f"failed to sync {run_dir}: {r.stdout}")
+
+    def _sync_forever(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self._sync()
+
+    def write(self, records: List[Record]) -> None:
+        for data, step in records:
+            self.run.log(data if step is None else dict(data, step=step))
+
+    def finish(self) -> None:
+        self.run.finish()
+        if self._sync_thread is not None:
+            self._stop.set()
+            self._sync_thread.join()
+            self._sync()
+
+
+class FileSink(LogSink):
+    """メトリクスをJSON Linesとしてファイルに追記する. wandbを使わない検証用."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def write(self, records: List[Record]) -> None:
+        with open(self.path, "a") as f:
+            for data, step in records:
+                f.write(json.dumps({"step": step, "data": data}, default=str) + "\n")
+
+
+def set_wandb_apikey() -> None:
+    """wandbをimportせずにAPIキーを設定する.
+
+    wandbは初回の使用時に環境変数WANDB_API_KEYから認証するため，flow logicが
+    wandbをどこでimportしてもログイン済みとして使用できる．
+    """
+    if settings.WANDB_APIKEY:
+        os.environ.setdefault("WANDB_API_KEY", settings.WANDB_APIKEY)
+
+
+def create_log_sink(cfg: Dict[str, Any], work_dir: str) -> LogSink:
+    """設定(LOG_SINK)に応じたジョブのメトリクスの出力先を作成する."""
+    if settings.LOG_SINK == "file":
+        return FileSink(os.path.join(work_dir, "metrics.jsonl"))
+    if settings.LOG_SINK == "wandb":
+        return WandbSink(
+            cfg,
+            work_dir,
+            mode=settings.WANDB_RUN_MODE,
+            sync=settings.WANDB_SYNC,
+            sync_interval=settings.WANDB_SYNC_INTERVAL,
+        )
+    raise ValueError(f"unknown log sink: {settings.LOG_SINK}")
+
+
+class LogBuffer:
+    """driverでジョブ内の全プロセスのメトリクスを集め，一定間隔で出力先に書き込む.
+
+    ワーカープロセスはqueueにメトリクスをまとめて送り，
+    出力先への書き込みはこのクラスのスレッドのみが行う．
+    書き込みに失敗したメトリクスは捨てて以降の書き込みを続け，その数をn_droppedに数える．
+    ジョブの計算結果には影響しないため例外とはしない．
+    """
+
+    def __init__(self, sink: LogSink, flush_interval: float) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.sink = sink
+        # 書き込みに失敗したメトリクスの数
+        self.n_dropped = 0
+        self.flush_interval = flush_interval
+        self.queue = multiprocessing.Queue()
+        self._records: List[Record] = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def log(self, data: Dict[str, Any], step: Optional[int] = None) -> None:
+        with self._lock:
+            self._records.append((data, step))
+
+    def extend(self, records: List[Record]) -> None:
+        with self._lock:
+            self._records.extend(records)
+
+    def _flush(self) -> None:
+        with self._lock:
+            records, self._records = self._records, []
+        if not records:
+            return
+        try:
+            self.sink.write(records)
+        except Exception as e:
+            self.n_dropped += len(records)
+            self._logger.error(f"failed to write {len(records)} metrics: {e}")
+
+    def _run(self) -> None:
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                records = self.queue.get(timeout=max(0, next_flush - time.monotonic()))
+            except queue.Empty:
+                records = []
+            if records is None:
+                break
+            self.extend(records)
+            if time.monotonic() >= next_flush:
+                self._flush()
+                next_flush = time.monotonic() + self.flush_interval
+        self._flush()
+
+    def close(self) -> None:
+        """残りのメトリクスを書き込み，出力先を終了する."""
+        self.queue.put(None)
+        self._thread.join()
+        self.queue.close()
+        self.sink.finish()
+        if self.n_dropped:
+            self._logger.error(f"{self.n_dropped} metrics could not be written")
+
+
+class WorkerLog:
+    """ワーカー側. メトリクスをためて一定間隔でまとめてdriverへ送る.
+
+    Args:
+        send (Callable[[List[Record]], None]): メトリクスのリストをdriverへ送る関数.
+        flush_interval (float): 送信間隔(秒).
+    """
+
+    def __init__(
+        self, send: Callable[[List[Record]], None], flush_interval: float
+    ) -> None:
+        self.send = send
+        self.flush_interval = flush_interval
+        self._records: List[Record] = []
+        self._last_flush = time.monotonic()
+
+    def log(self, data: Dict[str, Any], step: Optional[int] = None) -> None:
+        self._records.append((data, step))
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._records:
+            self.send(self._records)
+            self._records = []
+        self._last_flush = time.monotonic()
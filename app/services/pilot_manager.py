@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import socket
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional
+from uuid import uuid4
+
+from schema.create_job_schema import InputModel
+from schema.monitor_job_schema import JobRecordModel
+from schema.pilot_job_schema import PilotLeaseModel, PilotPoolModel, PilotTaskModel
+from services.job_executor import JobExecutor, create_tmp_dir
+from services.job_packing import elapse_seconds
+from services.job_registry import TERMINAL_STATUSES
+from services.job_status_cache import get_job_status_cache
+from services.job_timing import collect_job_timings
+from utils.config import settings
+
+
+class Pilot:
+    """投入済みのパイロットジョブ."""
+
+    def __init__(self, pilot_id: str, job_id: str) -> None:
+        self.pilot_id = pilot_id
+        self.job_id = job_id
+        # サーバーに接続済みか. 接続前はPJMのキューで待機している
+        self.active = False
+        # 最後にリース・生存確認を受け取った時刻
+        self.last_seen = time.monotonic()
+        # パイロットの経過時間の上限に達する時刻. 不明な場合はNone
+        self.deadline: Optional[float] = None
+
+    def walltime(self) -> Optional[float]:
+        """パイロットの残りの経過時間(秒)."""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+
+class PilotManager:
+    """パイロットジョブ上のウォームワーカーにジョブを割り当てる.
+
+    キューにジョブがありパイロット数が上限未満であればパイロットジョブを投入する．
+    パイロットはキューからジョブを取得してプロセス内で実行し，
+    アイドル時間がidle_timeoutを超えると割り当て資源を返却して終了する．
+    PJMで終了したパイロットと，lost_after秒以上応答の無いパイロットは取り除き，
+    実行中だったジョブをキューに戻す．
+    各ジョブには通常のジョブと同様にサーバーが一時ディレクトリを作成し，
+    キューに戻したジョブも同じディレクトリで(完了済みのタスクを省いて)再実行される．
+    """
+
+    def __init__(
+        self,
+        pool_size: int,
+        idle_timeout: float,
+        vnode_core: int,
+        elapse: str,
+        server_url: str,
+        lost_after: float,
+    ) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.lost_after = lost_after
+        self.pilot_model = InputModel(vnode_core=vnode_core, elapse=elapse)
+        self.server_url = server_url
+        self.tasks: Dict[str, PilotTaskModel] = {}
+        self.inputs: Dict[str, InputModel] = {}
+        # ジョブのキューへの追加時刻(UNIX時間)
+        self.submitted_at: Dict[str, float] = {}
+        self.queue: Deque[str] = deque()
+        self.pilots: Dict[str, Pilot] = {}
+        self._queued: Optional[asyncio.Condition] = None
+        self._scaling = asyncio.Lock()
+
+    @property
+    def queued(self) -> asyncio.Condition:
+        if self._queued is None:
+            self._queued = asyncio.Condition()
+        return self._queued
+
+    def fits(self, input_model: InputModel) -> bool:
+        """ジョブがパイロットの資源内で実行可能か."""
+        return (
+            (input_model.node or 1) <= 1
+            and not input_model.gpu
+            and (input_model.vnode_core or 1) <= (self.pilot_model.vnode_core or 1)
+            and elapse_seconds(input_model.elapse)
+            <= elapse_seconds(self.pilot_model.elapse)
+        )
+
+    def _fits_walltime(self, task_id: str, walltime: Optional[float]) -> bool:
+        """ジョブの経過時間の上限がパイロットの残りの経過時間内か."""
+        return walltime is None or (
+            elapse_seconds(self.inputs[task_id].elapse) <= walltime
+        )
+
+    def _take(self, walltime: Optional[float]) -> Optional[str]:
+        """残りの経過時間内に終わるジョブをキューの先頭から探して取り出す."""
+        for i, task_id in enumerate(self.queue):
+            if self._fits_walltime(task_id, walltime):
+                del self.queue[i]
+                return task_id
+        return None
+
+    async def enqueue(self, input_model: InputModel) -> PilotTaskModel:
+        """ジョブをキューに追加する."""
+        if not self.fits(input_model):
+            return PilotTaskModel(
+                status=400,
+                state="FAILED",
+                msg="requested resources exceed the pilot allocation",
+            )
+        task_id = str(uuid4())
+        self.tasks[task_id] = PilotTaskModel(
+            task_id=task_id, state="QUEUED", tmp_dir=create_tmp_dir(task_id)
+        )
+        self.inputs[task_id] = input_model
+        self.submitted_at[task_id] = time.time()
+        self.queue.append(task_id)
+        async with self.queued:
+            self.queued.notify()
+        await self.ensure_capacity()
+        return self.tasks[task_id]
+
+    async def _prune_pilots(self) -> None:
+        """終了済み・応答の無いパイロットを取り除き，実行中だったジョブをキューに戻す."""
+        now = time.monotonic()
+        # 接続後に応答が途絶えたパイロット(PJMのジョブ番号が不明なものを含む)
+        lost = [
+            pilot.pilot_id
+            for pilot in self.pilots.values()
+            if pilot.active and now - pilot.last_seen > self.lost_after
+        ]
+        pilots = [
+            pilot
+            for pilot in self.pilots.values()
+            if pilot.job_id and pilot.pilot_id not in lost
+        ]
+        if pilots:
+            stats = await get_job_status_cache().get_job_stats(
+                [pilot.job_id for pilot in pilots]
+            )
+            lost += [
+                pilot.pilot_id
+                for pilot, job_stats in zip(pilots, stats)
+                if job_stats.job_status in TERMINAL_STATUSES
+            ]
+        if not lost:
+            return
+        for pilot_id in lost:
+            self._release(pilot_id)
+        async with self.queued:
+            self.queued.notify_all()
+
+    def _release(self, pilot_id: str) -> None:
+        self.pilots.pop(pilot_id, None)
+        for task_id, task in self.tasks.items():
+            if task.state == "RUNNING" and task.pilot_id == pilot_id:
+                self._logger.info(f"pilot {pilot_id} is lost. requeue {task_id}")
+                task.state = "QUEUED"
+                task.pilot_id = ""
+                self.queue.appendleft(task_id)
+
+    async def ensure_capacity(self) -> None:
+        """キューの長さに応じてパイロットジョブを投入する."""
+        async with self._scaling:
+            await self._prune_pilots()
+            # 残りの経過時間内に終わるジョブが無いパイロットはアイドルとみなさない
+            idle = sum(
+                1
+                for pilot in self.pilots.values()
+                if not any(
+                    task.state == "RUNNING" and task.pilot_id == pilot.pilot_id
+                    for task in self.tasks.values()
+                )
+                and any(
+                    self._fits_walltime(task_id, pilot.walltime())
+                    for task_id in self.queue
+                )
+            )
+            shortage = min(len(self.queue) - idle, self.pool_size - len(self.pilots))
+            for _ in range(max(0, shortage)):
+                pilot_id = str(uuid4())
+                output = await JobExecutor(self.pilot_model).submit_pilot_job(
+                    {
+                        "server_url": self.server_url,
+                        "pilot_id": pilot_id,
+                        "idle_timeout": self.idle_timeout,
+                        "elapse": self.pilot_model.elapse,
+                    }
+                )
+                if not output.job_id:
+                    self._logger.error(f"failed to submit pilot: {output.msg}")
+                    break
+                self.pilots[pilot_id] = Pilot(pilot_id, output.job_id)
+
+    async def lease(
+        self, pilot_id: str, wait: float, walltime: Optional[float] = None
+    ) -> PilotLeaseModel:
+        """パイロットにジョブを1つ割り当てる.
+
+        walltimeを指定した場合は経過時間の上限がwalltime秒以内のジョブのみ割り当てる．
+        割り当てられるジョブが無い場合は最大wait秒待つ．
+        """
+        pilot = self.pilots.get(pilot_id)
+        if pilot is None:
+            # サーバー再起動前に投入されたパイロットも受け入れる
+            pilot = self.pilots[pilot_id] = Pilot(pilot_id, "")
+        pilot.active = True
+        pilot.last_seen = time.monotonic()
+        if walltime is not None:
+            pilot.deadline = pilot.last_seen + walltime
+        deadline = time.monotonic() + wait
+        async with self.queued:
+            while True:
+                task_id = self._take(pilot.walltime())
+                if task_id is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return PilotLeaseModel()
+                try:
+                    await asyncio.wait_for(self.queued.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return PilotLeaseModel()
+        task = self.tasks[task_id]
+        task.state = "RUNNING"
+        task.pilot_id = pilot_id
+        return PilotLeaseModel(
+            task_id=task_id, input_model=self.inputs[task_id], work_dir=task.tmp_dir
+        )
+
+    def heartbeat(self, pilot_id: str) -> None:
+        """ジョブを実行中のパイロットから生存確認を受け取る."""
+        pilot = self.pilots.get(pilot_id)
+        if pilot is not None:
+            pilot.last_seen = time.monotonic()
+
+    def complete(self, pilot_id: str, task_id: str, status: int, msg: str) -> None:
+        """パイロットからジョブの終了を受け取る."""
+        task = self.tasks.get(task_id)
+        # 再送された通知は無視する
+        if task is None or task.pilot_id != pilot_id or task.state != "RUNNING":
+            return
+        task.status = status
+        task.msg = msg
+        task.state = "DONE" if status == 0 else "FAILED"
+        input_model = self.inputs.pop(task_id)
+        # 通常のジョブと同様に実行時間をサーバーのメトリクスに集計する
+        collect_job_timings(
+            JobRecordModel(
+                job_id=task_id,
+                input_model=input_model,
+                tmp_dir=task.tmp_dir,
+                submitted_at=self.submitted_at.pop(task_id),
+            )
+        )
+
+    def release(self, pilot_id: str) -> None:
+        """アイドル状態で終了するパイロットを取り除く."""
+        self._logger.info(f"pilot {pilot_id} is released")
+        self._release(pilot_id)
+
+    async def run_forever(self, interval: float) -> None:
+        """終了したパイロットを定期的に取り除き，戻したジョブのパイロットを補充する."""
+        while True:
+            try:
+                await self.ensure_capacity()
+            except Exception as e:
+                self._logger.error(f"failed to prune pilots: {e}")
+            await asyncio.sleep(interval)
+
+    def get_tasks(self, task_ids: List[str]) -> List[PilotTaskModel]:
+        return [
+            self.tasks.get(
+                task_id,
+                PilotTaskModel(
+                    task_id=task_id, status=-1, msg="task_id does not exist"
+                ),
+            )
+            for task_id in task_ids
+        ]
+
+    def stats(self) -> PilotPoolModel:
+        states = [task.state for task in self.tasks.values()]
+        return PilotPoolModel(
+            pilots=len(self.pilots),
+            active_pilots=sum(1 for pilot in self.pilots.values() if pilot.active),
+            queued=len(self.queue),
+            running=states.count("RUNNING"),
+            pool_size=self.pool_size,
+            idle_timeout=self.idle_timeout,
+        )
+
+
+@lru_cache
+def get_pilot_manager() -> PilotManager:
+    return PilotManager(
+        pool_size=settings.PILOT_POOL_SIZE,
+        idle_timeout=settings.PILOT_IDLE_TIMEOUT,
+        vnode_core=settings.PILOT_VNODE_CORE,
+        elapse=settings.PILOT_ELAPSE,
+        server_url=settings.PILOT_SERVER_URL or f"http://{socket.gethostname()}:8000",
+        lost_after=settings.PILOT_LOST_AFTER,
+    )
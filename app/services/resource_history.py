@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from schema.create_job_schema import InputModel
+from schema.monitor_job_schema import JobRecordModel
+from services.artifact_cache import get_artifact_cache
+from services.job_packing import elapse_seconds, format_elapse
+from services.job_timing import read_job_timings
+from utils.config import settings
+
+# 履歴から資源指定を決める値
+AUTO = "auto"
+# スケッチで区別する最小の値
+MIN_VALUE = 1e-3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    key TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    sketch TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (key, metric)
+);
+"""
+
+
+class QuantileSketch:
+    """相対誤差accuracy以内の分位点を返す対数ビンのヒストグラム.
+
+    値xはgamma^(i-1) < x <= gamma^iとなるビンiで数え，ビン数は値の範囲の対数に比例する．
+    合計がmax_countを超えるとカウントを半減し，古い観測の重みを下げる．
+    """
+
+    def __init__(
+        self,
+        accuracy: float,
+        max_count: float,
+        counts: Optional[Dict[int, float]] = None,
+    ) -> None:
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.max_count = max_count
+        self.counts: Dict[int, float] = dict(counts or {})
+
+    @property
+    def count(self) -> float:
+        return sum(self.counts.values())
+
+    def add(self, value: float) -> None:
+        i = math.ceil(math.log(max(value, MIN_VALUE), self.gamma))
+        self.counts[i] = self.counts.get(i, 0.0) + 1.0
+        if self.count > self.max_count:
+            self.counts = {
+                i: count / 2 for i, count in self.counts.items() if count / 2 >= 0.01
+            }
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if not total:
+            return None
+        cumulative = 0.0
+        for i in sorted(self.counts):
+            cumulative += self.counts[i]
+            if cumulative >= q * total:
+                return self._value(i)
+        return self._value(max(self.counts))
+
+    def _value(self, i: int) -> float:
+        # ビン内の値との相対誤差がaccuracy以内となる代表値
+        return 2 * self.gamma**i / (self.gamma + 1)
+
+    def dumps(self) -> str:
+        return json.dumps(self.counts)
+
+    @classmethod
+    def loads(cls, data: str, accuracy: float, max_count: float) -> "QuantileSketch":
+        counts = {int(i): count for i, count in json.loads(data).items()}
+        return cls(accuracy, max_count, counts)
+
+
+def param_shape(value: Any) -> Any:
+    """paramsの形. 数値は2のべき乗の桁，文字列は型のみ，配列は長さの桁で区別する."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return f"num:{math.frexp(abs(value))[1] if value else 0}"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, dict):
+        return {str(key): param_shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [
+            f"len:{len(value).bit_length()}",
+            param_shape(value[0]) if value else None,
+        ]
+    return type(value).__name__
+
+
+class ResourceHistory:
+    """flow logicのバージョンとparamsの形ごとのジョブの実行時間・使用コア数の履歴.
+
+    終了したジョブがtimings.jsonに記録した実測値を分位点スケッチに逐次追加し，
+    "auto"が指定された資源指定を履歴の分位点から決める．スケッチはサーバーのメモリに
+    保持し，更新のたびにSQLiteへ保存する．
+    """
+
+    def __init__(
+        self, path: str, accuracy: float, max_count: float, min_samples: int
+    ) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.accuracy = accuracy
+        self.max_count = max_count
+        self.min_samples = min_samples
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            rows = self._conn.execute(
+                "SELECT key, metric, sketch FROM history"
+            ).fetchall()
+        self._sketches: Dict[Tuple[str, str], QuantileSketch] = {
+            (key, metric): QuantileSketch.loads(sketch, accuracy, max_count)
+            for key, metric, sketch in rows
+        }
+
+    def _digest(self, input_model: InputModel) -> Optional[str]:
+        try:
+            return get_artifact_cache().resolve(
+                input_model.project, input_model.flow_logic
+            )
+        except Exception as e:
+            self._logger.warning(f"failed to resolve {input_model.flow_logic}: {e}")
+            return None
+
+    @staticmethod
+    def keys(input_model: InputModel, digest: Optional[str]) -> List[str]:
+        """履歴のキー. 優先順に，バージョンと形・バージョン・flow logic名と形."""
+        shape = hashlib.sha256(
+            json.dumps(param_shape(input_model.params or {}), sort_keys=True).encode()
+        ).hexdigest()[:16]
+        project, name = input_model.project, input_model.flow_logic.split(":")[0]
+        keys = [f"{project}/{digest}/{shape}", f"{project}/{digest}"] if digest else []
+        return keys + [f"{project}/{name}/{shape}"]
+
+    def observe(
+        self, input_model: InputModel, digest: Optional[str], values: Dict[str, float]
+    ) -> None:
+        """実測値(実行時間(秒)・使用コア数)を履歴に追加する."""
+        now = time.time()
+        updated = []
+        with self._lock, self._conn:
+            for key in self.keys(input_model, digest):
+                for metric, value in values.items():
+                    sketch = self._sketches.setdefault(
+                        (key, metric), QuantileSketch(self.accuracy, self.max_count)
+                    )
+                    sketch.add(value)
+                    updated.append((key, metric, sketch.dumps(), now))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?)", updated
+            )
+
+    def observe_job(self, record: JobRecordModel) -> bool:
+        """正常終了したジョブの実行時間と使用コア数を履歴に追加する.
+
+        使用コア数はプロセスプールで同時に実行されていたタスク数の最大値に
+        1ワーカーのコア数を掛けたもの(それ以外の実行方法ではrun_tasks(無い場合は
+        ジョブ全体)のCPU時間を経過時間で割ったもの)．複数ノードのジョブは他ノードの
+        タスクを含まないため実行時間のみ追加する．実行時間は割り当てコア数ごとと，
+        コア数を掛けたコア時間としても追加する．
+
+        Returns:
+            bool: 履歴に追加した場合True.
+        """
+        timings = read_job_timings(record)
+        if timings is None or timings.get("status") != "ok":
+            return False
+        try:
+            phases, cpu = timings["phases"], timings.get("cpu_seconds", {})
+            values = {"elapse": phases["total"]}
+            if timings.get("cores"):
+                values[f"elapse@{timings['cores']}"] = phases["total"]
+                values["core_elapse"] = phases["total"] * timings["cores"]
+            phase = "run_tasks" if phases.get("run_tasks") else "total"
+            single_node = (record.input_model.node or 1) <= 1
+            if single_node and timings.get("peak_cores"):
+                values["cores"] = float(timings["peak_cores"])
+            elif single_node and cpu.get(phase) is not None and phases[phase] > 0:
+                values["cores"] = max(1.0, cpu[phase] / phases[phase])
+            self.observe(record.input_model, timings.get("flow_logic") or None, values)
+        except (KeyError, TypeError) as e:
+            self._logger.error(f"invalid timings of job {record.job_id}: {e}")
+            return False
+        return True
+
+    def predict(
+        self, input_model: InputModel, metric: str
+    ) -> Optional[Tuple[float, float]]:
+        """履歴の分位点. 観測数がmin_samples以上の最も詳細なキーを使用する.
+
+        Returns:
+            Optional[Tuple[float, float]]: 分位点と観測数. 履歴が無い場合はNone.
+        """
+        keys = self.keys(input_model, self._digest(input_model))
+        with self._lock:
+            for key in keys:
+                sketch = self._sketches.get((key, metric))
+                if sketch is not None and sketch.count >= self.min_samples:
+                    return sketch.quantile(settings.AUTO_SIZE_QUANTILE), sketch.count
+        return None
+
+    def predict_elapse(
+        self, input_model: InputModel, cores: Optional[int]
+    ) -> Optional[float]:
+        """コア数coresで実行した場合の経過時間(秒)の分位点.
+
+        コア数が異なる実行の経過時間で打ち切られないよう，同じコア数の履歴，
+        コア時間をコア数で割った値の順に使用する．コア数が不明(複数ノード等)の場合や
+        コア数ごとの記録より前の履歴のみの場合は全実行の経過時間とする．
+        """
+        if isinstance(cores, int) and not input_model.node:
+            predicted = self.predict(input_model, f"elapse@{cores}")
+            if predicted is not None:
+                return predicted[0]
+            predicted = self.predict(input_model, "core_elapse")
+            if predicted is not None:
+                return predicted[0] / cores
+        predicted = self.predict(input_model, "elapse")
+        return None if predicted is None else predicted[0]
+
+    def resolve(self, input_model: InputModel) -> InputModel:
+        """ "auto"が指定された経過時間・コア数を履歴から決める.
+
+        経過時間は決めたコア数での履歴，無い場合はコア時間をコア数で割った値とする．
+        履歴が無い場合はInputModelの既定値とする．
+        """
+        update: Dict[str, Any] = {}
+        if input_model.vnode_core == AUTO:
+            predicted = self.predict(input_model, "cores")
+            if predicted is None:
+                update["vnode_core"] = InputModel.model_fields["vnode_core"].default
+            else:
+                # 代表値の誤差で整数のコア数を切り上げないようにする
+                cores = math.ceil(predicted[0] * (1 - self.accuracy))
+                update["vnode_core"] = min(max(1, cores), settings.AUTO_VNODE_CORE_MAX)
+        if input_model.elapse == AUTO:
+            seconds = self.predict_elapse(
+                input_model, update.get("vnode_core", input_model.vnode_core)
+            )
+            if seconds is None:
+                update["elapse"] = InputModel.model_fields["elapse"].default
+            else:
+                seconds *= settings.AUTO_ELAPSE_MARGIN
+                # 分単位に切り上げ，上限で打ち切る
+                seconds = min(
+                    math.ceil(seconds / 60) * 60,
+                    elapse_seconds(settings.AUTO_ELAPSE_MAX),
+                )
+                update["elapse"] = format_elapse(int(seconds))
+        if not update:
+            return input_model
+        self._logger.info(f"auto resources of {input_model.flow_logic}: {update}")
+        return input_model.model_copy(update=update)
+
+
+async def resolve_auto_resources(input_models: List[InputModel]) -> List[InputModel]:
+    """ "auto"を含む資源指定を履歴から決めたInputModelのリスト."""
+    if not any(AUTO in (m.elapse, m.vnode_core) for m in input_models):
+        return input_models
+    history = get_resource_history()
+    return await asyncio.to_thread(
+        lambda: [history.resolve(input_model) for input_model in input_models]
+    )
+
+
+@lru_cache
+def get_resource_history() -> ResourceHistory:
+    return ResourceHistory(
+        settings.RESOURCE_HISTORY_PATH,
+        settings.RESOURCE_HISTORY_ACCURACY,
+        settings.RESOURCE_HISTORY_MAX_COUNT,
+        settings.AUTO_SIZE_MIN_SAMPLES,
+    )
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from schema.create_job_schema import InputModel, OutputModel
+from services.artifact_cache import get_artifact_cache
+from services.job_registry import TERMINAL_STATUSES, get_job_registry
+from utils.config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at);
+"""
+
+
+def done_marker(tmp_dir: str) -> Path:
+    """正常終了したジョブが一時ディレクトリに作成するファイル."""
+    return Path(tmp_dir) / "DONE"
+
+
+class ResultCache:
+    """同一の実験の再投入を省略するための結果キャッシュ.
+
+    キーはflow logicのダイジェスト，正規化したparams，入力Artifactのダイジェストの
+    ハッシュであり，資源指定やwandbの名前は含まない．正常終了したジョブがあれば
+    そのジョブの投入結果を返し，実行中のジョブがあればそのジョブに合流する．
+    """
+
+    def __init__(self, path: str, max_entries: int, max_age: float) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.max_entries = max_entries
+        self.max_age = max_age
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        # 投入処理中のキー. 同じキーのリクエストは投入の完了を待つ
+        self._submitting: Dict[str, asyncio.Future] = {}
+
+    def key(self, input_model: InputModel) -> str:
+        """ジョブ情報から結果のキーを計算する. Artifactのエイリアスはダイジェストに解決する."""
+        artifact_cache = get_artifact_cache()
+        params = dict(input_model.params or {})
+        artifacts = {}
+        for name in input_model.input_artifacts:
+            if isinstance(params.get(name), str):
+                artifacts[name] = artifact_cache.resolve(
+                    input_model.project, params.pop(name)
+                )
+        content = {
+            "flow_logic": artifact_cache.resolve(
+                input_model.project, input_model.flow_logic
+            ),
+            "params": params,
+            "artifacts": artifacts,
+        }
+        # タプルとリストはどちらもJSONの配列となり区別しない
+        canonical = json.dumps(
+            content, sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def lookup(self, key: str) -> Optional[Tuple[OutputModel, str]]:
+        """キーに対応するジョブを取得する.
+
+        Returns:
+            Optional[Tuple[OutputModel, str]]: ジョブの投入結果と，
+                正常終了済みなら"hit"，実行中なら"attached"．
+                期限切れ・異常終了の場合はエントリを削除しNone．
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, output, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, output, created_at = row
+        if time.time() - created_at > self.max_age:
+            self._delete(key)
+            return None
+        record = get_job_registry().get(job_id)
+        if record is None:
+            self._delete(key)
+            return None
+        if record.job_status not in TERMINAL_STATUSES:
+            state = "attached"
+        elif record.job_status == "EXT" and done_marker(record.tmp_dir).exists():
+            state = "hit"
+        else:
+            # 異常終了・キャンセルされたジョブの結果は再利用しない
+            self._delete(key)
+            return None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return OutputModel.model_validate_json(output), state
+
+    def put(self, key: str, output: OutputModel) -> None:
+        """投入に成功したジョブを記録し，古いエントリを削除する."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, output.job_id, output.model_dump_json(), now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM results WHERE created_at < ?", (now - self.max_age,)
+            )
+            self._conn.execute(
+                "DELETE FROM results WHERE key NOT IN "
+                "(SELECT key FROM results ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    async def submit(
+        self, input_model: InputModel, submit: Callable[[], Awaitable[OutputModel]]
+    ) -> OutputModel:
+        """同一の実験の結果があれば再利用し，無ければsubmitでジョブを投入する.
+
+        Args:
+            input_model (InputModel): 投入するジョブ情報.
+            submit (Callable[[], Awaitable[OutputModel]]): ジョブを投入する関数.
+
+        Returns:
+            OutputModel: 投入結果. 再利用した場合はmemoizedに"hit"または"attached".
+        """
+        try:
+            key = await asyncio.to_thread(self.key, input_model)
+        except Exception as e:
+            self._logger.error(f"failed to compute result cache key: {e}")
+            return await submit()
+        # 同じキーのリクエストは1つずつ処理し，後続は先行の投入結果に合流する
+        while key in self._submitting:
+            await asyncio.shield(self._submitting[key])
+        future = asyncio.get_running_loop().create_future()
+        self._submitting[key] = future
+        try:
+            cached = await asyncio.to_thread(self.lookup, key)
+            if cached is not None:
+                output, state = cached
+                self._logger.info(f"result cache {state}: {key} -> {output.job_id}")
+                return output.model_copy(update={"memoized": state})
+            output = await submit()
+            if output.job_id:
+                await asyncio.to_thread(self.put, key, output)
+        finally:
+            del self._submitting[key]
+            future.set_result(None)
+        return output
+
+
+@lru_cache
+def get_result_cache() -> ResultCache:
+    return ResultCache(
+        settings.RESULT_CACHE_PATH,
+        max_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+        max_age=settings.RESULT_CACHE_MAX_AGE,
+    )
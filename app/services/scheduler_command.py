@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import subprocess
+import time
+import weakref
+from functools import lru_cache
+from typing import List, MutableMapping, Optional, Sequence
+
+from services.metrics import get_metrics_registry
+from utils.config import settings
+
+# PJMが一時的な理由で要求を受け付けなかった場合の出力
+TRANSIENT_PATTERNS = (
+    "temporarily unavailable",
+    "try again",
+    "timed out",
+    "Connection refused",
+    "Connection reset",
+    "busy",
+)
+
+COMMAND_SECONDS = get_metrics_registry().histogram(
+    "hpcops_scheduler_command_seconds",
+    "Latency of scheduler command executions.",
+    ("command", "outcome"),
+)
+WAIT_SECONDS = get_metrics_registry().histogram(
+    "hpcops_scheduler_wait_seconds",
+    "Time spent waiting for a scheduler command slot.",
+    ("command",),
+)
+RETRIES = get_metrics_registry().counter(
+    "hpcops_scheduler_retries_total",
+    "Retries of scheduler commands after transient errors or timeouts.",
+    ("command",),
+)
+
+
+class SchedulerCommand:
+    """pjsub/pjstat/pjdelをasyncioのサブプロセスで実行する.
+
+    同時実行数をセマフォで制限し，コマンドごとのタイムアウトと
+    一時的なエラーに対する指数バックオフ付きのリトライを行う．
+    セマフォはイベントループごとに作成し，同時実行数はループごとに制限する．
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        timeout: float,
+        retries: int,
+        backoff: float,
+        transient_patterns: Sequence[str] = TRANSIENT_PATTERNS,
+    ) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.transient_patterns = tuple(transient_patterns)
+        # イベントループ -> セマフォ. 終了したループのセマフォは残さない
+        self._semaphores: MutableMapping[
+            asyncio.AbstractEventLoop, asyncio.Semaphore
+        ] = weakref.WeakKeyDictionary()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # パイロット・テストクライアント等が新しいループで実行しても以前のループに束縛しない
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def is_transient(self, r: subprocess.CompletedProcess) -> bool:
+        """リトライ対象の一時的なエラーかを判定する."""
+        if r.returncode == 0:
+            return False
+        output = f"{r.stdout or ''}{r.stderr or ''}"
+        return any(pattern in output for pattern in self.transient_patterns)
+
+    async def _exec(
+        self, command: List[str], timeout: float, cwd: Optional[str] = None
+    ) -> subprocess.CompletedProcess:
+        name = os.path.basename(command[0])
+        queued_at = time.perf_counter()
+        async with self.semaphore:
+            start = time.perf_counter()
+            WAIT_SECONDS.observe(start - queued_at, command=name)
+            proc = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=cwd,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                # タイムアウト・キャンセル時はプロセスを残さない
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                if isinstance(e, asyncio.TimeoutError):
+                    COMMAND_SECONDS.observe(
+                        time.perf_counter() - start, command=name, outcome="timeout"
+                    )
+                raise
+        r = subprocess.CompletedProcess(
+            command,
+            proc.returncode,
+            stdout.decode(errors="replace"),
+            stderr.decode(errors="replace"),
+        )
+        if self.is_transient(r):
+            outcome = "transient"
+        else:
+            outcome = "ok" if r.returncode == 0 else "error"
+        COMMAND_SECONDS.observe(
+            time.perf_counter() - start, command=name, outcome=outcome
+        )
+        return r
+
+    async def run(
+        self,
+        command: List[str],
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        retry_on_timeout: bool = True,
+        cwd: Optional[str] = None,
+    ) -> subprocess.CompletedProcess:
+        """スケジューラコマンドを実行する.
+
+        Args:
+            command (List[str]): 実行するコマンド.
+            timeout (Optional[float]): 1回の実行のタイムアウト(秒).
+            retries (Optional[int]): 一時的なエラーに対するリトライ回数.
+            retry_on_timeout (bool): タイムアウト時にリトライするか.
+                pjsubのように再実行で二重投入になり得るコマンドではFalseとする.
+            cwd (Optional[str]): コマンドを実行するディレクトリ.
+
+        Returns:
+            subprocess.CompletedProcess: コマンドの実行結果.
+                コマンドが存在しない場合やタイムアウト時はreturncodeが負となる.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            self._logger.info(f"command: {command}")
+            try:
+                r = await self._exec(command, timeout, cwd)
+            except asyncio.TimeoutError:
+                self._logger.error(f"command {command} timed out after {timeout}s")
+                r = subprocess.CompletedProcess(
+                    command, -1, "", f"command timed out after {timeout}s"
+                )
+                if not retry_on_timeout:
+                    return r
+            except OSError as e:
+                self._logger.error(f"command {command} could not be executed: {e}")
+                return subprocess.CompletedProcess(command, -1, "", str(e))
+            else:
+                if not self.is_transient(r):
+                    return r
+            if attempt < retries:
+                RETRIES.inc(command=os.path.basename(command[0]))
+                delay = self.backoff * 2**attempt
+                self._logger.info(f"retry {command} in {delay}s")
+                await asyncio.sleep(delay)
+        return r
+
+
+@lru_cache
+def get_scheduler_command() -> SchedulerCommand:
+    return SchedulerCommand(
+        max_concurrency=settings.SCHEDULER_MAX_CONCURRENCY,
+        timeout=settings.SCHEDULER_TIMEOUT,
+        retries=settings.SCHEDULER_RETRIES,
+        backoff=settings.SCHEDULER_BACKOFF,
+    )
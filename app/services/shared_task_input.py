@@ -0,0 +1,183 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from core.base_flow_logic import BaseFlowLogic
+from services.log_sink import WorkerLog
+from services.task_dispatch import pin_blas_threads
+from utils.config import settings
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# 共有メモリに置くDataFrameの列のdtypeの種類(bool, 整数, 浮動小数点, 複素数, 日時)
+SHAREABLE_KINDS = "biufcmM"
+# ワーカープロセス内で保持するflow logicと共有メモリ上の入力
+_worker_flow_logic: Optional[BaseFlowLogic] = None
+_worker_arrays: Dict[str, "np.ndarray"] = {}
+
+
+class SharedArray:
+    """共有メモリ上のファイルに置いたndarrayへのハンドル."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def load(self) -> "np.ndarray":
+        import numpy as np
+
+        # 同一ワーカー内の複数タスクでmmapを再利用する
+        if self.path not in _worker_arrays:
+            _worker_arrays[self.path] = np.load(self.path, mmap_mode="r")
+        return _worker_arrays[self.path]
+
+
+class SharedFrame:
+    """共有メモリ上のファイルに置いたDataFrameへのハンドル.
+
+    全列が同じdtypeの場合は1つの2次元配列としてコピーなしで復元する．
+    """
+
+    def __init__(
+        self,
+        arrays: List[SharedArray],
+        columns: List[Any],
+        index: Optional["pd.Index"],
+    ) -> None:
+        self.arrays = arrays
+        self.columns = columns
+        self.index = index
+
+    def load(self) -> "pd.DataFrame":
+        import pandas as pd
+
+        if len(self.arrays) == 1 and self.arrays[0].load().ndim == 2:
+            return pd.DataFrame(
+                self.arrays[0].load(),
+                columns=self.columns,
+                index=self.index,
+                copy=False,
+            )
+        return pd.DataFrame(
+            {col: arr.load() for col, arr in zip(self.columns, self.arrays)},
+            index=self.index,
+        )
+
+
+class SharedTaskInputs:
+    """タスク入力のndarray/DataFrameを共有メモリ上に一度だけ配置する.
+
+    with文を抜けるとタスクの成否に関わらず配置したファイルを削除する．
+    """
+
+    def __init__(self, root: str, min_bytes: int) -> None:
+        self.root = root if os.path.isdir(root) else tempfile.gettempdir()
+        self.min_bytes = min_bytes
+        self.directory = ""
+        # 同一オブジェクトを複数タスクで共有するためid単位で保持する
+        self._handles: Dict[int, Any] = {}
+        self._objects: List[Any] = []
+
+    def __enter__(self) -> "SharedTaskInputs":
+        self.directory = tempfile.mkdtemp(prefix="hpc-ops-", dir=self.root)
+        return self
+
+    def __exit__(self, *args) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._handles.clear()
+        self._objects.clear()
+
+    def _put_array(self, arr: "np.ndarray") -> SharedArray:
+        import numpy as np
+
+        path = os.path.join(self.directory, f"{uuid4()}.npy")
+        np.save(path, arr)
+        return SharedArray(path)
+
+    def _to_handle(self, obj: Any) -> Any:
+        # 未importのモジュールの型のオブジェクトは存在しないため，
+        # import済みの場合のみ判定しnumpy/pandasのimportを避ける
+        np, pd = sys.modules.get("numpy"), sys.modules.get("pandas")
+        if np is not None and isinstance(obj, np.ndarray):
+            if obj.dtype.hasobject or obj.nbytes < self.min_bytes:
+                return obj
+            return self._put_array(obj)
+        if pd is not None and isinstance(obj, pd.DataFrame):
+            if obj.memory_usage(index=False).sum() < self.min_bytes:
+                return obj
+            # Categorical・文字列・nullable整数等の拡張型やobjectの列はmmapで
+            # 復元できない(または型が変わる)ため共有しない
+            if not all(
+                isinstance(dtype, np.dtype) and dtype.kind in SHAREABLE_KINDS
+                for dtype in obj.dtypes
+            ):
+                return obj
+            index = None if isinstance(obj.index, pd.RangeIndex) else obj.index
+            if obj.dtypes.nunique() == 1:
+                arrays = [self._put_array(np.asfortranarray(obj.to_numpy()))]
+            else:
+                arrays = [self._put_array(obj[col].to_numpy()) for col in obj.columns]
+            return SharedFrame(arrays, list(obj.columns), index)
+        return obj
+
+    def share(self, task_input: Dict[str, Any]) -> Dict[str, Any]:
+        """タスク入力内の大きな配列をハンドルに置き換える.
+
+        Args:
+            task_input (Dict[str, Any]): task_schedulerが出力した1タスクの入力.
+
+        Returns:
+            Dict[str, Any]: 配列をハンドルに置き換えた入力.
+        """
+        shared_input = {}
+        for key, value in task_input.items():
+            if id(value) not in self._handles:
+                self._handles[id(value)] = self._to_handle(value)
+                # id再利用を防ぐため元オブジェクトへの参照を保持する
+                self._objects.append(value)
+            shared_input[key] = self._handles[id(value)]
+        return shared_input
+
+
+def resolve_task_input(task_input: Dict[str, Any]) -> Dict[str, Any]:
+    """ハンドルを共有メモリ上の配列・DataFrameに戻す."""
+    return {
+        key: value.load() if isinstance(value, (SharedArray, SharedFrame)) else value
+        for key, value in task_input.items()
+    }
+
+
+def init_worker(
+    flow_logic: BaseFlowLogic, blas_threads: int, log_queue: Optional[Any] = None
+) -> None:
+    """ワーカープロセスの初期化. flow logicはワーカーごとに1回だけ受け渡す."""
+    global _worker_flow_logic
+    _worker_flow_logic = flow_logic
+    if log_queue is not None:
+        flow_logic.sink = WorkerLog(log_queue.put, settings.LOG_FLUSH_INTERVAL)
+    pin_blas_threads(blas_threads)
+
+
+def run_shared_chunk(
+    task_inputs: List[Dict[str, Any]],
+) -> Tuple[List[Any], float, List[float], int]:
+    """ワーカープロセスでチャンク内のタスクを順に実行する.
+
+    Returns:
+        Tuple[List[Any], float, List[float], int]: タスク結果のリスト，
+            チャンクの実行時間(秒)，タスクごとの実行時間(秒)，ワーカーのPID.
+    """
+    start = time.perf_counter()
+    results, durations = [], []
+    for task_input in task_inputs:
+        task_start = time.perf_counter()
+        results.append(_worker_flow_logic.run_task(**resolve_task_input(task_input)))
+        durations.append(time.perf_counter() - task_start)
+    if _worker_flow_logic.sink is not None:
+        _worker_flow_logic.sink.flush()
+    return results, time.perf_counter() - start, durations, os.getpid()
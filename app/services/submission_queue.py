@@ -0,0 +1,396 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+from schema.create_job_schema import InputModel, OutputModel
+from schema.submission_queue_schema import (
+    SubmissionGroupModel,
+    SubmissionQueueModel,
+    SubmissionTicketModel,
+)
+from services.job_executor import JobExecutor
+from services.job_registry import TERMINAL_STATUSES
+from services.job_status_cache import get_job_status_cache
+from services.metrics import get_metrics_registry
+from services.scheduler_command import TRANSIENT_PATTERNS
+from utils.config import settings
+
+PRIORITIES = ("high", "normal", "low")
+# 投入数の上限によりpjsubが拒否した場合の出力(正規表現). 時間をおいて再投入する．
+# 経過時間・資源量の上限超過などの恒久的なエラーは含めない
+REJECTION_PATTERNS = (
+    r"PJM \d+ pjsub .*job count limit",
+    r"PJM \d+ pjsub .*(too many jobs|number of (submitted )?jobs)",
+)
+
+QUEUE_WAIT_SECONDS = get_metrics_registry().histogram(
+    "hpcops_submission_queue_wait_seconds",
+    "Time from enqueue to successful submission.",
+    ("resource_group", "priority"),
+)
+
+
+class TokenBucket:
+    """一定レートで補充されるトークンにより投入の頻度を制限する."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._updated_at = time.monotonic()
+
+    def _fill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def available(self) -> float:
+        self._fill()
+        return self.tokens
+
+    def take(self) -> bool:
+        self._fill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self) -> float:
+        """次のトークンが補充されるまでの時間(秒)."""
+        self._fill()
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else 1.0
+
+
+class SubmissionQueue:
+    """ジョブの投入要求を受け付け，リソースグループごとの制限内で順に投入する.
+
+    リソースグループごとにトークンバケットで投入頻度を，未終了のジョブ数で
+    同時投入数を制限する．優先度の高いジョブから投入し，同じ優先度では
+    未終了のジョブが少ないプロジェクトから投入する(フェアシェア)．
+    投入数の上限による拒否・一時的なエラーは指数バックオフで再投入する．
+    状態が確定したチケットはretention秒後に削除する．
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        max_in_flight: int,
+        group_limits: Dict[str, int],
+        max_attempts: int,
+        backoff: float,
+        retention: float,
+        rejection_patterns: Sequence[str] = REJECTION_PATTERNS,
+        transient_patterns: Sequence[str] = TRANSIENT_PATTERNS,
+    ) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.group_limits = group_limits
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.retention = retention
+        self.rejection_patterns = [
+            re.compile(pattern, re.IGNORECASE) for pattern in rejection_patterns
+        ]
+        self.transient_patterns = tuple(transient_patterns)
+        self.tickets: Dict[str, SubmissionTicketModel] = {}
+        self.inputs: Dict[str, InputModel] = {}
+        self.queued_at: Dict[str, float] = {}
+        # 状態が確定したチケット -> 確定した時刻. 確定した順に並ぶ
+        self.finished_at: Dict[str, float] = {}
+        # リソースグループ -> 優先度 -> プロジェクト -> 待ち状態のチケット
+        self.queues: Dict[str, Dict[str, Dict[str, Deque[str]]]] = {}
+        # リソースグループ -> 投入中のチケットID・未終了のジョブID -> (プロジェクト, 投入時刻)
+        self.in_flight: Dict[str, Dict[str, Tuple[str, float]]] = {}
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.paused_until: Dict[str, float] = {}
+        self.submitted = 0
+        self.failed = 0
+        self.retries = 0
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def limit(self, group: str) -> int:
+        return self.group_limits.get(group, self.max_in_flight)
+
+    def bucket(self, group: str) -> TokenBucket:
+        if group not in self.buckets:
+            self.buckets[group] = TokenBucket(self.rate, self.burst)
+        return self.buckets[group]
+
+    def _push(self, ticket_id: str, front: bool = False) -> None:
+        ticket = self.tickets[ticket_id]
+        queue = (
+            self.queues.setdefault(ticket.resource_group, {})
+            .setdefault(ticket.priority, {})
+            .setdefault(ticket.project, deque())
+        )
+        if front:
+            queue.appendleft(ticket_id)
+        else:
+            queue.append(ticket_id)
+
+    def enqueue(
+        self, input_models: List[InputModel], priority: str = "normal"
+    ) -> List[SubmissionTicketModel]:
+        """ジョブを投入キューに追加する."""
+        tickets = []
+        for input_model in input_models:
+            ticket_id = str(uuid4())
+            self.tickets[ticket_id] = SubmissionTicketModel(
+                ticket_id=ticket_id,
+                state="QUEUED",
+                priority=priority,
+                project=input_model.project,
+                resource_group=input_model.resource_group or settings.RESOURCE_GROUP,
+            )
+            self.inputs[ticket_id] = input_model
+            self.queued_at[ticket_id] = time.monotonic()
+            self._push(ticket_id)
+            tickets.append(self.tickets[ticket_id])
+        self.wakeup.set()
+        return tickets
+
+    def cancel(self, ticket_ids: List[str]) -> List[SubmissionTicketModel]:
+        """待ち状態のジョブを取り消す. 投入済のジョブはdelete-jobで削除する."""
+        for ticket_id in ticket_ids:
+            ticket = self.tickets.get(ticket_id)
+            if ticket is None or ticket.state != "QUEUED":
+                continue
+            queue = self.queues[ticket.resource_group][ticket.priority][ticket.project]
+            queue.remove(ticket_id)
+            ticket.state = "CANCELLED"
+            self.inputs.pop(ticket_id, None)
+            self._finish(ticket_id)
+        return self.get_tickets(ticket_ids)
+
+    def get_tickets(self, ticket_ids: List[str]) -> List[SubmissionTicketModel]:
+        return [
+            self.tickets.get(ticket_id)
+            or SubmissionTicketModel(
+                ticket_id=ticket_id, status=404, msg="ticket is not found"
+            )
+            for ticket_id in ticket_ids
+        ]
+
+    def _has_queued(self, group: str) -> bool:
+        return any(
+            queue
+            for projects in self.queues.get(group, {}).values()
+            for queue in projects.values()
+        )
+
+    def _next(self, group: str) -> Optional[str]:
+        """次に投入するチケットを選ぶ. 優先度順に，未終了のジョブが少ないプロジェクトから."""
+        in_flight_by_project: Dict[str, int] = {}
+        for project, _ in self.in_flight.get(group, {}).values():
+            in_flight_by_project[project] = in_flight_by_project.get(project, 0) + 1
+        for priority in PRIORITIES:
+            projects = self.queues.get(group, {}).get(priority, {})
+            candidates = [project for project, queue in projects.items() if queue]
+            if candidates:
+                project = min(
+                    candidates,
+                    key=lambda p: (
+                        in_flight_by_project.get(p, 0),
+                        self.queued_at[projects[p][0]],
+                    ),
+                )
+                return projects[project].popleft()
+        return None
+
+    async def _refresh_in_flight(self) -> None:
+        """終了したジョブを未終了のジョブ数から除く."""
+        job_ids = [
+            job_id
+            for jobs in self.in_flight.values()
+            for job_id in jobs
+            if job_id not in self.tickets
+        ]
+        if not job_ids:
+            return
+        stats = await get_job_status_cache().get_job_stats(job_ids)
+        now = time.time()
+        for job_id, job_stats in zip(job_ids, stats):
+            for jobs in self.in_flight.values():
+                if job_id not in jobs:
+                    continue
+                _, submitted_at = jobs[job_id]
+                # 投入直後はpjstatに表示されない場合があるため一定時間は未終了とみなす
+                lost = (
+                    not job_stats.job_status
+                    and now - submitted_at > settings.JOB_REGISTRY_LOST_AFTER
+                )
+                if job_stats.job_status in TERMINAL_STATUSES or lost:
+                    del jobs[job_id]
+
+    def _is_rejection(self, output: OutputModel) -> bool:
+        # タイムアウトしたpjsubは投入済の可能性があるため再投入しない
+        if output.status == -1:
+            return False
+        if any(pattern.search(output.msg) for pattern in self.rejection_patterns):
+            return True
+        return any(pattern in output.msg for pattern in self.transient_patterns)
+
+    def _finish(self, ticket_id: str) -> None:
+        self.finished_at[ticket_id] = time.monotonic()
+
+    def _evict(self) -> None:
+        """状態が確定してからretention秒を過ぎたチケットを削除する."""
+        deadline = time.monotonic() - self.retention
+        for ticket_id, finished_at in list(self.finished_at.items()):
+            if finished_at > deadline:
+                break
+            del self.finished_at[ticket_id]
+            self.tickets.pop(ticket_id, None)
+            self.inputs.pop(ticket_id, None)
+            self.queued_at.pop(ticket_id, None)
+
+    async def _submit(self, ticket_id: str) -> None:
+        ticket = self.tickets[ticket_id]
+        group = ticket.resource_group
+        input_model = self.inputs[ticket_id]
+        ticket.attempts += 1
+        try:
+            output = await JobExecutor(input_model).submit_job(input_model)
+        except Exception as e:
+            output = OutputModel(status=1, msg=f"{e}(submit error)")
+        in_flight = self.in_flight.setdefault(group, {})
+        in_flight.pop(ticket_id, None)
+        if output.job_id:
+            ticket.state = "SUBMITTED"
+            ticket.output = output
+            ticket.msg = output.msg
+            in_flight[output.job_id] = (ticket.project, time.time())
+            self.inputs.pop(ticket_id, None)
+            self.submitted += 1
+            QUEUE_WAIT_SECONDS.observe(
+                time.monotonic() - self.queued_at[ticket_id],
+                resource_group=group,
+                priority=ticket.priority,
+            )
+            self._finish(ticket_id)
+        elif self._is_rejection(output) and ticket.attempts < self.max_attempts:
+            # 一時的な拒否はリソースグループ全体の投入を止めてから再投入する
+            delay = min(300.0, self.backoff * 2 ** (ticket.attempts - 1))
+            self._logger.info(
+                f"submission of {ticket_id} is rejected. retry after {delay}s: {output.msg}"
+            )
+            self.paused_until[group] = max(
+                self.paused_until.get(group, 0.0), time.monotonic() + delay
+            )
+            ticket.state = "QUEUED"
+            ticket.msg = output.msg
+            self._push(ticket_id, front=True)
+            self.retries += 1
+        else:
+            ticket.state = "FAILED"
+            ticket.status = output.status or 1
+            ticket.output = output
+            ticket.msg = output.msg
+            self.inputs.pop(ticket_id, None)
+            self.failed += 1
+            self._finish(ticket_id)
+        self.wakeup.set()
+
+    async def drain(self) -> None:
+        """制限の範囲内で待ち状態のジョブを投入する."""
+        self._evict()
+        await self._refresh_in_flight()
+        now = time.monotonic()
+        for group in list(self.queues):
+            if self.paused_until.get(group, 0.0) > now:
+                continue
+            in_flight = self.in_flight.setdefault(group, {})
+            bucket = self.bucket(group)
+            while (
+                len(in_flight) < self.limit(group)
+                and self._has_queued(group)
+                and bucket.take()
+            ):
+                ticket_id = self._next(group)
+                self.tickets[ticket_id].state = "SUBMITTING"
+                in_flight[ticket_id] = (self.tickets[ticket_id].project, time.time())
+                asyncio.ensure_future(self._submit(ticket_id))
+
+    async def run_forever(self, interval: float) -> None:
+        """投入キューを処理し続ける. 新しいジョブの追加・投入の完了時に即座に処理する."""
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                self._logger.error(f"failed to drain submission queue: {e}")
+            self.wakeup.clear()
+            # トークンの補充・投入の再開を待つ
+            now = time.monotonic()
+            timeout = interval
+            for group in self.queues:
+                if not self._has_queued(group):
+                    continue
+                wait = max(
+                    self.bucket(group).wait_time(),
+                    self.paused_until.get(group, 0.0) - now,
+                )
+                timeout = min(timeout, max(0.01, wait))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> SubmissionQueueModel:
+        now = time.monotonic()
+        groups = {}
+        for group in set(self.queues) | set(self.in_flight):
+            groups[group] = SubmissionGroupModel(
+                queued=sum(
+                    len(queue)
+                    for projects in self.queues.get(group, {}).values()
+                    for queue in projects.values()
+                ),
+                in_flight=len(self.in_flight.get(group, {})),
+                max_in_flight=self.limit(group),
+                tokens=self.bucket(group).available(),
+                paused_for=max(0.0, self.paused_until.get(group, 0.0) - now),
+            )
+        return SubmissionQueueModel(
+            groups=groups,
+            queued={
+                priority: sum(
+                    len(queue)
+                    for priorities in self.queues.values()
+                    for queue in priorities.get(priority, {}).values()
+                )
+                for priority in PRIORITIES
+            },
+            submitted=self.submitted,
+            failed=self.failed,
+            retries=self.retries,
+        )
+
+
+@lru_cache
+def get_submission_queue() -> SubmissionQueue:
+    return SubmissionQueue(
+        rate=settings.SUBMIT_RATE,
+        burst=settings.SUBMIT_BURST,
+        max_in_flight=settings.SUBMIT_MAX_IN_FLIGHT,
+        group_limits=settings.SUBMIT_GROUP_LIMITS,
+        max_attempts=settings.SUBMIT_MAX_ATTEMPTS,
+        backoff=settings.SUBMIT_BACKOFF,
+        retention=settings.SUBMIT_TICKET_RETENTION,
+        rejection_patterns=settings.SUBMIT_REJECTION_PATTERNS or REJECTION_PATTERNS,
+    )
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from schema.monitor_job_schema import JobRecordModel
+from services.job_timing import BULK_JOB_ID
+
+# 1レコードの長さ. レコードは(タスクのキー, タスク結果)のpickle
+RECORD_HEADER = struct.Struct("<I")
+# 型ごとに区別してハッシュする値. それ以外はpickleしてハッシュする
+PRIMITIVE_TYPES = (str, int, float, bool, type(None))
+
+
+def checkpoint_path(tmp_dir: str, bulk_num: Optional[int] = None) -> Path:
+    """タスク結果を追記するファイル. バルクジョブではサブジョブごとに分ける."""
+    name = "checkpoint.bin" if bulk_num is None else f"checkpoint_{bulk_num}.bin"
+    return Path(tmp_dir) / name
+
+
+def job_checkpoint_path(record: JobRecordModel) -> Path:
+    """レジストリのジョブに対応するタスク結果のファイル."""
+    m = BULK_JOB_ID.search(record.job_id)
+    return checkpoint_path(record.tmp_dir, int(m.group("bulk_num")) if m else None)
+
+
+def copy_checkpoint(source: Path, tmp_dir: str) -> bool:
+    """再投入するジョブの一時ディレクトリに以前のジョブのタスク結果を複製する."""
+    if not source.exists():
+        return False
+    shutil.copyfile(source, checkpoint_path(tmp_dir))
+    return True
+
+
+def task_keys(task_inputs: List[Dict[str, Any]]) -> List[str]:
+    """タスク入力ごとの安定したキー.
+
+    辞書はキーの順序によらず，値は型を区別してハッシュする．
+    タスク間で共有される大きな配列等は一度だけpickleする．
+    同じ入力のタスクが複数ある場合(試行回数を等分したstudyのタスク等)も
+    別々に記録されるよう，ハッシュに同じ入力の中での出現順を付ける．
+    """
+    digests: Dict[int, bytes] = {}
+
+    def feed(h: Any, value: Any) -> None:
+        if isinstance(value, PRIMITIVE_TYPES):
+            h.update(f"{type(value).__name__}:{value!r};".encode())
+        elif isinstance(value, dict):
+            items = sorted(value.items(), key=lambda item: repr(item[0]))
+            h.update(f"dict:{len(items)};".encode())
+            for key, item in items:
+                feed(h, key)
+                feed(h, item)
+        elif isinstance(value, (list, tuple)):
+            h.update(f"{type(value).__name__}:{len(value)};".encode())
+            for item in value:
+                feed(h, item)
+        else:
+            digest = digests.get(id(value))
+            if digest is None:
+                digest = hashlib.sha256(pickle.dumps(value, protocol=4)).digest()
+                digests[id(value)] = digest
+            h.update(b"object:" + digest)
+
+    keys = []
+    occurrences: Dict[str, int] = {}
+    for task_input in task_inputs:
+        h = hashlib.sha256()
+        feed(h, task_input)
+        digest = h.hexdigest()
+        n = occurrences.get(digest, 0)
+        occurrences[digest] = n + 1
+        keys.append(f"{digest}-{n}")
+    return keys
+
+
+class TaskCheckpoint:
+    """完了したタスクの結果をジョブの一時ディレクトリに追記するストア.
+
+    タスク結果はチャンクの完了ごとにタスク入力のハッシュをキーとして追記され，
+    同じ一時ディレクトリで再実行(または結果を複製して再投入)したジョブは
+    完了済みのタスクを実行せずに記録した結果を使用する．
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.path = Path(path)
+        # 実行するタスクの番号 -> キー
+        self.keys: List[str] = []
+        self._file: Optional[Any] = None
+
+    def _load(self) -> Dict[str, Any]:
+        """記録済みのタスク結果. 書き込み途中で終了した末尾のレコードは切り捨てる."""
+        finished: Dict[str, Any] = {}
+        if not self.path.exists():
+            return finished
+        valid = 0
+        with open(self.path, "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                (size,) = RECORD_HEADER.unpack(header)
+                data = f.read(size)
+                if len(data) < size:
+                    break
+                try:
+                    key, result = pickle.loads(data)
+                except Exception:
+                    break
+                finished[key] = result
+                valid = f.tell()
+        if valid < self.path.stat().st_size:
+            self._logger.warning(f"discard incomplete checkpoint record in {self.path}")
+            os.truncate(self.path, valid)
+        return finished
+
+    def resume(
+        self, task_inputs: List[Dict[str, Any]]
+    ) -> Tuple[List[Dict[str, Any]], List[Any]]:
+        """記録済みのタスクを除く.
+
+        Args:
+            task_inputs (List[Dict[str, Any]]): パラメータを結合済みのタスク入力.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], List[Any]]: 実行するタスク入力, 記録済みのタスク結果.
+        """
+        keys = task_keys(task_inputs)
+        finished = self._load()
+        remaining = [
+            task_input
+            for task_input, key in zip(task_inputs, keys)
+            if key not in finished
+        ]
+        self.keys = [key for key in keys if key not in finished]
+        results = [finished[key] for key in keys if key in finished]
+        if results:
+            self._logger.info(
+                f"{len(results)} finished tasks are restored from {self.path}"
+            )
+        return remaining, results
+
+    def record(self, indices: List[int], results: List[Any]) -> None:
+        """完了したタスクの結果を追記する.
+
+        Args:
+            indices (List[int]): resumeが返したタスク入力の番号.
+            results (List[Any]): indicesの順のタスク結果.
+        """
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        records = []
+        for i, result in zip(indices, results):
+            data = pickle.dumps(
+                (self.keys[i], result), protocol=pickle.HIGHEST_PROTOCOL
+            )
+            records += [RECORD_HEADER.pack(len(data)), data]
+        self._file.write(b"".join(records))
+        # プロセスが強制終了されても記録が残るよう，チャンクごとにOSへ渡す
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,95 @@
+import logging
+import math
+import os
+from typing import Optional
+
+from schema.create_job_schema import InputModel
+
+# ワーカーごとのスレッド数を制限するBLAS/OpenMPの環境変数
+BLAS_THREAD_ENVS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def available_cores() -> int:
+    """このプロセスが利用可能なコア数(cpusetによる制限を反映)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def granted_cores(input_model: InputModel) -> int:
+    """ジョブに割り当てられたコア数を取得する.
+
+    PJMの環境変数，InputModelの資源指定の順に参照し，
+    実際に利用可能なコア数を上限とする．
+    """
+    available = available_cores()
+    pjm_vnode_core = os.getenv("PJM_VNODE_CORE", "")
+    if pjm_vnode_core.isdigit():
+        granted = int(pjm_vnode_core)
+    elif input_model.node:
+        granted = available
+    elif input_model.vnode_core:
+        granted = input_model.vnode_core
+    else:
+        granted = available
+    return max(1, min(granted, available))
+
+
+def pin_blas_threads(n_threads: int) -> None:
+    """BLAS/OpenMPのスレッド数を制限する. ワーカープロセスの初期化時に呼ぶ."""
+    for env in BLAS_THREAD_ENVS:
+        os.environ[env] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(n_threads)
+
+
+class ChunkSizer:
+    """タスクをまとめて投入する単位(チャンク)の大きさを実行時間から調整する.
+
+    1チャンクの実行時間がtarget_secondsとなるよう，完了したチャンクの
+    タスクあたり実行時間の指数移動平均からチャンクサイズを決める．
+    終盤の負荷の偏りを避けるため，残りタスクをワーカー数で割った値を上限とする．
+    """
+
+    def __init__(
+        self, n_workers: int, target_seconds: float, max_chunk: int, alpha: float = 0.3
+    ) -> None:
+        self._logger = logging.getLogger("uvicorn")
+        self.n_workers = n_workers
+        self.target_seconds = target_seconds
+        self.max_chunk = max_chunk
+        self.alpha = alpha
+        self.seconds_per_task: Optional[float] = None
+        self.n_chunks = 0
+
+    def next_size(self, remaining: int) -> int:
+        if self.seconds_per_task is None:
+            size = 1
+        elif self.seconds_per_task == 0:
+            size = self.max_chunk
+        else:
+            size = int(self.target_seconds / self.seconds_per_task)
+        balanced = math.ceil(remaining / (self.n_workers * 2))
+        return max(1, min(size, self.max_chunk, balanced, remaining))
+
+    def record(self, n_tasks: int, elapsed: float) -> None:
+        """完了したチャンクの実行時間を反映する."""
+        per_task = elapsed / n_tasks
+        if self.seconds_per_task is None:
+            self.seconds_per_task = per_task
+        else:
+            self.seconds_per_task += self.alpha * (per_task - self.seconds_per_task)
+        self.n_chunks += 1
+        self._logger.debug(
+            f"chunk {self.n_chunks}: {n_tasks} tasks in {elapsed:.3f}s "
+            f"(ema {self.seconds_per_task:.4f}s/task)"
+        )
@@ -1,3 +1,4 @@
+import json
 import os
 from functools import lru_cache
 from pathlib import Path
@@ -11,8 +12,114 @@ load_dotenv()
 class Settings(BaseSettings):
     # 環境変数ロード
     BASE_DIR_PATH: str = str(Path(__file__).parent.parent.parent.absolute())
+    # サーバーの状態(ジョブレジストリ等のDB・Artifactキャッシュ)の既定の保存先
+    STATE_DIR: str = os.getenv("STATE_DIR", str(Path(BASE_DIR_PATH) / "var"))
     RESOURCE_GROUP: str = os.getenv("RESOURCE_GROUP")
     WANDB_APIKEY: str = os.getenv("WANDB_APIKEY")
+    # pjstatスナップショットの有効期間(秒)と終了済ジョブの保持数
+    JOB_STATUS_CACHE_TTL: float = float(os.getenv("JOB_STATUS_CACHE_TTL", "5"))
+    JOB_STATUS_HISTORY_SIZE: int = int(os.getenv("JOB_STATUS_HISTORY_SIZE", "10000"))
+    # スケジューラコマンドの同時実行数・タイムアウト(秒)・リトライ設定
+    SCHEDULER_MAX_CONCURRENCY: int = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "8"))
+    SCHEDULER_TIMEOUT: float = float(os.getenv("SCHEDULER_TIMEOUT", "60"))
+    SCHEDULER_RETRIES: int = int(os.getenv("SCHEDULER_RETRIES", "3"))
+    SCHEDULER_BACKOFF: float = float(os.getenv("SCHEDULER_BACKOFF", "1"))
+    # Artifactキャッシュの保存先とエイリアス解決の有効期間(秒)
+    ARTIFACT_CACHE_DIR: str = os.getenv(
+        "ARTIFACT_CACHE_DIR", str(Path(STATE_DIR) / "artifact_cache")
+    )
+    ARTIFACT_ALIAS_TTL: float = float(os.getenv("ARTIFACT_ALIAS_TTL", "300"))
+    # タスク入力を共有メモリに配置する際の配置先と最小サイズ(byte)
+    SHARED_INPUT_DIR: str = os.getenv("SHARED_INPUT_DIR", "/dev/shm")
+    SHARED_INPUT_MIN_BYTES: int = int(os.getenv("SHARED_INPUT_MIN_BYTES", "1048576"))
+    # タスクをまとめて投入する際の1チャンクの目標実行時間(秒)と最大タスク数
+    TASK_CHUNK_SECONDS: float = float(os.getenv("TASK_CHUNK_SECONDS", "0.5"))
+    TASK_MAX_CHUNK: int = int(os.getenv("TASK_MAX_CHUNK", "1024"))
+    # タスクの実行方法が"thread"・"asyncio"の場合の既定の同時実行数
+    TASK_CONCURRENCY: int = int(os.getenv("TASK_CONCURRENCY", "32"))
+    # 完了したタスクの結果をジョブの一時ディレクトリに記録し，再実行時に省略するか
+    TASK_CHECKPOINT: bool = os.getenv("TASK_CHECKPOINT", "1") == "1"
+    # 他ノードでワーカーを起動するコマンド
+    NODE_LAUNCHER: str = os.getenv("NODE_LAUNCHER", "pjrsh")
+    # パイロットジョブの上限数・アイドル時間(秒)・資源指定と，ワーカーの接続先
+    PILOT_POOL_SIZE: int = int(os.getenv("PILOT_POOL_SIZE", "2"))
+    PILOT_IDLE_TIMEOUT: float = float(os.getenv("PILOT_IDLE_TIMEOUT", "600"))
+    PILOT_VNODE_CORE: int = int(os.getenv("PILOT_VNODE_CORE", "4"))
+    PILOT_ELAPSE: str = os.getenv("PILOT_ELAPSE", "06:00:00")
+    PILOT_SERVER_URL: str = os.getenv("PILOT_SERVER_URL", "")
+    # パイロットの生存確認の送信間隔(秒)・応答が途絶えたパイロットを取り除くまでの時間(秒)・
+    # 終了したパイロットを取り除く間隔(秒)
+    PILOT_HEARTBEAT_INTERVAL: float = float(os.getenv("PILOT_HEARTBEAT_INTERVAL", "60"))
+    PILOT_LOST_AFTER: float = float(os.getenv("PILOT_LOST_AFTER", "300"))
+    PILOT_PRUNE_INTERVAL: float = float(os.getenv("PILOT_PRUNE_INTERVAL", "30"))
+    # ジョブレジストリの保存先・状態の更新間隔(秒)・追跡を終えるまでの時間(秒)
+    JOB_REGISTRY_PATH: str = os.getenv(
+        "JOB_REGISTRY_PATH", str(Path(STATE_DIR) / "job_registry.db")
+    )
+    JOB_REGISTRY_INTERVAL: float = float(os.getenv("JOB_REGISTRY_INTERVAL", "30"))
+    JOB_REGISTRY_LOST_AFTER: float = float(
+        os.getenv("JOB_REGISTRY_LOST_AFTER", "86400")
+    )
+    # ジョブ状態の配信間隔(秒)とクライアントごとに保持するイベント数
+    JOB_STATUS_STREAM_INTERVAL: float = float(
+        os.getenv("JOB_STATUS_STREAM_INTERVAL", "5")
+    )
+    JOB_STATUS_STREAM_QUEUE_SIZE: int = int(
+        os.getenv("JOB_STATUS_STREAM_QUEUE_SIZE", "1000")
+    )
+    # ジョブのメトリクスの出力先("wandb" or "file")とdriverでまとめて書き込む間隔(秒)
+    LOG_SINK: str = os.getenv("LOG_SINK", "wandb")
+    LOG_FLUSH_INTERVAL: float = float(os.getenv("LOG_FLUSH_INTERVAL", "10"))
+    # wandb runのモード("online" or "offline")と，オフライン時のアップロード方法
+    # ("server": ジョブ終了後にサーバーから, "background": 実行中に一定間隔で, "none")
+    WANDB_RUN_MODE: str = os.getenv("WANDB_RUN_MODE", "online")
+    WANDB_SYNC: str = os.getenv("WANDB_SYNC", "server")
+    WANDB_SYNC_INTERVAL: float = float(os.getenv("WANDB_SYNC_INTERVAL", "300"))
+    # 結果キャッシュの保存先・最大エントリ数・有効期間(秒)
+    RESULT_CACHE_PATH: str = os.getenv(
+        "RESULT_CACHE_PATH", str(Path(STATE_DIR) / "result_cache.db")
+    )
+    RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+    RESULT_CACHE_MAX_AGE: float = float(os.getenv("RESULT_CACHE_MAX_AGE", "604800"))
+    # パックジョブ1つあたりのコア数と経過時間の上限
+    PACK_MAX_CORES: int = int(os.getenv("PACK_MAX_CORES", "48"))
+    PACK_MAX_ELAPSE: str = os.getenv("PACK_MAX_ELAPSE", "06:00:00")
+    # 投入キューのリソースグループごとの投入レート(件/秒)・バースト数・未終了ジョブ数の上限.
+    # SUBMIT_GROUP_LIMITSはリソースグループごとの上限(JSON)
+    SUBMIT_RATE: float = float(os.getenv("SUBMIT_RATE", "1"))
+    SUBMIT_BURST: int = int(os.getenv("SUBMIT_BURST", "10"))
+    SUBMIT_MAX_IN_FLIGHT: int = int(os.getenv("SUBMIT_MAX_IN_FLIGHT", "100"))
+    SUBMIT_GROUP_LIMITS: dict = json.loads(os.getenv("SUBMIT_GROUP_LIMITS", "{}"))
+    # 一時的に拒否された投入の最大試行回数・バックオフ(秒)と投入キューの確認間隔(秒)
+    SUBMIT_MAX_ATTEMPTS: int = int(os.getenv("SUBMIT_MAX_ATTEMPTS", "10"))
+    SUBMIT_BACKOFF: float = float(os.getenv("SUBMIT_BACKOFF", "5"))
+    SUBMIT_QUEUE_INTERVAL: float = float(os.getenv("SUBMIT_QUEUE_INTERVAL", "5"))
+    # 投入数の上限による拒否とみなすpjsubの出力(正規表現のJSONリスト. 空の場合は既定値)と，
+    # 投入済・失敗・取り消したチケットを保持する時間(秒)
+    SUBMIT_REJECTION_PATTERNS: list = json.loads(
+        os.getenv("SUBMIT_REJECTION_PATTERNS", "[]")
+    )
+    SUBMIT_TICKET_RETENTION: float = float(os.getenv("SUBMIT_TICKET_RETENTION", "3600"))
+    # ジョブの実行時間・使用コア数の履歴の保存先・分位点の相対誤差・観測数の上限(超えると古い観測を半減)
+    RESOURCE_HISTORY_PATH: str = os.getenv(
+        "RESOURCE_HISTORY_PATH", str(Path(STATE_DIR) / "resource_history.db")
+    )
+    RESOURCE_HISTORY_ACCURACY: float = float(
+        os.getenv("RESOURCE_HISTORY_ACCURACY", "0.01")
+    )
+    RESOURCE_HISTORY_MAX_COUNT: float = float(
+        os.getenv("RESOURCE_HISTORY_MAX_COUNT", "200")
+    )
+    # "auto"の資源指定に使用する分位点・必要な観測数・経過時間の余裕(倍率)と上限・コア数の上限
+    AUTO_SIZE_QUANTILE: float = float(os.getenv("AUTO_SIZE_QUANTILE", "0.95"))
+    AUTO_SIZE_MIN_SAMPLES: int = int(os.getenv("AUTO_SIZE_MIN_SAMPLES", "3"))
+    AUTO_ELAPSE_MARGIN: float = float(os.getenv("AUTO_ELAPSE_MARGIN", "1.2"))
+    AUTO_ELAPSE_MAX: str = os.getenv("AUTO_ELAPSE_MAX", "24:00:00")
+    AUTO_VNODE_CORE_MAX: int = int(os.getenv("AUTO_VNODE_CORE_MAX", "48"))
+    # ジョブ出力の1回の読み込みの上限(バイト)・行インデックスの間隔(行)・追跡の確認間隔(秒)
+    LOG_TAIL_MAX_BYTES: int = int(os.getenv("LOG_TAIL_MAX_BYTES", "1048576"))
+    LOG_INDEX_STRIDE: int = int(os.getenv("LOG_INDEX_STRIDE", "1000"))
+    LOG_FOLLOW_INTERVAL: float = float(os.getenv("LOG_FOLLOW_INTERVAL", "1"))
 
     # BASE_CONFIG: dict = yaml.safe_load(
     #    open(str(Path(BASE_DIR_PATH) / "main.yaml"), "r", encoding="utf-8_sig")
@@ -0,0 +1,213 @@
+"""APIのスループットとテールレイテンシを代替のPJM上で測定する.
+
+ジョブ数ごとに新しい環境でサーバーを起動し，以下を測定する．
+
+    create-job: 1ジョブずつの/create-job
+    create-multi-job: batchジョブずつの/create-multi-job
+    create-multi-job-bulk: batchジョブずつの/create-multi-job(bulk=True)
+    job-status: status-batch件ずつの/job-status(投入済の全ジョブから無作為に選択)
+
+使い方:
+    python benchmarks/api_throughput.py --jobs 1000 10000 --output results.jsonl
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import Server, env_info, fake_env, pjm_calls, summarize, write_result  # noqa: E402
+
+SCENARIOS = ("create-job", "create-multi-job", "create-multi-job-bulk", "job-status")
+
+
+def job(i: int) -> Dict[str, Any]:
+    return {
+        "project": "benchmark",
+        "group": f"g{i % 10}",
+        "flow_logic": "bench_flow_logic:latest",
+        "params": {"i": i},
+    }
+
+
+async def run_requests(
+    url: str, bodies: List[Tuple[str, str, Any]], concurrency: int
+) -> Tuple[List[float], List[Any], int, float]:
+    """リクエストを同時実行数concurrencyで送信する.
+
+    Returns:
+        Tuple[List[float], List[Any], int, float]: レイテンシ(秒), レスポンス,
+            エラー数, 全体の経過時間(秒).
+    """
+    latencies: List[float] = []
+    responses: List[Any] = [None] * len(bodies)
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in enumerate(bodies):
+        queue.put_nowait(item)
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        nonlocal errors
+        while not queue.empty():
+            i, (method, path, body) = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                async with session.request(method, url + path, json=body) as r:
+                    responses[i] = await r.json()
+                    if r.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+        wall = time.perf_counter() - start
+    return latencies, responses, errors, wall
+
+
+def job_ids_of(scenario: str, responses: List[Any]) -> List[str]:
+    if scenario == "create-job":
+        return [r["job_id"] for r in responses if r and r.get("job_id")]
+    return [
+        s["output"]["job_id"]
+        for r in responses
+        if isinstance(r, list)
+        for s in r
+        if s["output"]["job_id"]
+    ]
+
+
+async def bench_jobs(args: argparse.Namespace, n_jobs: int, work_dir: str) -> None:
+    env = fake_env(
+        work_dir,
+        FAKE_PJM_LATENCY=args.pjm_latency,
+        FAKE_PJM_JITTER=args.pjm_jitter,
+        FAKE_PJM_QUEUE_SECONDS=args.pjm_queue_seconds,
+        FAKE_PJM_RUN_SECONDS=args.pjm_run_seconds,
+        # 測定中にバックグラウンドの処理が動かないようにする
+        JOB_REGISTRY_INTERVAL=3600,
+    )
+    info = env_info()
+    job_ids: List[str] = []
+    with Server(env, os.path.join(work_dir, "server.log")) as server:
+        for scenario in args.scenarios:
+            if scenario == "create-job":
+                bodies = [("POST", "/create-job", job(i)) for i in range(n_jobs)]
+                n_items = n_jobs
+            elif scenario.startswith("create-multi-job"):
+                bulk = scenario.endswith("bulk")
+                bodies = [
+                    (
+                        "POST",
+                        "/create-multi-job",
+                        {
+                            "jobs": [
+                                job(i) for i in range(s, min(s + args.batch, n_jobs))
+                            ],
+                            "bulk": bulk,
+                        },
+                    )
+                    for s in range(0, n_jobs, args.batch)
+                ]
+                n_items = n_jobs
+            else:
+                if not job_ids:
+                    continue
+                rng = random.Random(0)
+                bodies = [
+                    (
+                        "PUT",
+                        "/job-status",
+                        {
+                            "job_ids": rng.sample(
+                                job_ids, min(args.status_batch, len(job_ids))
+                            )
+                        },
+                    )
+                    for _ in range(args.status_requests)
+                ]
+                n_items = args.status_requests * min(args.status_batch, len(job_ids))
+            calls_before = pjm_calls(env)
+            latencies, responses, errors, wall = await run_requests(
+                server.url, bodies, args.concurrency
+            )
+            calls_after = pjm_calls(env)
+            if scenario != "job-status":
+                job_ids += job_ids_of(scenario, responses)
+            write_result(
+                args.output,
+                "api_throughput",
+                {
+                    "scenario": scenario,
+                    "jobs": n_jobs,
+                    "concurrency": args.concurrency,
+                    "batch": args.batch,
+                    "status_batch": args.status_batch,
+                    "pjm_latency": args.pjm_latency,
+                },
+                {
+                    "requests": len(bodies),
+                    "items": n_items,
+                    "errors": errors,
+                    "wall_seconds": wall,
+                    "requests_per_s": len(bodies) / wall,
+                    "items_per_s": n_items / wall,
+                    "latency": summarize(latencies),
+                    "pjm_calls": {
+                        command: count - calls_before.get(command, 0)
+                        for command, count in calls_after.items()
+                    },
+                },
+                info,
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1000])
+    parser.add_argument(
+        "--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=100,
+        help="/create-multi-jobの1リクエストのジョブ数",
+    )
+    parser.add_argument(
+        "--status-batch",
+        type=int,
+        default=100,
+        help="/job-statusの1リクエストのジョブ数",
+    )
+    parser.add_argument("--status-requests", type=int, default=500)
+    parser.add_argument(
+        "--pjm-latency", type=float, default=0.05, help="PJMコマンドの応答時間(秒)"
+    )
+    parser.add_argument("--pjm-jitter", type=float, default=0.02)
+    parser.add_argument("--pjm-queue-seconds", type=float, default=0)
+    parser.add_argument("--pjm-run-seconds", type=float, default=3600)
+    parser.add_argument(
+        "--output", default=None, help="結果を追記するJSON Linesファイル"
+    )
+    args = parser.parse_args()
+    for n_jobs in args.jobs:
+        with tempfile.TemporaryDirectory(prefix="hpc-ops-bench-") as work_dir:
+            asyncio.run(bench_jobs(args, n_jobs, work_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""ベンチマークの共通処理. 代替のPJM・wandbを使う環境の作成と結果の出力.
+
+結果は1行1測定のJSON Linesとし，各行はベンチマーク名・パラメータ・測定値・
+実行環境(コミット等)を持つ．benchmarks/compare.pyで2つの結果を比較できる．
+"""
+
+import json
+import os
+import platform
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).parent.absolute()
+REPO_DIR = BENCH_DIR.parent
+FAKE_PJM_DIR = BENCH_DIR / "fake_pjm"
+FAKE_WANDB_DIR = BENCH_DIR / "fake_wandb"
+
+
+def fake_env(work_dir: str, **overrides: Any) -> Dict[str, str]:
+    """代替のpjsub/pjstat/pjdel・wandbを使用し，状態をwork_dirに閉じ込める環境変数.
+
+    Args:
+        work_dir (str): ジョブの一時ディレクトリ・レジストリ等を置くディレクトリ.
+        overrides: 追加・上書きする環境変数(FAKE_PJM_LATENCY等).
+    """
+    work = Path(work_dir)
+    os.makedirs(work / "wandb_store", exist_ok=True)
+    # 代替のPJMコマンドの起動時間が測定を支配しないよう，現在のインタプリタを
+    # site無しで直接起動するラッパーを作成する
+    bin_dir = work / "bin"
+    os.makedirs(bin_dir, exist_ok=True)
+    for command in ("pjsub", "pjstat", "pjdel"):
+        path = bin_dir / command
+        path.write_text(
+            f"#!{sys.executable} -S\n"
+            "import sys\n"
+            f"sys.path.insert(0, {str(FAKE_PJM_DIR)!r})\n"
+            "from fake_pjm import main\n"
+            f"sys.exit(main({command!r}, sys.argv[1:]))\n"
+        )
+        path.chmod(0o755)
+    # ジョブスクリプトはBASE_DIR_PATH/app以下を参照する
+    if not (work / "app").exists():
+        os.symlink(REPO_DIR / "app", work / "app")
+    env = dict(
+        os.environ,
+        PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+        PYTHONPATH=os.pathsep.join(
+            [
+                str(FAKE_WANDB_DIR),
+                str(REPO_DIR / "app"),
+                os.environ.get("PYTHONPATH", ""),
+            ]
+        ),
+        FAKE_PJM_STATE=str(work / "pjm.db"),
+        FAKE_WANDB_DIR=str(work / "wandb_store"),
+        BASE_DIR_PATH=str(work),
+        RESOURCE_GROUP=os.environ.get("RESOURCE_GROUP", "benchmark"),
+        WANDB_APIKEY=os.environ.get("WANDB_APIKEY", "benchmark"),
+        JOB_REGISTRY_PATH=str(work / "job_registry.db"),
+        RESULT_CACHE_PATH=str(work / "result_cache.db"),
+        ARTIFACT_CACHE_DIR=str(work / "artifact_cache"),
+        LOG_SINK="file",
+    )
+    env.update({key: str(value) for key, value in overrides.items()})
+    return env
+
+
+def use_fake_env(env: Dict[str, str]) -> None:
+    """現在のプロセスを代替の環境に切り替える. appのモジュールのimport前に呼ぶ."""
+    os.environ.update(env)
+    for path in reversed(env["PYTHONPATH"].split(os.pathsep)):
+        if path and path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def pjm_calls(env: Dict[str, str]) -> Dict[str, int]:
+    """代替のPJMコマンドが呼ばれた回数."""
+    path = env["FAKE_PJM_STATE"]
+    if not os.path.exists(path):
+        return {}
+    with sqlite3.connect(path, timeout=60) as conn:
+        try:
+            return dict(conn.execute("SELECT command, count FROM calls").fetchall())
+        except sqlite3.OperationalError:
+            return {}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """APIサーバーを代替の環境でサブプロセスとして起動する."""
+
+    def __init__(self, env: Dict[str, str], log_path: str) -> None:
+        self.env = env
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = log_path
+
+    def __enter__(self) -> "Server":
+        self._log = open(self.log_path, "w")
+        self.proc = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "main:app",
+                "--port",
+                str(self.port),
+                "--log-level",
+                "warning",
+            ],
+            cwd=REPO_DIR / "app",
+            env=self.env,
+            stdout=self._log,
+            stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server exited. see {self.log_path}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("server did not start")
+
+    def __exit__(self, *args: Any) -> None:
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self._log.close()
+
+
+def summarize(seconds: Sequence[float]) -> Dict[str, float]:
+    """レイテンシ(秒)の要約統計量(ミリ秒)."""
+    if not len(seconds):
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def env_info() -> Dict[str, Any]:
+    """結果を比較するための実行環境の情報."""
+
+    def git(*args: str) -> str:
+        r = subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True)
+        return r.stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": len(os.sched_getaffinity(0)),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write_result(
+    output: Optional[str],
+    benchmark: str,
+    params: Dict[str, Any],
+    metrics: Dict[str, Any],
+    env: Optional[Dict[str, Any]] = None,
+) -> None:
+    """測定結果をJSON Linesとして追記する. outputがNoneの場合は標準出力へ出力する."""
+    line = json.dumps(
+        {
+            "benchmark": benchmark,
+            "params": params,
+            "metrics": metrics,
+            "env": env or env_info(),
+        }
+    )
+    if output is None:
+        print(line, flush=True)
+        return
+    with open(output, "a") as f:
+        f.write(line + "\n")
+    print(line, flush=True)
+
+
+def read_results(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
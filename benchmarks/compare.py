@@ -0,0 +1,76 @@
+"""2つのベンチマーク結果(JSON Lines)を比較し，性能の悪化を検出する.
+
+同じベンチマーク名・パラメータの測定同士で数値の測定値を比較する．
+スループット(名前が"_per_s"・"_per_hour"で終わるもの)と稼働率は大きいほど，
+それ以外(時間・レイテンシ等)は小さいほど良いとみなす．
+
+使い方:
+    python benchmarks/compare.py base.jsonl new.jsonl --threshold 0.1
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, Iterator, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import read_results  # noqa: E402
+
+HIGHER_IS_BETTER = ("_per_s", "_per_hour", "utilization")
+# 比較しない測定値(件数・設定値)
+IGNORED = ("count", "requests", "items", "repeat", "n_workers", "errors")
+
+
+def flatten(metrics: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, f"{name}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, float(value)
+
+
+def index(path: str) -> Dict[Tuple[str, str], Dict[str, float]]:
+    """(ベンチマーク名, パラメータ) -> 測定値. 同じ測定が複数あれば最後のもの."""
+    return {
+        (r["benchmark"], json.dumps(r["params"], sort_keys=True)): dict(
+            flatten(r["metrics"])
+        )
+        for r in read_results(path)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="悪化とみなす変化率"
+    )
+    args = parser.parse_args()
+    base, new = index(args.base), index(args.new)
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        benchmark, params = key
+        for name, before in sorted(base[key].items()):
+            if name not in new[key] or name.split(".")[-1] in IGNORED or before == 0:
+                continue
+            after = new[key][name]
+            change = (after - before) / abs(before)
+            worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+            flag = "REGRESSION" if worse > args.threshold else ""
+            regressions += bool(flag)
+            print(
+                f"{benchmark}\t{params}\t{name}\t{before:.6g}\t{after:.6g}"
+                f"\t{change:+.1%}\t{flag}"
+            )
+    missing = base.keys() ^ new.keys()
+    if missing:
+        print(f"{len(missing)} measurements exist in only one file", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""ベンチマーク用のpjsub/pjstat/pjdelの代替.
+
+ジョブの状態はFAKE_PJM_STATEのSQLiteに保持し，投入からの経過時間で
+QUE -> RUN -> EXT と遷移する．以下の環境変数で挙動を変更できる．
+
+    FAKE_PJM_STATE: 状態を保持するSQLiteのパス(必須).
+    FAKE_PJM_LATENCY: コマンドごとの応答時間(秒). 既定0.
+    FAKE_PJM_JITTER: 応答時間に加える一様乱数の上限(秒). 既定0.
+    FAKE_PJM_QUEUE_SECONDS: 投入から実行開始までの時間(秒). 既定0.
+    FAKE_PJM_RUN_SECONDS: 実行時間(秒). 既定60.
+    FAKE_PJM_MAX_JOBS: 未終了のジョブ数の上限. 超えるとpjsubが拒否する. 既定0(無制限).
+    FAKE_PJM_FAIL_RATE: 一時的なエラーを返す確率. 既定0.
+    FAKE_PJM_EXECUTE: "1"の場合，投入したジョブスクリプトを実際にバックグラウンドで実行する.
+"""
+
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+from typing import List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    cancelled_at REAL,
+    node TEXT NOT NULL,
+    core TEXT NOT NULL,
+    elapse TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seq (id INTEGER PRIMARY KEY AUTOINCREMENT);
+CREATE TABLE IF NOT EXISTS calls (command TEXT PRIMARY KEY, count INTEGER NOT NULL);
+"""
+HEADER = (
+    f"{'JOB_ID':<21}{'JOB_NAME':<11}{'MD':<3}{'ST':<4}{'USER':<9}{'START_DATE':<16}"
+    f"{'ELAPSE_LIM':<11}{'NODE_REQUIRE':<16}{'VNODE':<7}{'CORE':<5}V_MEM"
+)
+BULK_JOB_ID = re.compile(r"^(?P<job_id>\d+)\[(?P<bulk_num>\d+)\]$")
+
+
+def _env(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+
+def connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(os.environ["FAKE_PJM_STATE"], timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def job_status(submitted_at: float, cancelled_at: Optional[float], now: float) -> str:
+    if cancelled_at is not None:
+        return "CCL"
+    elapsed = now - submitted_at
+    queue_seconds = _env("FAKE_PJM_QUEUE_SECONDS", "0")
+    if elapsed < queue_seconds:
+        return "QUE"
+    if elapsed < queue_seconds + _env("FAKE_PJM_RUN_SECONDS", "60"):
+        return "RUN"
+    return "EXT"
+
+
+def _format_job(row: Tuple, status: str) -> str:
+    job_id, name, submitted_at, _, node, core, elapse = row
+    started_at = submitted_at + _env("FAKE_PJM_QUEUE_SECONDS", "0")
+    if status == "QUE":
+        start_date = time.strftime("(%m/%d %H:%M)", time.localtime(started_at))
+    else:
+        start_date = time.strftime("%m/%d %H:%M:%S", time.localtime(started_at))
+    user = os.getenv("USER", "bench")[:8]
+    return (
+        f"{job_id:<21}{name[:10]:<11}{'NM':<3}{status:<4}{user:<9}{start_date:<16}"
+        f"{elapse:<11}{node:<16}{'1':<7}{core:<5}4G"
+    )
+
+
+def _parse_resources(option: str) -> dict:
+    resources = {}
+    for item in option.split(","):
+        key, _, value = item.partition("=")
+        resources[key] = value
+    return resources
+
+
+def pjsub(conn: sqlite3.Connection, args: List[str]) -> int:
+    resources, out_path, bulk = {}, None, None
+    i = 0
+    while i < len(args) - 1:
+        if args[i] == "-L":
+            resources = _parse_resources(args[i + 1])
+            i += 1
+        elif args[i] == "-o":
+            out_path = args[i + 1]
+            i += 1
+        elif args[i] == "--sparam":
+            start, _, end = args[i + 1].partition("-")
+            bulk = range(int(start), int(end) + 1)
+            i += 1
+        i += 1
+    script = args[-1]
+    now = time.time()
+    with conn:
+        max_jobs = int(_env("FAKE_PJM_MAX_JOBS", "0"))
+        if max_jobs:
+            rows = conn.execute(
+                "SELECT submitted_at, cancelled_at FROM jobs WHERE cancelled_at IS NULL"
+            ).fetchall()
+            active = sum(1 for row in rows if job_status(*row, now) != "EXT")
+            if active + len(bulk or [0]) > max_jobs:
+                print(
+                    "[ERR.] PJM 0007 pjsub Job count limit exceeded.", file=sys.stderr
+                )
+                return 1
+        job_id = str(conn.execute("INSERT INTO seq DEFAULT VALUES").lastrowid)
+        sub_ids = [f"{job_id}[{n}]" for n in bulk] if bulk is not None else [job_id]
+        conn.executemany(
+            "INSERT INTO jobs VALUES (?, ?, ?, NULL, ?, ?, ?)",
+            [
+                (
+                    sub_id,
+                    os.path.basename(script),
+                    now,
+                    resources.get("node", "-"),
+                    resources.get("vnode-core", "1"),
+                    resources.get("elapse", "01:00:00"),
+                )
+                for sub_id in sub_ids
+            ],
+        )
+    if os.getenv("FAKE_PJM_EXECUTE") == "1":
+        for n in bulk if bulk is not None else [None]:
+            env = dict(os.environ, PJM_VNODE_CORE=resources.get("vnode-core", "1"))
+            if n is not None:
+                env["PJM_BULKNUM"] = str(n)
+            out = out_path or os.path.join(os.getcwd(), f"{job_id}.{n or 0}.out")
+            with open(out, "w") as f:
+                subprocess.Popen(
+                    ["bash", script],
+                    env=env,
+                    stdout=f,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                )
+    print(f"[INFO] PJM 0000 pjsub Job {job_id} submitted.")
+    return 0
+
+
+def pjstat(conn: sqlite3.Connection, args: List[str]) -> int:
+    history = "-H" in args
+    job_ids = [arg for arg in args if not arg.startswith("-")]
+    if job_ids:
+        rows = conn.execute(
+            f"SELECT * FROM jobs WHERE job_id IN ({', '.join('?' * len(job_ids))})",
+            job_ids,
+        ).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM jobs").fetchall()
+    now = time.time()
+    lines = [HEADER]
+    for row in rows:
+        status = job_status(row[2], row[3], now)
+        finished = status in ("EXT", "CCL")
+        if finished == history:
+            lines.append(_format_job(row, status))
+    print("\n".join(lines))
+    return 0
+
+
+def pjdel(conn: sqlite3.Connection, args: List[str]) -> int:
+    returncode = 0
+    now = time.time()
+    with conn:
+        for job_id in args:
+            m = BULK_JOB_ID.match(job_id)
+            # バルクジョブのIDを指定した場合は全サブジョブを削除する
+            pattern = job_id if m else f"{job_id}[%]"
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE job_id = ? OR job_id LIKE ?",
+                (job_id, pattern),
+            ).fetchall()
+            active = [
+                row[0]
+                for row in rows
+                if job_status(row[2], row[3], now) in ("QUE", "RUN")
+            ]
+            if not active:
+                print(
+                    f"[ERR.] PJM 0120 pjdel Job {job_id} already ended.",
+                    file=sys.stderr,
+                )
+                returncode = 1
+                continue
+            conn.executemany(
+                "UPDATE jobs SET cancelled_at = ? WHERE job_id = ?",
+                [(now, active_id) for active_id in active],
+            )
+            print(f"[INFO] PJM 0100 pjdel Job {job_id} canceled.")
+    return returncode
+
+
+COMMANDS = {"pjsub": pjsub, "pjstat": pjstat, "pjdel": pjdel}
+
+
+def main(command: str, args: List[str]) -> int:
+    time.sleep(
+        _env("FAKE_PJM_LATENCY", "0") + random.uniform(0, _env("FAKE_PJM_JITTER", "0"))
+    )
+    conn = connect()
+    with conn:
+        conn.execute(
+            "INSERT INTO calls VALUES (?, 1) "
+            "ON CONFLICT(command) DO UPDATE SET count = count + 1",
+            (command,),
+        )
+    if random.random() < _env("FAKE_PJM_FAIL_RATE", "0"):
+        print(
+            f"[ERR.] PJM 0001 {command} Resource temporarily unavailable.",
+            file=sys.stderr,
+        )
+        return 1
+    return COMMANDS[command](conn, args)
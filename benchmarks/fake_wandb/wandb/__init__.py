@@ -0,0 +1,112 @@
+"""ベンチマーク用のwandbの代替.
+
+PYTHONPATHの先頭に置くことで本物のwandbの代わりにimportされる．
+Artifactは FAKE_WANDB_DIR のローカルストアに保存し，runのメトリクスは
+runのディレクトリにJSON Linesとして書き込む．
+
+    FAKE_WANDB_DIR: Artifactストアのディレクトリ(必須).
+    FAKE_WANDB_LATENCY: Artifactの取得ごとの応答時間(秒). 既定0.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+from uuid import uuid4
+
+
+def _store() -> Path:
+    return Path(os.environ["FAKE_WANDB_DIR"])
+
+
+def _latency() -> None:
+    time.sleep(float(os.getenv("FAKE_WANDB_LATENCY", "0")))
+
+
+def login(key: Optional[str] = None, **kwargs: Any) -> bool:
+    return True
+
+
+class Plotly:
+    def __init__(self, figure: Any) -> None:
+        self.figure = figure
+
+
+class Run:
+    def __init__(self, dir: Optional[str] = None, **kwargs: Any) -> None:
+        self.config = kwargs.get("config") or {}
+        self.name = kwargs.get("name")
+        self.id = uuid4().hex[:8]
+        self.dir = str(Path(dir or ".") / "wandb" / f"fake-run-{self.id}" / "files")
+        os.makedirs(self.dir, exist_ok=True)
+        self._file = open(Path(self.dir) / "history.jsonl", "a")
+
+    def define_metric(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def log(self, data: Dict[str, Any], step: Optional[int] = None) -> None:
+        self._file.write(json.dumps(dict(data, _step=step), default=str) + "\n")
+
+    def finish(self) -> None:
+        self._file.close()
+
+
+def init(**kwargs: Any) -> Run:
+    return Run(**kwargs)
+
+
+class Artifact:
+    def __init__(self, path: Path, digest: str) -> None:
+        self._path = path
+        self.digest = digest
+
+    def download(self, root: Optional[str] = None) -> str:
+        _latency()
+        shutil.copytree(self._path, root)
+        return root
+
+
+class Api:
+    def __init__(self, api_key: Optional[str] = None, **kwargs: Any) -> None:
+        pass
+
+    def artifact(self, name: str) -> Artifact:
+        """ "<project>/<artifact名>:<エイリアス or バージョン>"のArtifactを取得する."""
+        _latency()
+        project, _, name = name.rpartition("/")
+        base_name, _, alias = name.partition(":")
+        artifact_dir = _store() / project / base_name
+        aliases = json.loads((artifact_dir / "aliases.json").read_text())
+        digest = aliases[alias or "latest"]
+        return Artifact(artifact_dir / digest, digest)
+
+
+def publish(
+    project: str,
+    name: str,
+    files: Dict[str, bytes],
+    aliases: Iterable[str] = ("latest",),
+) -> str:
+    """ファイルをArtifactとしてストアに保存し，バージョン("v<n>")とエイリアスを付ける.
+
+    Returns:
+        str: Artifactのダイジェスト.
+    """
+    h = hashlib.sha256()
+    for file_name in sorted(files):
+        h.update(file_name.encode() + b"\0" + files[file_name])
+    digest = h.hexdigest()[:32]
+    artifact_dir = _store() / project / name
+    os.makedirs(artifact_dir / digest, exist_ok=True)
+    for file_name, content in files.items():
+        (artifact_dir / digest / file_name).write_bytes(content)
+    index_path = artifact_dir / "aliases.json"
+    index = json.loads(index_path.read_text()) if index_path.exists() else {}
+    versions = {alias for alias in index if alias.startswith("v")}
+    for alias in (*aliases, f"v{len(versions)}"):
+        index[alias] = digest
+    index_path.write_text(json.dumps(index))
+    return digest
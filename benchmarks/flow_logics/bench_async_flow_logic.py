@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+from core.base_flow_logic import BaseFlowLogic
+
+
+class MyFlowLogic(BaseFlowLogic):
+    """bench_flow_logicと同じタスクをasync defのrun_taskで実行するflow logic.
+
+    params:
+        n_tasks (int): タスク数.
+        payload_bytes (int): タスクごとの入力の大きさ(byte).
+        task_seconds (float): タスクごとの実行時間(秒).
+        workload (str): "cpu"はビジーループ，"io"はasyncio.sleepで待つ.
+    """
+
+    async def task_scheduler(self):
+        params = self.cfg["params"]
+        return [
+            {"task_id": i, "payload": bytes(params["payload_bytes"])}
+            for i in range(params["n_tasks"])
+        ]
+
+    async def run_task(
+        self, task_id, payload, task_seconds=0.0, workload="cpu", **kwargs
+    ):
+        if workload == "io":
+            await asyncio.sleep(task_seconds)
+            return task_id, len(payload)
+        deadline = time.perf_counter() + task_seconds
+        while time.perf_counter() < deadline:
+            pass
+        return task_id, len(payload)
+
+    async def create_result(self, result_set):
+        assert len(result_set) == self.cfg["params"]["n_tasks"]
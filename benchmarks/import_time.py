@@ -0,0 +1,139 @@
+"""APIサーバー・ジョブのエントリーポイントのimport時間を測定し，予算を超えたら失敗する.
+
+各エントリーポイントを新しいインタプリタで`-X importtime`付きでimportし，importに
+かかった時間(--repeat回の最小値)と，時間のかかったパッケージ(トップレベルの
+パッケージ名ごとのself時間の合計)を出力する．importが--budget秒を超えた場合，
+または起動時に不要な重いパッケージ(--forbid)が読み込まれた場合は終了コード1とする．
+代替のwandbではなく実際にインストールされたパッケージのimport時間を測定する．
+
+使い方:
+    python benchmarks/import_time.py --budget 1.0 --output results.jsonl
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import REPO_DIR, env_info, write_result  # noqa: E402
+
+# APIサーバー, ジョブ, パックジョブ, 複数ノードのワーカーのエントリーポイント
+TARGETS = ("main", "job_script", "pack_script", "node_worker")
+# エントリーポイントのimportで読み込まれてはならないパッケージ
+FORBIDDEN = ("wandb", "pandas", "numpy")
+
+PROBE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+"""
+
+
+def parse_importtime(stderr: str, target: str) -> Dict[str, float]:
+    """`-X importtime`の出力から，targetのimport中のパッケージごとのself時間(ミリ秒)."""
+    entries: List[Tuple[str, float]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        entries.append((name, int(fields[0]) / 1000))
+    # targetの行より前で，直前のトップレベルの行より後がtargetのimportした部分
+    end = next(
+        (i for i, (name, _) in enumerate(entries) if name == target), len(entries)
+    )
+    start = max(
+        (i for i, (name, _) in enumerate(entries[:end]) if not name.startswith(" ")),
+        default=-1,
+    )
+    packages: Dict[str, float] = defaultdict(float)
+    for name, self_ms in entries[start + 1 : end + 1]:
+        packages[name.strip().split(".")[0]] += self_ms
+    return dict(packages)
+
+
+def measure(target: str, env: Dict[str, str]) -> Dict[str, Any]:
+    """新しいインタプリタでtargetを1回importする."""
+    r = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE, target],
+        cwd=REPO_DIR / "app",
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if r.returncode != 0:
+        raise RuntimeError(f"failed to import {target}:\n{r.stderr[-2000:]}")
+    probe = json.loads(r.stdout.strip().splitlines()[-1])
+    return {
+        "seconds": probe["seconds"],
+        "modules": set(probe["modules"]),
+        "packages": parse_importtime(r.stderr, target),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS))
+    parser.add_argument(
+        "--budget", type=float, default=1.0, help="import時間の上限(秒)"
+    )
+    parser.add_argument("--forbid", nargs="*", default=list(FORBIDDEN))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="出力するパッケージの数")
+    parser.add_argument(
+        "--output", default=None, help="結果を追記するJSON Linesファイル"
+    )
+    args = parser.parse_args()
+
+    # 設定の必須項目のみ補い，インストール済みのパッケージをそのまま使用する
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(
+            [str(REPO_DIR / "app"), os.environ.get("PYTHONPATH", "")]
+        ),
+        RESOURCE_GROUP=os.environ.get("RESOURCE_GROUP", "benchmark"),
+        WANDB_APIKEY=os.environ.get("WANDB_APIKEY", "benchmark"),
+    )
+    info = env_info()
+    failures = []
+    for target in args.targets:
+        runs = [measure(target, env) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        top = sorted(best["packages"].items(), key=lambda item: -item[1])[: args.top]
+        forbidden = sorted(
+            {name.split(".")[0] for run in runs for name in run["modules"]}
+            & set(args.forbid)
+        )
+        write_result(
+            args.output,
+            "import_time",
+            {"target": target},
+            {
+                "import_ms": best["seconds"] * 1000,
+                "packages_ms": dict(top),
+                "forbidden": forbidden,
+            },
+            info,
+        )
+        if best["seconds"] > args.budget:
+            failures.append(
+                f"{target}: import took {best['seconds']:.3f}s > {args.budget}s"
+            )
+        if forbidden:
+            failures.append(f"{target}: imports {', '.join(forbidden)}")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
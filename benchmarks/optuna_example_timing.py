@@ -0,0 +1,130 @@
+"""flow_logics/optuna_example.py の目的関数の試行スループットを比較する.
+
+before: 試行ごとにKFoldを作成し，DataFrameからfoldをコピーして直列に学習する(従来の実装).
+after: foldをタスク内で一度だけ作成し，スレッドで並列に学習してpruningを行う.
+
+使い方:
+    python benchmarks/optuna_example_timing.py --n-trials 40 --n-rows 20000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import optuna
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import KFold
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("RESOURCE_GROUP", "benchmark")
+os.environ.setdefault("WANDB_APIKEY", "benchmark")
+
+from flow_logics.optuna_example import MyFlowLogic  # noqa: E402
+
+PARAMS = {
+    "clf": ("clf", ("RF", "GB")),
+    "rf_max_depth": ("rf_max_depth", 2, 32),
+    "rf_min_samples_split": ("rf_min_samples_split", 0.01, 1),
+    "gb_max_depth": ("gb_max_depth", 2, 32),
+    "gb_min_samples_split": ("gb_min_samples_split", 0.01, 1),
+}
+
+
+def make_dataset(n_rows: int, n_features: int, seed: int = 0):
+    """adultデータセットのget_dummies後に近い形の疑似データを作成."""
+    rng = np.random.default_rng(seed)
+    X = (rng.random((n_rows, n_features)) < 0.2).astype("float64")
+    w = rng.normal(size=n_features)
+    y = (X @ w + rng.normal(scale=0.5, size=n_rows)) > 0
+    return pd.DataFrame(X, columns=[f"f{i}" for i in range(n_features)]), y
+
+
+def objective_before(params, X: pd.DataFrame, y: np.ndarray):
+    def objective(trial):
+        clf_name = trial.suggest_categorical(*params["clf"])
+        if clf_name == "RF":
+            clf = RandomForestClassifier(
+                max_depth=trial.suggest_int(*params["rf_max_depth"]),
+                min_samples_split=trial.suggest_float(*params["rf_min_samples_split"]),
+            )
+        else:
+            clf = GradientBoostingClassifier(
+                max_depth=trial.suggest_int(*params["gb_max_depth"]),
+                min_samples_split=trial.suggest_float(*params["gb_min_samples_split"]),
+            )
+        acc_list = []
+        for train_idx, val_idx in list(KFold(n_splits=3).split(X)):
+            clf.fit(X.loc[train_idx], y[train_idx])
+            acc_list.append(accuracy_score(y[val_idx], clf.predict(X.loc[val_idx])))
+        return np.mean(acc_list)
+
+    return objective
+
+
+def run_before(X, y, n_trials: int, seed: int) -> dict:
+    study = optuna.create_study(
+        direction="maximize", sampler=optuna.samplers.TPESampler(seed=seed)
+    )
+    start = time.perf_counter()
+    study.optimize(objective_before(PARAMS, X, y), n_trials=n_trials)
+    return summarize("before", study, time.perf_counter() - start)
+
+
+def run_after(X, y, n_trials: int, seed: int, fold_jobs: int, pruner: str) -> dict:
+    flow_logic = MyFlowLogic({"params": dict(PARAMS, fold_jobs=fold_jobs)})
+    study = optuna.create_study(
+        direction="maximize",
+        sampler=optuna.samplers.TPESampler(seed=seed),
+        pruner=flow_logic._pruner(pruner),
+    )
+    start = time.perf_counter()
+    folds = flow_logic.make_folds(X, y)
+    with ThreadPoolExecutor(max_workers=flow_logic.threads_per_worker) as executor:
+        study.optimize(flow_logic.objective_vr(folds, executor), n_trials=n_trials)
+    return summarize(
+        f"after ({pruner}, fold_jobs={fold_jobs})", study, time.perf_counter() - start
+    )
+
+
+def summarize(name: str, study, elapsed: float) -> dict:
+    states = [t.state for t in study.trials]
+    return {
+        "name": name,
+        "n_trials": len(states),
+        "pruned": states.count(optuna.trial.TrialState.PRUNED),
+        "best_value": study.best_value,
+        "seconds": round(elapsed, 3),
+        "trials_per_hour": round(len(states) / elapsed * 3600, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-trials", type=int, default=40)
+    parser.add_argument("--n-rows", type=int, default=20000)
+    parser.add_argument("--n-features", type=int, default=100)
+    parser.add_argument("--fold-jobs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    X, y = make_dataset(args.n_rows, args.n_features, args.seed)
+    results = [
+        run_before(X, y, args.n_trials, args.seed),
+        run_after(X, y, args.n_trials, args.seed, args.fold_jobs, "none"),
+        run_after(X, y, args.n_trials, args.seed, args.fold_jobs, "median"),
+        run_after(X, y, args.n_trials, args.seed, args.fold_jobs, "hyperband"),
+    ]
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
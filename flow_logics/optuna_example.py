@@ -1,11 +1,10 @@
-import pickle
-from pathlib import Path
-from typing import Any, List, Dict, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Dict, Callable, Tuple
 
 import numpy as np
-import pandas as pd
 import optuna
 import wandb
+from sklearn.base import clone
 from sklearn.datasets import fetch_openml
 from sklearn.ensemble import GradientBoostingClassifier
 from sklearn.ensemble import RandomForestClassifier
@@ -16,12 +15,55 @@ from app.core.base_flow_logic import BaseFlowLogic
 from app.utils.config import settings
 
 
+# データセットの前処理定義. 変換結果はデータセットのバージョンごとに共有される
+DATASET_TABLES = {
+    "X": [
+        {"op": "select", "key": "data"},
+        {"op": "get_dummies"},
+        {"op": "astype", "dtype": "float64"},
+    ],
+    "y": [
+        {"op": "select", "key": "target"},
+        {"op": "equals", "value": ">50K"},
+    ],
+}
+
+
 class MyFlowLogic(BaseFlowLogic):
     def __init__(self, cfg):
         super().__init__(cfg)
         self.wandb_key = settings.WANDB_APIKEY
+        # 1タスク内で並列に学習するfold数. ワーカー数はこの値に応じて減る
+        self.threads_per_worker = cfg["params"].get("fold_jobs", 2)
 
-    def objective_vr(self, X: pd.DataFrame, y: np.ndarray) -> Callable:
+    def make_folds(self, X: Any, y: np.ndarray) -> List[Tuple[np.ndarray, ...]]:
+        """交差検証の分割を作成. タスク内の全試行で共有する.
+
+        Args:
+            X (Any): 特徴量. DataFrameの場合も配列として扱う.
+            y (np.ndarray): 目的変数.
+
+        Returns:
+            List[Tuple[np.ndarray, ...]]: foldごとの(X_train, y_train, X_val, y_val).
+        """
+        X = np.asarray(X)
+        y = np.asarray(y)
+        kfold = KFold(n_splits=self.cfg["params"].get("n_splits", 3))
+        return [
+            (X[train_idx], y[train_idx], X[val_idx], y[val_idx])
+            for train_idx, val_idx in kfold.split(X)
+        ]
+
+    @staticmethod
+    def fit_fold(clf: Any, fold: Tuple[np.ndarray, ...]) -> float:
+        X_train, y_train, X_val, y_val = fold
+        clf = clone(clf)
+        clf.fit(X_train, y_train)
+        return accuracy_score(y_val, clf.predict(X_val))
+
+    def objective_vr(
+        self, folds: List[Tuple[np.ndarray, ...]], executor: ThreadPoolExecutor
+    ) -> Callable:
         def objective(trial):
             clf_name = trial.suggest_categorical(*self.cfg["params"]["clf"])
             # clf_name の値によってハイパーパラメータを分岐させる
@@ -53,23 +95,29 @@ class MyFlowLogic(BaseFlowLogic):
                 "gb_max_depth": gb_max_depth,
                 "gb_min_samples_split": gb_min_samples_split,
             }
+            # foldはスレッドで並列に学習し，fold順に平均精度を途中経過として報告する
+            futures = [executor.submit(self.fit_fold, clf, fold) for fold in folds]
             acc_list = []
-            kfold_indicies = list(KFold(n_splits=3).split(X))
-            for train_idx, val_idx in kfold_indicies:
-                X_train, y_train = X.loc[train_idx], y[train_idx]
-                X_val, y_val = X.loc[val_idx], y[val_idx]
-                clf.fit(X_train, y_train)
-                y_pred = clf.predict(X_val)
-                # print(clf.feature_importances_)
-                acc_list.append(accuracy_score(y_val, y_pred))
+            pruned = False
+            for future in futures:
+                acc_list.append(future.result())
+                trial.report(float(np.mean(acc_list)), step=len(acc_list))
+                if trial.should_prune():
+                    pruned = True
+                    break
+            # 打ち切った場合は未開始のfoldを実行しない
+            for future in futures:
+                future.cancel()
             expt_log = dict(
                 **expt_log,
                 **{f"fold{i + 1} Acc": acc_list[i] for i in range(len(acc_list))},
             )
             accuracy = np.mean(acc_list)
             expt_log["Acc"] = accuracy
-            if hasattr(self, "run"):
-                self.run.log(expt_log, step=trial.number)
+            expt_log["pruned"] = pruned
+            self.log(expt_log, step=trial.number)
+            if pruned:
+                raise optuna.TrialPruned()
             return accuracy
 
         return objective
@@ -81,26 +129,23 @@ class MyFlowLogic(BaseFlowLogic):
             List[Dict[str, Any]]: 1タスクの入力をDictとした要素を持つリスト.
         """
         # data = fetch_openml(name="adult")
-        download_path = str(Path(settings.BASE_DIR_PATH) / Path("data"))
-        run = wandb.init(
-            project=self.cfg["project"],
-            group=self.cfg["group"],
-            job_type=self.cfg["jobtype"],
-            name="fetch-dataset",
-        )
-        artifact = run.use_artifact(self.cfg["params"]["dataset"])
-        artifact_dir = artifact.download(root=download_path)
-        download_path = str(
-            Path(download_path)
-            / Path(self.cfg["params"]["dataset"].split(":")[0] + ".pkl")
+        dataset = self.stage_dataset(self.cfg["params"]["dataset"], DATASET_TABLES)
+        X = dataset["X"]
+        y = dataset["y"]
+        study_name = self.cfg["project"]
+        if self.cfg["group"]:
+            study_name += "-" + self.cfg["group"]
+        if self.cfg["jobtype"]:
+            study_name += "-" + self.cfg["jobtype"]
+        study_name += f"-{self.cfg['flow_logic']}-{self.cfg['params']['dataset']}"
+        # 試行をジョブのワーカー(node > 1の場合は全ノード)に分割して実行する
+        return self.create_study_tasks(
+            study_name,
+            n_trials=self.cfg["params"].get("n_trials", 100),
+            direction="maximize",
+            task_input={"X": X, "y": y},
+            pruner=self.cfg["params"].get("pruner", "median"),
         )
-        with open(download_path, "rb") as f:
-            data = pickle.load(f)
-
-        X = pd.get_dummies(data["data"])
-        y = np.array([1 if d == ">50K" else 0 for d in data["target"]])
-        run.finish()
-        return [{"X": X, "y": y}]
 
     def run_task(self, **kwargs) -> Any:
         """Job内で実行するタスクの内容を記述.
@@ -111,26 +156,11 @@ class MyFlowLogic(BaseFlowLogic):
         Returns:
             Any: タスク実行結果. create_resultへの入力となる.
         """
-        self.run = wandb.init(
-            project=self.cfg["project"],
-            group=self.cfg["group"],
-            job_type=self.cfg["jobtype"],
-            name="run-tasks",
-            config=self.cfg,
-        )
-        study_name = self.cfg["project"]
-        if self.cfg["group"]:
-            study_name += "-" + self.cfg["group"]
-        if self.cfg["jobtype"]:
-            study_name += "-" + self.cfg["jobtype"]
-        study_name += f"-{self.cfg['flow_logic']}-{self.cfg['params']['dataset']}"
-        study = optuna.create_study(
-            direction="maximize",
-            study_name=study_name,
-        )
-        study.optimize(self.objective_vr(kwargs["X"], kwargs["y"]), n_trials=100)
-
-        return study
+        folds = self.make_folds(kwargs["X"], kwargs["y"])
+        with ThreadPoolExecutor(max_workers=self.threads_per_worker) as executor:
+            return self.optimize_study(
+                kwargs["study"], self.objective_vr(folds, executor)
+            )
 
     async def create_result(self, result_set: list[Any]) -> None:
         """Job内でタスク実行後にwandbに出力する.
@@ -139,14 +169,8 @@ class MyFlowLogic(BaseFlowLogic):
             List[Any]: run_taskの出力をまとめたものが渡される.
         """
         # https://optuna.readthedocs.io/en/stable/tutorial/10_key_features/005_visualization.html#visualization
-        self.run = wandb.init(
-            project=self.cfg["project"],
-            group=self.cfg["group"],
-            job_type=self.cfg["jobtype"],
-            name="create-result",
-            config=self.cfg,
-        )
-        study = result_set[0]
+        # 全タスクの試行は共有のstudyに記録されている
+        study = self.load_study(result_set[0])
         importance_fig = optuna.visualization.plot_param_importances(
             study=study,
             params=["gb_max_depth", "gb_min_samples_split"],
@@ -155,12 +179,11 @@ class MyFlowLogic(BaseFlowLogic):
             study=study,
             params=["gb_max_depth", "gb_min_samples_split"],
         )
-        self.run.log(
+        self.log(
             {
                 "importance plot": wandb.Plotly(importance_fig),
                 "contour plot": wandb.Plotly(contour_fig),
             }
         )
-        self.run.finish()
 
         return None